@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+Benchmark the opening, decoding and loading of every dataset in `data/registry.txt`.
+
+Each file is benchmarked in a fresh process, so that its peak resident memory is measured in isolation.
+For every file, the script times the raw open (no CF decoding), the CF decoding of the metadata
+(including the decoding of times, with cftime for non-standard calendars) and the full `.load()`.
+Results are written to a JSON file that can be compared against the results of another commit.
+
+Requires xarray and a NetCDF backend (netCDF4 or h5netcdf).
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Optional, Union
+
+from report_check_sums import read_registry
+
+STAGES = ("open", "decode", "load")
+
+
+def _peak_rss() -> int:
+    """Return the peak resident memory of the current process, in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def benchmark_file(filename: str, repeat: int = 5, warmup: int = 1) -> dict:
+    """Time the open, metadata decoding and full load of a dataset.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the file.
+    repeat : int
+        Number of timed repetitions.
+    warmup : int
+        Number of untimed repetitions run first.
+
+    Returns
+    -------
+    dict
+        The timings of each stage (in seconds), the resident memory after importing xarray
+        and the peak resident memory (in bytes).
+    """
+    import xarray as xr
+
+    # Memory used by the interpreter and the imported libraries, before opening anything
+    import_rss = _peak_rss()
+    timings = {stage: [] for stage in STAGES}
+    for i in range(warmup + repeat):
+        start = time.perf_counter()
+        raw = xr.open_dataset(filename, decode_cf=False, cache=False)
+        opened = time.perf_counter()
+        ds = xr.decode_cf(raw)
+        decoded = time.perf_counter()
+        ds.load()
+        loaded = time.perf_counter()
+        ds.close()
+        raw.close()
+        if i >= warmup:
+            timings["open"].append(opened - start)
+            timings["decode"].append(decoded - opened)
+            timings["load"].append(loaded - decoded)
+
+    result = {
+        stage: dict(
+            min=min(values),
+            median=statistics.median(values),
+            max=max(values),
+        )
+        for stage, values in timings.items()
+    }
+    result["import_rss"] = import_rss
+    result["peak_rss"] = _peak_rss()
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    patterns: Optional[list[str]] = None,
+    registry: Union[str, Path] = "data/registry.txt",
+    repeat: int = 5,
+    warmup: int = 1,
+) -> dict:
+    """Benchmark the registered NetCDF files, each in its own process.
+
+    Parameters
+    ----------
+    patterns : list of str, optional
+        Glob patterns of the files to benchmark, relative to `data/`. Defaults to all NetCDF files.
+    registry : str or Path
+        The registry file.
+    repeat : int
+        Number of timed repetitions.
+    warmup : int
+        Number of untimed repetitions run first.
+    """
+    import xarray as xr
+
+    registry = Path(registry)
+    names = [
+        name
+        for name in sorted(read_registry(registry))
+        if name.endswith(".nc")
+        and (not patterns or any(fnmatch(name, pattern) for pattern in patterns))
+    ]
+
+    results = dict()
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        file = registry.parent.joinpath(name)
+        if not file.exists():
+            print(f"Skipping missing file: {name}")
+            continue
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[name] = executor.submit(
+                benchmark_file, file.as_posix(), repeat, warmup
+            ).result()
+        print(
+            f"{name}: "
+            + ", ".join(
+                f"{stage} {results[name][stage]['median'] * 1000:.1f} ms"
+                for stage in STAGES
+            )
+            + f", peak RSS {results[name]['peak_rss'] / 2**20:.1f} MiB"
+        )
+
+    return dict(
+        commit=_git_commit(),
+        python=platform.python_version(),
+        xarray=xr.__version__,
+        repeat=repeat,
+        warmup=warmup,
+        results=results,
+    )
+
+
+def compare(current: dict, baseline: dict, threshold: float = 1.25) -> list[str]:
+    """Return the files whose median timings or peak memory regressed beyond a threshold.
+
+    Parameters
+    ----------
+    current : dict
+        The results of the current commit.
+    baseline : dict
+        The results to compare against.
+    threshold : float
+        Ratio of current over baseline above which a measure is considered a regression.
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratios = {
+            stage: result[stage]["median"] / max(base[stage]["median"], 1e-9)
+            for stage in STAGES
+        }
+        ratios["peak_rss"] = result["peak_rss"] / max(base["peak_rss"], 1)
+        for measure, ratio in ratios.items():
+            if ratio > threshold:
+                regressions.append(f"{name}: {measure} x{ratio:.2f}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark opening, decoding and loading the datasets of data/registry.txt."
+    )
+    parser.add_argument(
+        "patterns",
+        nargs="*",
+        help="Glob patterns of the files to benchmark, relative to data/ (e.g. 'sdba/*').",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("-o", "--output", default="benchmark_datasets.json")
+    parser.add_argument(
+        "--compare",
+        metavar="BASELINE",
+        help="Results of another commit to compare with. Exits with 1 on regressions.",
+    )
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1.")
+    if args.warmup < 0:
+        parser.error("--warmup cannot be negative.")
+
+    output = run_benchmarks(args.patterns, repeat=args.repeat, warmup=args.warmup)
+    with Path(args.output).open("w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(
+        f"Successfully wrote results for {len(output['results'])} files to {args.output}."
+    )
+
+    if args.compare:
+        with Path(args.compare).open(encoding="utf-8") as f:
+            regressions = compare(output, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+Package the registered files into a single uncompressed, indexed bundle.
+
+The bundle starts with an 8-byte magic string, followed by every file of `data/registry.txt` (and the registry itself)
+stored uncompressed, each member starting on a 4096-byte boundary. It ends with a JSON index of the members
+(offset, size and sha256), followed by the offset of that index (little-endian uint64) and the magic string again.
+A copy of the index, with the sha256 of the whole bundle, is also written next to it (`{bundle}.index.json`),
+so that consumers can fetch and check it before downloading the bundle.
+
+Consumers download a single artifact, verify it, and open its members in place through a memory map,
+without extracting them:
+
+    with Bundle("xclim-testdata.bundle") as bundle:
+        ds = xr.open_dataset(bundle.open("sdba/CanESM2_1950-2100.nc"), engine="h5netcdf")
+"""
+import argparse
+import hashlib
+import io
+import json
+import mmap
+import struct
+import sys
+import weakref
+from pathlib import Path
+from typing import Optional, Union
+
+from report_check_sums import CHUNK_SIZE, file_sha256_checksum, read_registry
+
+MAGIC = b"XCTDBND1"
+ALIGNMENT = 4096
+_TRAILER = struct.Struct(f"<Q{len(MAGIC)}s")
+
+
+def build_bundle(
+    registry: Union[str, Path] = "data/registry.txt",
+    output: Union[str, Path] = "dist/xclim-testdata.bundle",
+) -> dict:
+    """Write the bundle of the registered files and its index.
+
+    Parameters
+    ----------
+    registry : str or Path
+        The registry file. Files are checked against it while they are copied.
+    output : str or Path
+        The bundle to write. The index is written to `{output}.index.json`.
+
+    Returns
+    -------
+    dict
+        The index of the bundle.
+    """
+    registry = Path(registry)
+    data_folder = registry.parent
+    entries = read_registry(registry)
+    entries[registry.name] = f"sha256:{file_sha256_checksum(registry)}"
+
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    members = dict()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with output.open("wb") as out:
+        out.write(MAGIC)
+        for name in sorted(entries):
+            file = data_folder.joinpath(name)
+            if not file.exists():
+                print(f"Skipping missing file: {name}")
+                continue
+            out.write(b"\0" * (-out.tell() % ALIGNMENT))
+            offset = out.tell()
+            h = hashlib.sha256()
+            with file.open("rb", buffering=0) as f:
+                while n := f.readinto(buffer):
+                    h.update(view[:n])
+                    out.write(view[:n])
+            if entries[name] != f"sha256:{h.hexdigest()}":
+                raise ValueError(f"Checksum of {name} does not match the registry.")
+            members[name] = dict(
+                offset=offset, size=out.tell() - offset, sha256=h.hexdigest()
+            )
+
+        index = dict(format=1, alignment=ALIGNMENT, members=members)
+        index_offset = out.tell()
+        out.write(json.dumps(index, sort_keys=True).encode("utf-8"))
+        out.write(_TRAILER.pack(index_offset, MAGIC))
+
+    index.update(size=output.stat().st_size, sha256=file_sha256_checksum(output))
+    with Path(f"{output}.index.json").open("w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    print(
+        f"Successfully wrote {len(members)} files to {output} ({index['size']} bytes)."
+    )
+    return index
+
+
+class _MemberIO(io.RawIOBase):
+    """Read-only, seekable file object over a memory view, released when the file is closed."""
+
+    def __init__(self, view: memoryview, on_close=None):
+        self._view = view
+        self._pos = 0
+        self._on_close = on_close
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+            if self._on_close is not None:
+                self._on_close(self)
+        super().close()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}
+        self._pos = max(0, base[whence] + offset)
+        return self._pos
+
+    def readinto(self, b) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        data = self._view[self._pos : self._pos + len(b)]
+        n = len(data)
+        memoryview(b).cast("B")[:n] = data
+        self._pos += n
+        return n
+
+
+class Bundle:
+    """Memory-mapped, read-only access to the members of a bundle.
+
+    Closing the bundle closes the file objects opened over its members. Views returned by `member` must be
+    released first.
+
+    Parameters
+    ----------
+    path : str or Path
+        The bundle file.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        # File objects opened over the members, closed with the bundle
+        self._members = weakref.WeakSet()
+        self._file = Path(path).open("rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        if self._view[: len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a test data bundle.")
+        index_offset, magic = _TRAILER.unpack(self._view[-_TRAILER.size :])
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is truncated.")
+        self.index = json.loads(
+            bytes(self._view[index_offset : len(self._view) - _TRAILER.size])
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close the file objects opened over the members and release the memory map.
+
+        Raises
+        ------
+        BufferError
+            If views returned by `member` are still in use.
+        """
+        for member in list(self._members):
+            member.close()
+        if getattr(self, "_view", None) is not None:
+            self._view.release()
+            self._view = None
+        if getattr(self, "_mmap", None) is not None:
+            try:
+                self._mmap.close()
+            except BufferError as err:
+                raise BufferError(
+                    "Cannot close the bundle while views of its members are in use: "
+                    "release the views returned by `Bundle.member` first."
+                ) from err
+            self._mmap = None
+        self._file.close()
+
+    @property
+    def names(self) -> list[str]:
+        """Names of the members, relative to `data/`."""
+        return list(self.index["members"])
+
+    def member(self, name: str) -> memoryview:
+        """Return a zero-copy view of the bytes of a member."""
+        entry = self.index["members"][name]
+        return self._view[entry["offset"] : entry["offset"] + entry["size"]]
+
+    def open(self, name: str) -> io.BufferedReader:
+        """Return a read-only file object over a member, without copying it. It is closed with the bundle."""
+        member = _MemberIO(self.member(name), self._members.discard)
+        self._members.add(member)
+        return io.BufferedReader(member)
+
+    def verify(self, names: Optional[list[str]] = None) -> list[str]:
+        """Return the names of the members whose sha256 does not match the index.
+
+        Parameters
+        ----------
+        names : list of str, optional
+            The members to check. Defaults to all members.
+        """
+        return [
+            name
+            for name in names or self.names
+            if hashlib.sha256(self.member(name)).hexdigest()
+            != self.index["members"][name]["sha256"]
+        ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Package the files of data/registry.txt into a single indexed bundle."
+    )
+    parser.add_argument("--registry", default="data/registry.txt")
+    parser.add_argument("-o", "--output", default="dist/xclim-testdata.bundle")
+    parser.add_argument(
+        "--verify",
+        metavar="BUNDLE",
+        help="Check the members of an existing bundle instead. Exits with 1 on any mismatch.",
+    )
+    args = parser.parse_args()
+    if args.verify:
+        with Bundle(args.verify) as bundle:
+            corrupted = bundle.verify()
+        for name in corrupted:
+            print(f"Checksum mismatch: {name}")
+        sys.exit(1 if corrupted else 0)
+    build_bundle(args.registry, args.output)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""
+Benchmark `construct_era5_daily_cancities.py` offline, against a synthetic stand-in of the converted ERA5 archive.
+
+The archive is written with `synthesize_era5_archive.py` (and reused between runs), then the builder is run in a
+subprocess, in a temporary folder, with empty checkpoints, so that every stage computes all its slices. The wall time,
+dask task count, peak memory, spilled memory and disk reads of each stage are taken from the `profile.json` written
+by the builder, and the variables of the output file are listed, so that a broken stage is caught as well as a slow
+one. With `--repeat`, the stage timings are the medians of the runs and the memory and disk reads their maxima.
+The disk reads are the bytes read from storage. The archive is evicted from the page cache before each run, so that
+its reads are counted even just after it was written, and every run reads it from disk. Where this is not possible
+(without `posix_fadvise`, e.g. on Windows and macOS), the reads served from the page cache are not counted.
+
+Requires the dependencies of the builder (xclim==0.40, dask.distributed, ...).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+from synthesize_era5_archive import synthesize_archive
+
+BUILDER = Path(__file__).parent.joinpath("construct_era5_daily_cancities.py")
+
+
+def drop_page_cache(folder: Path) -> bool:
+    """Evict the files of a folder from the page cache, so that the next reads of them come from the disk.
+
+    Parameters
+    ----------
+    folder : Path
+        The folder, e.g. the synthetic archive.
+
+    Returns
+    -------
+    bool
+        False if the platform cannot evict files from the page cache.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for file in folder.rglob("*"):
+        if file.is_file():
+            fd = os.open(file, os.O_RDONLY)
+            try:
+                # Pages that are not written yet, e.g. of a store that was just written, cannot be evicted
+                os.fsync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+    return True
+
+
+def run_builder(
+    archive: Path,
+    years: list[int],
+    workdir: Path,
+    builder: Path = BUILDER,
+    options: Optional[list[str]] = None,
+) -> dict:
+    """Run the builder once, with empty checkpoints, and return its profile.
+
+    Parameters
+    ----------
+    archive : Path
+        The folder holding the (synthetic) converted archive.
+    years : list of int
+        The first and last years to build.
+    workdir : Path
+        Folder in which the builder runs and writes its output, checkpoints and reports.
+    builder : Path
+        The builder script.
+    options : list of str, optional
+        Other arguments passed to the builder (e.g. `--points`, `--workers 2`).
+
+    Returns
+    -------
+    dict
+        The wall time of the run, the profile of each stage and the variables of the output file.
+
+    Raises
+    ------
+    RuntimeError
+        If the builder fails.
+    """
+    import xarray as xr
+
+    command = [
+        sys.executable,
+        str(Path(builder).resolve()),
+        str(Path(archive).resolve()),
+        "--years",
+        str(years[0]),
+        str(years[-1]),
+        "--checkpoints",
+        "checkpoints",
+        "--grid-cache",
+        "grid",
+        "--report-dir",
+        "report",
+        *(options or []),
+    ]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=workdir, capture_output=True, text=True)
+    wall_time = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"The builder failed:\n{result.stderr[-5000:]}")
+
+    with workdir.joinpath("report", "profile.json").open(encoding="utf-8") as f:
+        profile = json.load(f)
+    output = workdir.joinpath(f"daily_surface_cancities_{years[0]}-{years[-1]}.nc")
+    with xr.open_dataset(output) as ds:
+        variables = sorted(ds.data_vars)
+        sizes = dict(ds.sizes)
+    return dict(
+        wall_time=wall_time,
+        stages=profile["stages"],
+        tasks=(profile["task_stream"] or {}).get("tasks"),
+        output=dict(size=output.stat().st_size, sizes=sizes, variables=variables),
+    )
+
+
+def summarize(runs: list[dict]) -> dict:
+    """Return the median wall times and the maximal memory, tasks and disk reads of each stage over several runs."""
+    stages = dict()
+    for name in runs[0]["stages"]:
+        profiles = [run["stages"][name] for run in runs]
+        stages[name] = dict(
+            wall_time=statistics.median(p["wall_time"] for p in profiles),
+            peak_memory=max(p["peak_memory"] for p in profiles),
+            spilled=max(p["spilled"] for p in profiles),
+            tasks=max(p.get("tasks", 0) for p in profiles),
+            disk_read=max(p.get("disk_read", 0) for p in profiles),
+        )
+    return dict(
+        wall_time=statistics.median(run["wall_time"] for run in runs),
+        stages=stages,
+        output=runs[-1]["output"],
+    )
+
+
+def benchmark(
+    archive: Union[str, Path],
+    years: list[int],
+    resolution: float = 2.5,
+    seed: int = 0,
+    repeat: int = 1,
+    builder: Union[str, Path] = BUILDER,
+    options: Optional[list[str]] = None,
+) -> dict:
+    """Write the synthetic archive if needed, and benchmark the builder against it.
+
+    Parameters
+    ----------
+    archive : str or Path
+        The folder of the synthetic archive. Missing stores are written first.
+    years : list of int
+        The first and last years to build.
+    resolution : float
+        The resolution of the grid of the synthetic archive, in degrees.
+    seed : int
+        Seed of the synthetic archive.
+    repeat : int
+        Number of runs of the builder.
+    builder : str or Path
+        The builder script.
+    options : list of str, optional
+        Other arguments passed to the builder.
+
+    Returns
+    -------
+    dict
+        The settings, the summary over all runs and the profile of each run.
+    """
+    archive = Path(archive)
+    years = list(range(years[0], years[-1] + 1))
+    written = synthesize_archive(archive, years, resolution, seed)
+    print(f"Wrote {len(written)} stores of the synthetic archive in {archive}.")
+
+    runs = []
+    for i in range(repeat):
+        if not drop_page_cache(archive) and not i:
+            print(
+                "Warning: the archive cannot be evicted from the page cache on this platform, "
+                "the disk reads do not count the parts of it that are cached (e.g. just after it was written)."
+            )
+        with tempfile.TemporaryDirectory(prefix="era5_benchmark_") as workdir:
+            runs.append(run_builder(archive, years, Path(workdir), builder, options))
+        print(f"Run {i + 1}/{repeat}: {runs[-1]['wall_time']:.1f} s")
+    return dict(
+        years=years,
+        resolution=resolution,
+        seed=seed,
+        options=options or [],
+        summary=summarize(runs),
+        runs=runs,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark construct_era5_daily_cancities.py against a synthetic stand-in of the converted ERA5 archive. "
+            "Unknown arguments (e.g. --points, --workers 2) are passed to the builder."
+        )
+    )
+    parser.add_argument(
+        "--archive",
+        type=Path,
+        default=Path(".era5_synthetic"),
+        help="Folder of the synthetic archive, written if needed and reused between runs.",
+    )
+    parser.add_argument(
+        "--years",
+        nargs=2,
+        type=int,
+        default=[1990, 1991],
+        metavar=("START", "END"),
+        help="First and last years to build (default: 1990 1991).",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=float,
+        default=2.5,
+        help="Resolution of the grid of the synthetic archive, in degrees (default: 2.5).",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--builder",
+        type=Path,
+        default=BUILDER,
+        help="The builder script to benchmark (default: construct_era5_daily_cancities.py).",
+    )
+    parser.add_argument("-o", "--output", default="benchmark_era5_builder.json")
+    args, options = parser.parse_known_args()
+
+    results = benchmark(
+        args.archive,
+        args.years,
+        args.resolution,
+        args.seed,
+        args.repeat,
+        args.builder,
+        options,
+    )
+    summary = results["summary"]
+    print(
+        f"{'stage':<10} {'time (s)':>9} {'tasks':>7} {'memory (MiB)':>13} {'disk read (MiB)':>16}"
+    )
+    for name, stage in summary["stages"].items():
+        print(
+            f"{name:<10} {stage['wall_time']:>9.2f} {stage['tasks']:>7} "
+            f"{stage['peak_memory'] / 2**20:>13.1f} {stage['disk_read'] / 2**20:>16.1f}"
+        )
+    print(
+        f"Total: {summary['wall_time']:.1f} s, "
+        f"{len(summary['output']['variables'])} output variables."
+    )
+    with Path(args.output).open("w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Successfully wrote the benchmark to {args.output}.")
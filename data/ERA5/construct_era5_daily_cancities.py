@@ -8,83 +8,203 @@ is computed or it is ensured that needed base variables are given here. For exam
 
 Some of those extra variables are computed here but not included in the final output.
 
+The dataset is built in stages: gather the zarr stores, extract the cities, aggregate the hourly variables to daily
+values, derive the output variables and assemble the output file. The result of each stage is checkpointed in one file
+per (variable, year), along the cities, each keyed by a hash of its inputs and parameters (see `--checkpoints`), so that
+adding a city, a year or a variable only computes the new slices.
+
+Without access to the converted archive, `synthesize_era5_archive.py` writes a small stand-in with the same layout, and
+`benchmark_era5_builder.py` runs this script against it and reports the cost of each stage.
+
 Requires xclim==0.40 and data converted with miranda>=0.3.0
 
 Author: Pascal Bourgault, 2021
 Revised: Trevor James Smith, 2023
 """
+import argparse
+import csv
 import datetime as dt
+import functools
+import hashlib
+import inspect
+import json
 import logging
+import os
+import pickle
+import resource
 import sys
+import time
+import warnings
+from collections import Counter
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
+from typing import Callable, Optional
 
+import dask.array
+import numpy as np
 import xarray as xr
 import xclim as xc
-from dask import compute
-from dask.distributed import Client
+from dask.callbacks import Callback
+from dask.distributed import Client, get_task_stream, performance_report
+from dask.utils import key_split, parse_bytes
+from distributed.diagnostics import MemorySampler
 from numpy import arctan2, cos, sin
+from scipy.spatial import cKDTree
 from xclim.core import formatting
 from xclim.core.units import convert_units_to
 
 logging.basicConfig(level=logging.INFO)
 
-if len(sys.argv) == 2:
-    base_path = Path(sys.argv[-1])
-else:
-    base_path = Path().cwd()
+glob_files = "{variable}_{time}_ecmwf_era5-single-levels_NAM_{year}*.zarr"
 
-# Base Path for converted ERA5
-NAMpath = base_path.joinpath("datasets/reconstruction/ECMWF/ERA5/NAM/{time}")
-glob_files = "{variable}_{time}_ecmwf_era5-single-levels_NAM_199{y}*.zarr"
+# Daily reductions of hourly values, skipping NaNs as `resample(time="D")` does. "first" is the value at 00:00.
+REDUCTIONS = {
+    "mean": np.nanmean,
+    "min": np.nanmin,
+    "max": np.nanmax,
+    "sum": np.nansum,
+    "first": lambda days, axis: np.take(days, 0, axis=axis),
+}
 
-# Protect dask's threading
-if __name__ == "__main__":
-    logging.info("Starting the construction of ERA5 daily_cancities dataset")
-    logging.info(f"Will use data found in {NAMpath.parent.as_posix()}")
-    # Uses the threads, but not that much memory
-    c = Client(
-        n_workers=6, threads_per_worker=6, dashboard_address=8786, memory_limit="5GB"
-    )
+# Daily variable: (hourly variable, reduction), used when the daily variable is not given by ERA5
+DAILY_FROM_HOURLY = {
+    "tas": ("tas", "mean"),
+    "tasmin": ("tas", "min"),
+    "tasmax": ("tas", "max"),
+    "pr": ("pr", "mean"),
+    "evspsblpot": ("evspsblpot", "mean"),
+    "prsn": ("prsn", "mean"),
+    "snw": ("snw", "mean"),
+    "snr": ("snr", "mean"),
+    "snd": ("snd", "mean"),
+    "sfcWind": ("windmag", "mean"),
+    "sfcWindmax": ("windmag", "max"),
+    "ps": ("ps", "mean"),
+    "psl": ("psl", "mean"),
+    "tdps": ("tdps", "mean"),
+    "rlds": ("rlds", "mean"),
+    "rls": ("rls", "mean"),
+    "rsds": ("rsds", "mean"),
+    "rss": ("rss", "mean"),
+}
 
-    gather = dict()
-    gather["1hr"] = []
-    gather["day"] = []
+# Hourly variables computed from other hourly variables before their aggregation
+HOURLY_INPUTS = {"windmag": ("uas", "vas"), "sunny": ("rsds",)}
 
-    for freq, files in gather.items():
-        logging.info(f"Gathering {freq} files.")
-        for variable_folder in Path(NAMpath.as_posix().format(time=freq)).iterdir():
-            variable = variable_folder.name
-            fpath = Path(NAMpath.as_posix().format(time=freq)).joinpath(variable)
-            if fpath.exists():
-                logging.info(f"Found {freq} folders for {variable}.")
-                for y in range(4):
-                    files.extend(
-                        list(
-                            fpath.glob(
-                                (glob_files.format(time=freq, variable=variable, y=y))
-                            )
-                        )
-                    )
+# Variables of the output file
+OUTPUT_VARIABLES = (
+    "evspsblpot",
+    "hurs",
+    "huss",
+    "pr",
+    "prsn",
+    "ps",
+    "psl",
+    "rlds",
+    "rls",
+    "rsds",
+    "rss",
+    "sfcWind",
+    "sfcWindfromdir",
+    "snd",
+    "snw",
+    "sund",
+    "swe",
+    "tas",
+    "tasmax",
+    "tasmin",
+    "tdps",
+    "uas",
+    "vas",
+    "sfcWindmax",
+)
 
-    raw_hrly_nam = xr.open_mfdataset(
-        gather["1hr"],
-        chunks={"time": 2928, "latitude": 25, "longitude": 50},
-        engine="zarr",
-    )
-    raw_dly_nam = xr.open_mfdataset(
-        gather["day"],
-        chunks={"time": 2928, "latitude": 25, "longitude": 50},
-        engine="zarr",
-    )
 
+def _reduce_days(block: np.ndarray, reductions: tuple[str, ...]) -> np.ndarray:
+    """Reduce an hourly block, with time as the last axis, to daily values for all reductions at once."""
+    days = block.reshape(*block.shape[:-1], -1, 24)
+    with warnings.catch_warnings():
+        # Days without any valid value are NaN, as with `resample`
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.stack([REDUCTIONS[r](days, axis=-1) for r in reductions])
+
+
+def daily_aggregate(
+    hrly: xr.Dataset, spec: dict[str, list[str]]
+) -> dict[str, dict[str, xr.DataArray]]:
+    """Compute all requested daily reductions of hourly variables in a single pass over each chunk.
+
+    Instead of one `resample(time="D")` per variable and reduction, each hourly chunk is reduced once for all the
+    reductions of its variable, which adds a single layer per variable to the dask graph.
+
+    Parameters
+    ----------
+    hrly : xr.Dataset
+        Hourly data, starting at 00:00 and covering whole days.
+    spec : dict
+        Mapping of hourly variables to the list of reductions to compute ("mean", "min", "max" or "sum").
+
+    Returns
+    -------
+    dict
+        Mapping of variables to a mapping of reductions to daily DataArrays.
+    """
+    if hrly.time.size % 24 or hrly.time[0].dt.hour != 0:
+        raise ValueError("Hourly data must start at 00:00 and cover whole days.")
+    time = hrly.time[::24].dt.floor("D")
+
+    out = dict()
+    for name, reductions in spec.items():
+        reductions = tuple(reductions)
+        da = hrly[name].transpose(..., "time")
+        data = da.data
+        if not isinstance(data, dask.array.Array):
+            data = dask.array.from_array(data, chunks=-1)
+        # Chunks must hold whole days
+        if any(c % 24 for c in data.chunks[-1]):
+            data = data.rechunk({data.ndim - 1: 24 * max(data.chunks[-1][0] // 24, 1)})
+        dtype = _reduce_days(np.zeros((24,), dtype=data.dtype), reductions).dtype
+        daily = data.map_blocks(
+            _reduce_days,
+            reductions,
+            chunks=(
+                (len(reductions),),
+                *data.chunks[:-1],
+                tuple(c // 24 for c in data.chunks[-1]),
+            ),
+            new_axis=0,
+            dtype=dtype,
+        )
+        coords = {k: v for k, v in da.coords.items() if "time" not in v.dims}
+        out[name] = {
+            reduction: xr.DataArray(
+                daily[i],
+                dims=da.dims,
+                coords=dict(coords, time=time),
+                attrs=da.attrs,
+                name=name,
+            ).transpose(*hrly[name].dims)
+            for i, reduction in enumerate(reductions)
+        }
+    return out
+
+
+# KD-trees of the grids already seen in this run, keyed by the hash of their coordinates
+_GRID_INDEXES = dict()
+
+
+def station_coordinates(
+    names: list[str], lons: list[float], lats: list[float]
+) -> tuple[xr.DataArray, xr.DataArray]:
+    """Return the longitude and latitude of stations, along a `location` dimension."""
     location = xr.DataArray(
-        ["Halifax", "Montréal", "Iqaluit", "Saskatoon", "Victoria"],
+        names,
         dims=("location",),
         name="location",
         attrs={"long_name": "City"},
     )
     lon = xr.DataArray(
-        [-63.5, -73.5, -68.5, -106.75, -123.25],
+        lons,
         dims=("location",),
         coords={"location": location},
         attrs={
@@ -94,7 +214,7 @@ if __name__ == "__main__":
         },
     )
     lat = xr.DataArray(
-        [44.5, 45.5, 63.75, 52.0, 48.5],
+        lats,
         dims=("location",),
         coords={"location": location},
         attrs={
@@ -103,28 +223,380 @@ if __name__ == "__main__":
             "long_name": "latitude",
         },
     )
+    return lon, lat
+
+
+def read_stations(filename: Path) -> tuple[xr.DataArray, xr.DataArray]:
+    """Read the names and coordinates of stations from a CSV or GeoJSON file.
+
+    CSV files need a `name` (or `location`) column and `lat`/`lon` (or `latitude`/`longitude`) columns.
+    GeoJSON files must hold a FeatureCollection of points with a `name` (or `location`) property.
+    """
+    names, lons, lats = [], [], []
+    if filename.suffix.lower() in (".geojson", ".json"):
+        with filename.open(encoding="utf-8") as f:
+            for feature in json.load(f)["features"]:
+                props = feature["properties"]
+                names.append(props.get("name", props.get("location")))
+                lons.append(float(feature["geometry"]["coordinates"][0]))
+                lats.append(float(feature["geometry"]["coordinates"][1]))
+    else:
+        with filename.open(encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                row = {k.strip().lower(): v for k, v in row.items()}
+                names.append(row.get("name", row.get("location")))
+                lons.append(float(row.get("lon", row.get("longitude"))))
+                lats.append(float(row.get("lat", row.get("latitude"))))
+    return station_coordinates(names, lons, lats)
+
+
+def _unit_vectors(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Return the cartesian coordinates of points on the unit sphere."""
+    lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+    return np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1
+    )
+
+
+def grid_index(
+    lat: np.ndarray, lon: np.ndarray, cache_dir: Optional[Path] = None
+) -> cKDTree:
+    """Return a KD-tree of the cells of a lat/lon grid, on the unit sphere.
+
+    The tree is kept in memory and, if `cache_dir` is given, pickled to disk between runs,
+    keyed by a hash of the grid coordinates.
+    """
+    key = hashlib.sha256(
+        np.asarray(lat, dtype="f8").tobytes() + np.asarray(lon, dtype="f8").tobytes()
+    ).hexdigest()[:16]
+    if key in _GRID_INDEXES:
+        return _GRID_INDEXES[key]
+
+    cached = cache_dir.joinpath(f"grid_index_{key}.pkl") if cache_dir else None
+    if cached is not None and cached.exists():
+        with cached.open("rb") as f:
+            tree = pickle.load(f)
+    else:
+        lat2d, lon2d = np.meshgrid(lat, lon, indexing="ij")
+        tree = cKDTree(_unit_vectors(lat2d.ravel(), lon2d.ravel()))
+        if cached is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            with cached.open("wb") as f:
+                pickle.dump(tree, f)
+    _GRID_INDEXES[key] = tree
+    return tree
+
+
+def nearest_cells(
+    ds: xr.Dataset,
+    lon: xr.DataArray,
+    lat: xr.DataArray,
+    cache_dir: Optional[Path] = None,
+) -> dict[str, xr.DataArray]:
+    """Return the `isel` indexers of the grid cells nearest to some points, matched in a single KD-tree query.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Data on a regular grid with `lat` and `lon` dimensions.
+    lon, lat : xr.DataArray
+        The coordinates of the points, along a common dimension.
+    cache_dir : Path, optional
+        Folder in which the KD-tree of the grid is cached between runs.
+    """
+    tree = grid_index(ds.lat.values, ds.lon.values, cache_dir)
+    _, flat = tree.query(_unit_vectors(lat.values, lon.values))
+    ilat, ilon = np.unravel_index(flat, (ds.lat.size, ds.lon.size))
+    return {
+        "lat": xr.DataArray(ilat, dims=lat.dims, coords=lat.coords),
+        "lon": xr.DataArray(ilon, dims=lon.dims, coords=lon.coords),
+    }
+
+
+def extract_points(
+    files: list[Path],
+    lon: xr.DataArray,
+    lat: xr.DataArray,
+    cache_dir: Optional[Path] = None,
+) -> xr.Dataset:
+    """Extract the grid cells nearest to some points, reading only the zarr chunks that contain them.
+
+    The nearest grid indices are first resolved from the coordinates. Each store is then indexed pointwise through
+    xarray's lazy backend arrays, without dask, so no full-domain graph is built and only the chunks holding the
+    points are read and decompressed.
+
+    Parameters
+    ----------
+    files : list of Path
+        The zarr stores, one per variable and period, all on the same grid.
+    lon, lat : xr.DataArray
+        The coordinates of the points, along a common dimension.
+    cache_dir : Path, optional
+        Folder in which the KD-tree of the grid is cached between runs.
+
+    Returns
+    -------
+    xr.Dataset
+        The merged data at the points, loaded in memory.
+    """
+    extracted = []
+    for file in files:
+        ds = xr.open_zarr(file, chunks=None)
+        extracted.append(ds.isel(nearest_cells(ds, lon, lat, cache_dir)).load())
+        ds.close()
+    return xr.combine_by_coords(extracted, compat="override", combine_attrs="override")
+
+
+def _hash(*parts) -> str:
+    """Return a short hash of JSON-serializable inputs and parameters."""
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+def _source_hash(*functions) -> str:
+    """Return a short hash of the source code of functions, so that editing them invalidates their checkpoints."""
+    return _hash(*(inspect.getsource(func) for func in functions))
+
+
+def _store_signature(store: Path) -> list:
+    """Return the name, size and modification time of the metadata of a zarr store."""
+    metadata = store.joinpath(".zmetadata")
+    stat = (metadata if metadata.exists() else store).stat()
+    return [store.name, stat.st_size, stat.st_mtime_ns]
+
+
+class Checkpoints:
+    """Stage outputs persisted as NetCDF files, one per (stage, variable, year), along a `location` dimension.
+
+    Each file is stored as `{folder}/{stage}/{variable}/{year}.nc`, with the key of each location, a hash of the inputs
+    and parameters of the stage there, in its `checkpoint_keys` attribute. A location is reused as long as its key is
+    unchanged, and recomputed otherwise. The locations of other runs, e.g. with other stations, are kept.
+
+    Parameters
+    ----------
+    folder : Path
+        The folder holding the checkpoints.
+    """
+
+    keys_attr = "checkpoint_keys"
 
-    hrly = raw_hrly_nam.sel(lon=lon, lat=lat, method="nearest")
-    dly = raw_dly_nam.sel(lon=lon, lat=lat, method="nearest")
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self.computed = Counter()
+        self.reused = Counter()
 
-    dly.lon.attrs.update(lon.attrs)
-    dly.lat.attrs.update(lat.attrs)
+    def _path(self, stage: str, variable: str, year: int) -> Path:
+        return self.folder.joinpath(stage, variable, f"{year}.nc")
 
-    # Variables computation
+    def _open(self, path: Path) -> tuple[Optional[xr.Dataset], dict[str, str]]:
+        """Return a checkpoint, opened lazily, and the keys of its locations."""
+        if not path.exists():
+            return None, dict()
+        ds = xr.open_dataset(path, chunks={})
+        return ds, json.loads(ds.attrs.pop(self.keys_attr, "{}"))
+
+    def get(
+        self,
+        stage: str,
+        variable: str,
+        year: int,
+        keys: dict[str, str],
+        compute: Callable[[list[str]], xr.Dataset],
+    ) -> xr.Dataset:
+        """Return the output of a stage at some locations, computing the ones without an up-to-date checkpoint.
+
+        The missing locations are computed together, with a single `load`, and written to the checkpoint with the
+        others.
+
+        Parameters
+        ----------
+        stage : str
+            The stage.
+        variable : str
+            The variable of the output.
+        year : int
+            The year of the output.
+        keys : dict
+            Mapping of the locations to the keys of their output.
+        compute : callable
+            Function returning the output at a list of locations, along a `location` dimension.
+
+        Returns
+        -------
+        xr.Dataset
+            The output at the locations of `keys`, in that order, opened lazily from the checkpoint.
+        """
+        path = self._path(stage, variable, year)
+        ds, stored = self._open(path)
+        missing = [
+            location for location, key in keys.items() if stored.get(location) != key
+        ]
+        self.reused[stage] += len(keys) - len(missing)
+        if missing:
+            kept = [location for location in stored if location not in missing]
+            parts = ([ds.sel(location=kept)] if kept else []) + [compute(missing)]
+            out = xr.concat(
+                parts,
+                "location",
+                coords="minimal",
+                compat="override",
+                combine_attrs="override",
+            ).load()
+            out.attrs[self.keys_attr] = json.dumps(
+                {location: stored[location] for location in kept}
+                | {location: keys[location] for location in missing}
+            )
+            if ds is not None:
+                ds.close()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            out.to_netcdf(path.with_suffix(".tmp"))
+            os.replace(path.with_suffix(".tmp"), path)
+            self.computed[stage] += len(missing)
+            ds, _ = self._open(path)
+        return ds.sel(location=list(keys))
+
+
+def gather_files(
+    nam_path: Path, years: list[int]
+) -> dict[str, dict[tuple[str, int], list[Path]]]:
+    """Return the zarr stores of each frequency, by (variable, year).
+
+    Parameters
+    ----------
+    nam_path : Path
+        The folder of the converted ERA5 data, with a `{time}` field for the frequency.
+    years : list of int
+        The years to gather.
+    """
+    gather = dict()
+    for freq in ("1hr", "day"):
+        logging.info(f"Gathering {freq} files.")
+        gather[freq] = dict()
+        for variable_folder in Path(nam_path.as_posix().format(time=freq)).iterdir():
+            variable = variable_folder.name
+            logging.info(f"Found {freq} folders for {variable}.")
+            for year in years:
+                files = sorted(
+                    variable_folder.glob(
+                        glob_files.format(time=freq, variable=variable, year=year)
+                    )
+                )
+                if files:
+                    gather[freq][(variable, year)] = files
+    return gather
+
+
+def extract_stage(
+    checkpoints: Checkpoints,
+    freq: str,
+    variable: str,
+    year: int,
+    files: list[Path],
+    lon: xr.DataArray,
+    lat: xr.DataArray,
+    points: bool = False,
+    grid_cache: Optional[Path] = None,
+) -> tuple[dict[str, str], xr.Dataset]:
+    """Extract the grid cells nearest to each location from the stores of a variable and year.
+
+    Only the locations without an up-to-date checkpoint are extracted, all in a single pass over the stores.
+
+    Parameters
+    ----------
+    checkpoints : Checkpoints
+        The checkpoints of the pipeline.
+    freq : str
+        The frequency of the stores ("1hr" or "day").
+    variable : str
+        The variable of the stores.
+    year : int
+        The year of the stores.
+    files : list of Path
+        The zarr stores.
+    lon, lat : xr.DataArray
+        The coordinates of the locations, along a `location` dimension.
+    points : bool
+        Whether to read only the chunks holding the locations, without dask, instead of the full domain.
+    grid_cache : Path, optional
+        Folder in which the KD-tree of the grid is cached between runs.
+
+    Returns
+    -------
+    dict
+        Mapping of the locations to the keys of their data.
+    xr.Dataset
+        The extracted data, along a `location` dimension.
+    """
+    stage = f"extract/{freq}"
+    signatures = [_store_signature(file) for file in files]
+    keys = {
+        location: _hash(stage, variable, year, signatures, location, float(x), float(y))
+        for location, x, y in zip(lon.location.values, lon.values, lat.values)
+    }
+
+    def extract(locations: list[str]) -> xr.Dataset:
+        x, y = lon.sel(location=locations), lat.sel(location=locations)
+        if points:
+            return extract_points(files, x, y, grid_cache)
+        raw = xr.open_mfdataset(
+            files,
+            chunks={"time": 2928, "latitude": 25, "longitude": 50},
+            engine="zarr",
+        )
+        return raw.isel(nearest_cells(raw, x, y, grid_cache))
+
+    return keys, checkpoints.get(stage, variable, year, keys, extract)
+
+
+def hourly_variable(name: str, hrly: xr.Dataset) -> xr.DataArray:
+    """Return an hourly variable to aggregate, computing the ones that are not given by ERA5."""
+    if name == "windmag":
+        windmag, _ = xc.atmos.wind_speed_from_vector(uas=hrly.uas, vas=hrly.vas)
+        return windmag
+    if name == "sunny":
+        return hrly.rsds > 120
+    return hrly[name]
+
+
+def _wind_from_hourly(day_variables: set[str]) -> bool:
+    """Return whether the wind variables are computed from the hourly wind vectors."""
+    return not {"uas", "vas", "sfcWind", "sfcWindmax"} <= day_variables
+
+
+def derive_variables(
+    dly: xr.Dataset, daily: dict[str, dict[str, xr.DataArray]]
+) -> dict[str, xr.DataArray]:
+    """Compute the output variables from the daily variables and the daily reductions of hourly variables.
+
+    Variables given by ERA5 at the daily frequency are used as is, the others are approximated.
+
+    Parameters
+    ----------
+    dly : xr.Dataset
+        The variables given at the daily frequency.
+    daily : dict
+        The daily reductions of hourly variables, as returned by `daily_aggregate` for `daily_spec`.
+
+    Returns
+    -------
+    dict
+        Mapping of the names of `OUTPUT_VARIABLES` to their values.
+    """
     # Loosely regrouped by thematics
 
     if "tas" not in dly.data_vars:
-        tas = hrly.tas.resample(time="D").mean()
+        tas = daily["tas"]["mean"]
     else:
         tas = dly.tas
 
     if "tasmin" not in dly.data_vars:
-        tasmin = hrly.tas.resample(time="D").min()
+        tasmin = daily["tas"]["min"]
     else:
         tasmin = dly.tasmin
 
     if "tasmax" not in dly.data_vars:
-        tasmax = hrly.tas.resample(time="D").max()
+        tasmax = daily["tas"]["max"]
     else:
         tasmax = dly.tasmax
 
@@ -149,7 +621,7 @@ if __name__ == "__main__":
 
     if "pr" not in dly.data_vars:
         # Total precip flux in kg m-2 s-1
-        pr = hrly.pr.resample(time="D").mean()
+        pr = daily["pr"]["mean"]
     else:
         pr = dly.pr
 
@@ -163,7 +635,7 @@ if __name__ == "__main__":
 
     if "evspsblpot" not in dly.data_vars:
         # Total Potential Evapotranspiration flux in kg m-2 s-1
-        evspsblpot = hrly.evspsblpot.resample(time="D").mean()
+        evspsblpot = daily["evspsblpot"]["mean"]
     else:
         evspsblpot = dly.evspsblpot
 
@@ -177,16 +649,16 @@ if __name__ == "__main__":
 
     if "prsn" not in dly.data_vars:
         # Total Solid Precipitation flux in kg m-2 s-1
-        prsn = hrly.prsn.resample(time="D").mean()
+        prsn = daily["prsn"]["mean"]
     else:
         prsn = dly.prsn
 
-    snw = hrly.snw.resample(time="D").mean() if "snw" not in dly.data_vars else dly.snw
+    snw = daily["snw"]["mean"] if "snw" not in dly.data_vars else dly.snw
     swe = snw / 1000
-    snr = hrly.snr.resample(time="D").mean() if "snr" not in dly.data_vars else dly.snr
+    snr = daily["snr"]["mean"] if "snr" not in dly.data_vars else dly.snr
     if "snd" not in dly.data_vars:
-        if "snd" in hrly.data_vars:
-            snd = hrly.snd.resample(time="D").mean()
+        if "snd" in daily:
+            snd = daily["snd"]["mean"]
         else:
             snd = snw / snr
     else:
@@ -218,16 +690,10 @@ if __name__ == "__main__":
     )
 
     uas, vas = None, None
-    if (
-        "uas" not in dly.data_vars
-        or "vas" not in dly.data_vars
-        or "sfcWind" not in dly.data_vars
-        or "sfcWindmax" not in dly.data_vars
-    ):
-        windmag_interim, _ = xc.atmos.wind_speed_from_vector(uas=hrly.uas, vas=hrly.vas)
-        sfcWind = windmag_interim.resample(time="D").mean()
-        sfcWindmax = windmag_interim.resample(time="D").max()
-        theta = arctan2(hrly.vas, hrly.uas)
+    if _wind_from_hourly(set(dly.data_vars)):
+        sfcWind = daily["windmag"]["mean"]
+        sfcWindmax = daily["windmag"]["max"]
+        theta = arctan2(daily["vas"]["first"], daily["uas"]["first"])
 
         uas = cos(theta) * sfcWind
         vas = sin(theta) * sfcWind
@@ -272,15 +738,15 @@ if __name__ == "__main__":
     )
 
     if "ps" not in dly.data_vars:
-        ps = hrly.ps.resample(time="D").mean()
+        ps = daily["ps"]["mean"]
     else:
         ps = dly.ps
 
     if "psl" not in dly.data_vars:
-        if "psl" not in hrly.data_vars:
+        if "psl" not in daily:
             psl = ps.copy()
         else:
-            psl = hrly.psl.resample(time="D").mean()
+            psl = daily["psl"]["mean"]
     else:
         psl = dly.psl
 
@@ -299,7 +765,7 @@ if __name__ == "__main__":
     )
 
     if "tdps" not in dly.data_vars:
-        tdps = hrly.tdps.resample(time="D").mean()
+        tdps = daily["tdps"]["mean"]
     else:
         tdps = dly.tdps
 
@@ -331,7 +797,7 @@ if __name__ == "__main__":
     )
 
     if "rlds" not in dly.data_vars:
-        rlds = hrly.rlds.tdps.resample(time="D").mean()
+        rlds = daily["rlds"]["mean"]
     else:
         rlds = dly.rlds
     rlds.attrs.update(
@@ -341,7 +807,7 @@ if __name__ == "__main__":
     )
 
     if "rls" not in dly.data_vars:
-        rls = hrly.rls.tdps.resample(time="D").mean()
+        rls = daily["rls"]["mean"]
     else:
         rls = dly.rls
     rlds.attrs.update(
@@ -351,7 +817,7 @@ if __name__ == "__main__":
     )
 
     if "rsds" not in dly.data_vars:
-        rsds = hrly.rsds.tdps.resample(time="D").mean()
+        rsds = daily["rsds"]["mean"]
     else:
         rsds = dly.rsds
     rsds.attrs.update(
@@ -361,7 +827,7 @@ if __name__ == "__main__":
     )
 
     if "rss" not in dly.data_vars:
-        rss = hrly.rss.tdps.resample(time="D").mean()
+        rss = daily["rss"]["mean"]
     else:
         rss = dly.rss
     rss.attrs.update(
@@ -370,43 +836,17 @@ if __name__ == "__main__":
         cell_methods="time: mean within days",
     )
 
-    sund = convert_units_to(
-        xc.core.units.to_agg_units(
-            (hrly.rsds > 120).resample(time="D").sum(), hrly.rsds, "count"
-        ),
-        "s",
-    )
+    # Number of sunny hours in each day
+    sunny = daily["sunny"]["sum"]
+    sunny.attrs["units"] = "h"
+    sund = convert_units_to(sunny, "s")
     sund.attrs.update(
         standard_name="duration_of_sunshine",
         long_name="Daily duration of sunshine",
         cell_methods="time: sum within days",
     )
 
-    logging.info("Preparing dataset")
-    ds = xr.Dataset(
-        coords={k: v for k, v in dly.coords.items() if k != "time"},
-        attrs={
-            "Conventions": "CF-1.9",
-            "history": formatting.update_history(
-                "Spatial extraction, daily aggregation and intermediate computation of raw ERA5 data.",
-                raw_dly_nam,
-            ),
-            "title": "xclim test dataset from ERA5",
-            "source": "reanalysis",
-            "comment": f"Contains modified Copernicus Climate ChangeService information {dt.date.today().year}",
-            "institution": "ECMWF",
-            "doi": "doi:10.24381/cds.adbb2d47",
-            "description": (
-                "Test dataset for xclim including all officially supported atmos variables that ERA5 can provide. "
-                "Intended for testing only, some intermediate variables are only rough approximations, "
-                "but they should have data in the right range and sequence. Approximated variables are flagged "
-                "as such in their description."
-            ),
-        },
-    )
-
-    # Here we choose which variables to include
-    ds = ds.assign(
+    return dict(
         evspsblpot=evspsblpot,
         hurs=hurs,
         huss=huss,
@@ -433,25 +873,574 @@ if __name__ == "__main__":
         sfcWindmax=sfcWindmax,
     )
 
+
+def daily_spec(day_variables: set[str], hourly_variables: set[str]) -> dict:
+    """Return the daily reductions of each hourly variable needed by `derive_variables`.
+
+    Parameters
+    ----------
+    day_variables : set of str
+        The variables given at the daily frequency.
+    hourly_variables : set of str
+        The variables given at the hourly frequency.
+    """
+    spec = {"sunny": ["sum"]}
+    if _wind_from_hourly(day_variables):
+        # The wind direction is taken from the first hourly vectors of each day
+        spec.update(uas=["first"], vas=["first"])
+    for name, (variable, reduction) in DAILY_FROM_HOURLY.items():
+        if variable == "windmag":
+            from_hourly = _wind_from_hourly(day_variables)
+        else:
+            from_hourly = name not in day_variables
+        if from_hourly and variable in hourly_variables | {"windmag"}:
+            spec.setdefault(variable, []).append(reduction)
+    return spec
+
+
+def aggregate_stage(
+    checkpoints: Checkpoints,
+    name: str,
+    reductions: list[str],
+    year: int,
+    hourly: dict[str, tuple[dict[str, str], xr.Dataset]],
+) -> tuple[dict[str, str], xr.Dataset]:
+    """Compute the daily reductions of an hourly variable at each location.
+
+    Parameters
+    ----------
+    checkpoints : Checkpoints
+        The checkpoints of the pipeline.
+    name : str
+        The hourly variable, as understood by `hourly_variable`.
+    reductions : list of str
+        The daily reductions to compute.
+    year : int
+        The year of the data.
+    hourly : dict
+        The keys and data of the extracted hourly variables of the year, by variable.
+
+    Returns
+    -------
+    dict
+        Mapping of the locations to the keys of their data.
+    xr.Dataset
+        The daily data, with one variable per reduction.
+    """
+    inputs = HOURLY_INPUTS.get(name, (name,))
+    code = _source_hash(hourly_variable, _reduce_days)
+    keys = {
+        location: _hash(
+            "aggregate",
+            name,
+            reductions,
+            [hourly[variable][0][location] for variable in inputs],
+            code,
+        )
+        for location in hourly[inputs[0]][0]
+    }
+
+    def aggregate(locations: list[str]) -> xr.Dataset:
+        hrly = xr.merge(
+            [hourly[variable][1].sel(location=locations) for variable in inputs],
+            compat="override",
+            combine_attrs="override",
+        )
+        da = hourly_variable(name, hrly)
+        daily = daily_aggregate(da.to_dataset(name=name), {name: reductions})
+        return xr.Dataset(daily[name])
+
+    return keys, checkpoints.get("aggregate", name, year, keys, aggregate)
+
+
+def derive_stage(
+    checkpoints: Checkpoints,
+    year: int,
+    day: dict[str, tuple[dict[str, str], xr.Dataset]],
+    aggregated: dict[str, tuple[dict[str, str], xr.Dataset]],
+) -> dict[str, tuple[dict[str, str], xr.Dataset]]:
+    """Compute the output variables of a year, from the daily data and the daily aggregates of hourly variables.
+
+    Parameters
+    ----------
+    checkpoints : Checkpoints
+        The checkpoints of the pipeline.
+    year : int
+        The year of the data.
+    day : dict
+        The keys and data of the extracted daily variables, by variable.
+    aggregated : dict
+        The keys and data of the daily aggregates of hourly variables, by variable.
+
+    Returns
+    -------
+    dict
+        Mapping of the output variables to the keys of their locations and their data.
+    """
+    sources = [*day.values(), *aggregated.values()]
+    inputs = {
+        location: sorted(keys[location] for keys, _ in sources)
+        for location in sources[0][0]
+    }
+    code = _source_hash(derive_variables)
+    derived = dict()
+
+    def derive(variable: str, locations: list[str]) -> xr.Dataset:
+        # All the variables are derived at once, usually for the same missing locations
+        if tuple(locations) not in derived:
+            dly = xr.merge(
+                [ds.sel(location=locations) for _, ds in day.values()],
+                compat="override",
+                combine_attrs="override",
+            ).load()
+            daily = {
+                name: {
+                    reduction: ds[reduction].sel(location=locations).load().rename(name)
+                    for reduction in ds.data_vars
+                }
+                for name, (_, ds) in aggregated.items()
+            }
+            derived[tuple(locations)] = derive_variables(dly, daily)
+        return derived[tuple(locations)][variable].to_dataset(name=variable)
+
+    outputs = dict()
+    for variable in OUTPUT_VARIABLES:
+        keys = {
+            location: _hash("derive", variable, location_inputs, code)
+            for location, location_inputs in inputs.items()
+        }
+        outputs[variable] = (
+            keys,
+            checkpoints.get(
+                "derive", variable, year, keys, functools.partial(derive, variable)
+            ),
+        )
+    return outputs
+
+
+def assemble_stage(
+    checkpoints: Checkpoints,
+    derived: dict[int, dict[str, tuple[dict[str, str], xr.Dataset]]],
+    output: Path,
+    lon: xr.DataArray,
+    lat: xr.DataArray,
+    history_sources: list[xr.Dataset],
+) -> bool:
+    """Write the output file from the derived variables, unless it is already up to date.
+
+    Parameters
+    ----------
+    checkpoints : Checkpoints
+        The checkpoints of the pipeline. The key of the last written output is stored in `{folder}/assemble.json`.
+    derived : dict
+        The keys and data of the derived variables, by year and variable.
+    output : Path
+        The file to write.
+    lon, lat : xr.DataArray
+        The coordinates of the locations, whose attributes are given to the output coordinates.
+    history_sources : list of xr.Dataset
+        The datasets whose history is kept in the output.
+
+    Returns
+    -------
+    bool
+        Whether the output was written.
+    """
+    key = _hash(
+        "assemble",
+        output.name,
+        sorted(
+            key
+            for outputs in derived.values()
+            for keys, _ in outputs.values()
+            for key in keys.values()
+        ),
+    )
+    manifest = checkpoints.folder.joinpath("assemble.json")
+    written = json.loads(manifest.read_text()) if manifest.exists() else dict()
+    if output.exists() and written.get(output.name) == key:
+        checkpoints.reused["assemble"] += 1
+        return False
+
+    years = sorted(derived)
+    variables = {
+        variable: xr.concat(
+            [derived[year][variable][1] for year in years],
+            "time",
+            coords="minimal",
+            compat="override",
+        )[variable]
+        for variable in OUTPUT_VARIABLES
+    }
+
+    logging.info("Preparing dataset")
+    ds = xr.Dataset(
+        variables,
+        attrs={
+            "Conventions": "CF-1.9",
+            "history": formatting.update_history(
+                "Spatial extraction, daily aggregation and intermediate computation of raw ERA5 data.",
+                *history_sources,
+            ),
+            "title": "xclim test dataset from ERA5",
+            "source": "reanalysis",
+            "comment": f"Contains modified Copernicus Climate ChangeService information {dt.date.today().year}",
+            "institution": "ECMWF",
+            "doi": "doi:10.24381/cds.adbb2d47",
+            "description": (
+                "Test dataset for xclim including all officially supported atmos variables that ERA5 can provide. "
+                "Intended for testing only, some intermediate variables are only rough approximations, "
+                "but they should have data in the right range and sequence. Approximated variables are flagged "
+                "as such in their description."
+            ),
+        },
+    )
+    ds.lon.attrs.update(lon.attrs)
+    ds.lat.attrs.update(lat.attrs)
+
     # Needed due to bad metadata in some variable coordinates
     for coord in ds.coords:
         if "_precision" in ds[coord].attrs:
             del ds[coord].attrs["_precision"]
 
-    # Save it with a fancy save_mfdataset : enables parallel IO. But we merge it anyway at the end.
-    base_path = "daily_surface_cancities_1990-1993_{var}.nc"
-    objs = []
-    paths = []
-    for nam, var in ds.data_vars.items():
-        objs.append(var.to_dataset())
-        paths.append(base_path.format(var=nam))
-    delayed = xr.save_mfdataset(objs, paths, compute=False)
-    compute(delayed)
-
-    dss = xr.open_mfdataset("daily_surface_cancities_1990-1993_*.nc")
-    dss = dss.transpose("location", "time")
-    dss.attrs.update(ds.attrs)
+    # Variables are sorted by name, as they were when merged from one file per variable.
+    ds = ds[sorted(ds.data_vars)].transpose("location", "time")
     encoding = {"time": {"dtype": "int32"}}
-    for var in dss.data_vars.keys():
+    for var in ds.data_vars.keys():
         encoding[var] = {"dtype": "float32"}
-    dss.to_netcdf("daily_surface_cancities_1990-1993.nc", encoding=encoding)
+    # The checkpoints are opened lazily, so that the output is written chunk by chunk. The chunks are written by
+    # threads of this process, as the workers of a cluster cannot write to the same NetCDF file.
+    delayed = ds.to_netcdf(output.with_suffix(".tmp"), encoding=encoding, compute=False)
+    dask.compute(delayed, scheduler="threads")
+    os.replace(output.with_suffix(".tmp"), output)
+
+    written[output.name] = key
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    manifest.write_text(json.dumps(written, indent=2))
+    checkpoints.computed["assemble"] += 1
+    return True
+
+
+def cluster_size(
+    workers: Optional[int] = None,
+    threads: Optional[int] = None,
+    memory_limit: Optional[int] = None,
+) -> tuple[int, int, int]:
+    """Return the number of workers, threads per worker and memory limit per worker, sized from the machine.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of workers. Defaults to the number of cores divided by the number of threads per worker.
+    threads : int, optional
+        Number of threads per worker. Defaults to 4, or less on smaller machines.
+    memory_limit : int, optional
+        Memory limit of each worker, in bytes. Defaults to 80% of the total memory, shared between the workers.
+    """
+    import psutil
+
+    cores = os.cpu_count() or 1
+    threads = threads or min(4, cores)
+    workers = workers or max(1, cores // threads)
+    memory_limit = memory_limit or int(0.8 * psutil.virtual_memory().total / workers)
+    return workers, threads, memory_limit
+
+
+def _peak_rss() -> int:
+    """Return the peak resident memory of the current process, in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _disk_read() -> int:
+    """Return the bytes read from storage so far by the current process and its children (e.g. the dask workers).
+
+    These are the `read_bytes` I/O counters: the reads served from the page cache are not counted, nor is the traffic
+    of sockets and pipes, e.g. between the dask workers. Returns 0 on platforms without I/O counters.
+    """
+    import psutil
+
+    current = psutil.Process()
+    total = 0
+    for process in [current, *current.children(recursive=True)]:
+        try:
+            total += process.io_counters().read_bytes
+        except (AttributeError, psutil.AccessDenied, psutil.NoSuchProcess):
+            continue
+    return total
+
+
+class StageProfiler:
+    """Wall time, peak memory, spilled memory, dask tasks and disk reads of each stage of the pipeline.
+
+    With a dask cluster, the memory of all workers is sampled by the scheduler during each stage, and the tasks are
+    counted from the task stream. Without one, the peak memory is the peak resident memory of the current process,
+    since its start, and the tasks run by the local dask schedulers are counted. The disk reads are the bytes read
+    from storage by the current process and the workers, without the reads served from the page cache.
+
+    Parameters
+    ----------
+    client : Client, optional
+        The client of the dask cluster, if any.
+    """
+
+    def __init__(self, client: Optional[Client] = None):
+        self.client = client
+        self.stages = dict()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Profile the code run within the context as stage `name`."""
+        start, read = time.perf_counter(), _disk_read()
+        if self.client is None:
+            keys = []
+            with Callback(pretask=lambda key, dsk, state: keys.append(key)):
+                yield
+            peak_memory, spilled, tasks = _peak_rss(), 0, len(keys)
+        else:
+            process, spill = MemorySampler(), MemorySampler()
+            with process.sample(name, client=self.client, measure="process"):
+                with spill.sample(name, client=self.client, measure="spilled"):
+                    with get_task_stream(self.client) as stream:
+                        yield
+            peak_memory = max(nbytes for _, nbytes in process.samples[name])
+            spilled = max(nbytes for _, nbytes in spill.samples[name])
+            tasks = len(stream.data)
+        self.stages[name] = dict(
+            wall_time=time.perf_counter() - start,
+            peak_memory=peak_memory,
+            spilled=spilled,
+            tasks=tasks,
+            disk_read=_disk_read() - read,
+        )
+        logging.info(
+            f"Stage {name}: {self.stages[name]['wall_time']:.1f} s, "
+            f"peak memory {self.stages[name]['peak_memory'] / 2**30:.2f} GiB, "
+            f"spilled {self.stages[name]['spilled'] / 2**30:.2f} GiB, "
+            f"{tasks} tasks, read {self.stages[name]['disk_read'] / 2**30:.2f} GiB from disk."
+        )
+
+
+def task_stream_summary(tasks: list[dict]) -> dict:
+    """Return the number of tasks and the time spent per task prefix and per action in a dask task stream.
+
+    Parameters
+    ----------
+    tasks : list of dict
+        The task stream, as recorded by `get_task_stream`.
+    """
+    actions, prefixes = dict(), dict()
+    for task in tasks:
+        prefix = prefixes.setdefault(key_split(task["key"]), dict(tasks=0, compute=0.0))
+        prefix["tasks"] += 1
+        for startstop in task["startstops"]:
+            duration = startstop["stop"] - startstop["start"]
+            actions[startstop["action"]] = (
+                actions.get(startstop["action"], 0.0) + duration
+            )
+            if startstop["action"] == "compute":
+                prefix["compute"] += duration
+    return dict(tasks=len(tasks), actions=actions, prefixes=prefixes)
+
+
+# Protect dask's threading
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Construct xclim's ERA5/daily_surface_cancities_1990-1993.nc test dataset."
+    )
+    parser.add_argument(
+        "base_path",
+        nargs="?",
+        type=Path,
+        default=Path().cwd(),
+        help="Folder holding the converted ERA5 data (default: current directory).",
+    )
+    parser.add_argument(
+        "--points",
+        action="store_true",
+        help=(
+            "Point-extraction mode: only read the zarr chunks containing the cities and build the (location, time) "
+            "arrays directly, without a dask cluster."
+        ),
+    )
+    parser.add_argument(
+        "--stations",
+        type=Path,
+        help=(
+            "CSV or GeoJSON file of the stations to extract, instead of the five default cities. "
+            "CSV files need name, lat and lon columns."
+        ),
+    )
+    parser.add_argument(
+        "--grid-cache",
+        type=Path,
+        default=Path(".era5_grid_index"),
+        help="Folder in which the KD-tree of the ERA5 grid is cached between runs.",
+    )
+    parser.add_argument(
+        "--checkpoints",
+        type=Path,
+        default=Path(".era5_checkpoints"),
+        help=(
+            "Folder in which the output of each stage is checkpointed, in one file per (variable, year). "
+            "Reruns only compute the cities whose inputs or parameters changed."
+        ),
+    )
+    parser.add_argument(
+        "--years",
+        nargs=2,
+        type=int,
+        default=[1990, 1993],
+        metavar=("START", "END"),
+        help="First and last years of the dataset (default: 1990 1993).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of dask workers (default: number of cores divided by the threads per worker).",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="Number of threads per dask worker (default: 4, or less on smaller machines).",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=parse_bytes,
+        help="Memory limit of each dask worker, e.g. 5GB (default: 80%% of the memory, shared between workers).",
+    )
+    parser.add_argument(
+        "--report-dir",
+        type=Path,
+        default=Path("era5_build_report"),
+        help=(
+            "Folder in which the dask performance report (dask-report.html) and the profile of the run "
+            "(profile.json: wall time, peak memory, spill, dask tasks and disk reads of each stage, task stream summary) "
+            "are written."
+        ),
+    )
+    args = parser.parse_args()
+
+    # Base Path for converted ERA5
+    NAMpath = args.base_path.joinpath("datasets/reconstruction/ECMWF/ERA5/NAM/{time}")
+    years = list(range(args.years[0], args.years[1] + 1))
+    output = Path(f"daily_surface_cancities_{years[0]}-{years[-1]}.nc")
+    checkpoints = Checkpoints(args.checkpoints)
+
+    logging.info("Starting the construction of ERA5 daily_cancities dataset")
+    logging.info(f"Will use data found in {NAMpath.parent.as_posix()}")
+    client, cluster = None, None
+    if not args.points:
+        workers, threads, memory_limit = cluster_size(
+            args.workers, args.threads, args.memory_limit
+        )
+        cluster = dict(
+            workers=workers, threads_per_worker=threads, memory_limit=memory_limit
+        )
+        logging.info(
+            f"Starting {workers} dask workers with {threads} threads and {memory_limit / 2**30:.1f} GiB each."
+        )
+        client = Client(
+            n_workers=workers,
+            threads_per_worker=threads,
+            dashboard_address=8786,
+            memory_limit=memory_limit,
+        )
+
+    if args.stations:
+        lon, lat = read_stations(args.stations)
+        logging.info(f"Read {lon.location.size} stations from {args.stations}.")
+    else:
+        lon, lat = station_coordinates(
+            ["Halifax", "Montréal", "Iqaluit", "Saskatoon", "Victoria"],
+            [-63.5, -73.5, -68.5, -106.75, -123.25],
+            [44.5, 45.5, 63.75, 52.0, 48.5],
+        )
+
+    profiler = StageProfiler(client)
+    args.report_dir.mkdir(parents=True, exist_ok=True)
+    with ExitStack() as stack:
+        if client is not None:
+            try:
+                # Needed to render the performance report
+                import bokeh  # noqa: F401
+
+                stack.enter_context(
+                    performance_report(filename=args.report_dir / "dask-report.html")
+                )
+            except ImportError:
+                logging.warning("Install bokeh to write the dask performance report.")
+            task_stream = stack.enter_context(get_task_stream(client))
+
+        with profiler.stage("gather"):
+            gather = gather_files(NAMpath, years)
+        found_years = sorted({year for stores in gather.values() for _, year in stores})
+
+        logging.info("Extracting the cities.")
+        with profiler.stage("extract"):
+            extracted = {
+                freq: {
+                    (variable, year): extract_stage(
+                        checkpoints,
+                        freq,
+                        variable,
+                        year,
+                        files,
+                        lon,
+                        lat,
+                        args.points,
+                        args.grid_cache,
+                    )
+                    for (variable, year), files in stores.items()
+                }
+                for freq, stores in gather.items()
+            }
+
+        def year_slices(freq: str, year: int) -> dict:
+            return {v: s for (v, y), s in extracted[freq].items() if y == year}
+
+        logging.info("Aggregating the hourly variables.")
+        with profiler.stage("aggregate"):
+            aggregated = dict()
+            for year in found_years:
+                day, hourly = year_slices("day", year), year_slices("1hr", year)
+                aggregated[year] = {
+                    name: aggregate_stage(checkpoints, name, reductions, year, hourly)
+                    for name, reductions in daily_spec(set(day), set(hourly)).items()
+                }
+
+        logging.info("Computing the variables.")
+        with profiler.stage("derive"):
+            derived = {
+                year: derive_stage(
+                    checkpoints, year, year_slices("day", year), aggregated[year]
+                )
+                for year in found_years
+            }
+
+        with profiler.stage("assemble"):
+            # The history of the daily data is kept, as when it was opened with open_mfdataset
+            history_sources = [ds for _, ds in list(extracted["day"].values())[:1]]
+            assemble_stage(checkpoints, derived, output, lon, lat, history_sources)
+
+    for stage in sorted(set(checkpoints.computed) | set(checkpoints.reused)):
+        logging.info(
+            f"{stage}: {checkpoints.computed[stage]} slices computed, {checkpoints.reused[stage]} reused."
+        )
+
+    profile = dict(
+        years=years,
+        cluster=cluster,
+        stages=profiler.stages,
+        slices={
+            stage: dict(
+                computed=checkpoints.computed[stage], reused=checkpoints.reused[stage]
+            )
+            for stage in sorted(set(checkpoints.computed) | set(checkpoints.reused))
+        },
+        task_stream=task_stream_summary(task_stream.data) if client else None,
+    )
+    with args.report_dir.joinpath("profile.json").open("w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    logging.info(f"Wrote the profile of the run to {args.report_dir}.")
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+"""
+Write a small synthetic stand-in of the converted ERA5 archive read by `construct_era5_daily_cancities.py`.
+
+The stores follow the layout of the archive converted with miranda: one Zarr (v2, consolidated) store per variable,
+frequency and year, under `datasets/reconstruction/ECMWF/ERA5/NAM/{time}/{variable}/`, named
+`{variable}_{time}_ecmwf_era5-single-levels_NAM_{year}.zarr`, on a regular latitude-longitude grid covering the
+default cities, with the chunking expected by the builder (122 days of hourly values, 25 x 50 grid cells).
+
+The hourly variables are those of `HOURLY_VARIABLES`; the daily variables of `DAILY_VARIABLES` are reductions of
+the same hourly values, so that both paths of the builder are exercised. Values are plausible rather than realistic
+(seasonal and diurnal cycles, persistent weather anomalies, solar geometry, wet hours, snow in the cold season) and
+consistent between variables (e.g. `tdps <= tas`, `prsn` only below freezing). They only depend on the seed and
+the year, so a store is the same whatever the other years written.
+
+Requires numpy, pandas, xarray and zarr.
+"""
+import argparse
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Layout of the converted archive, as read by the builder
+ARCHIVE_PATH = "datasets/reconstruction/ECMWF/ERA5/NAM/{time}"
+STORE_NAME = "{variable}_{time}_ecmwf_era5-single-levels_NAM_{year}.zarr"
+
+# Chunks of the stores, in time steps and grid cells
+CHUNKS = {"1hr": {"time": 2928, "lat": 25, "lon": 50}, "day": {"lat": 25, "lon": 50}}
+
+# Latitude and longitude ranges of the grid, holding the default cities of the builder
+LAT_RANGE = (40.0, 70.0)
+LON_RANGE = (-130.0, -60.0)
+
+# Hourly variables: units, standard name and long name
+HOURLY_VARIABLES = {
+    "tas": ("K", "air_temperature", "2 metre temperature"),
+    "tdps": ("K", "dew_point_temperature", "2 metre dewpoint temperature"),
+    "pr": ("kg m-2 s-1", "precipitation_flux", "Total precipitation"),
+    "prsn": ("kg m-2 s-1", "snowfall_flux", "Snowfall"),
+    "evspsblpot": (
+        "kg m-2 s-1",
+        "water_potential_evaporation_flux",
+        "Potential evaporation",
+    ),
+    "snw": ("kg m-2", "surface_snow_amount", "Snow depth water equivalent"),
+    "snr": ("kg m-3", "snow_density", "Snow density"),
+    "ps": ("Pa", "surface_air_pressure", "Surface pressure"),
+    "rsds": (
+        "W m-2",
+        "surface_downwelling_shortwave_flux_in_air",
+        "Surface solar radiation downwards",
+    ),
+    "rss": (
+        "W m-2",
+        "surface_net_downward_shortwave_flux",
+        "Surface net solar radiation",
+    ),
+    "rlds": (
+        "W m-2",
+        "surface_downwelling_longwave_flux_in_air",
+        "Surface thermal radiation downwards",
+    ),
+    "rls": (
+        "W m-2",
+        "surface_net_downward_longwave_flux",
+        "Surface net thermal radiation",
+    ),
+    "uas": ("m s-1", "eastward_wind", "10 metre U wind component"),
+    "vas": ("m s-1", "northward_wind", "10 metre V wind component"),
+}
+
+# Daily variables: hourly variable and daily reduction
+DAILY_VARIABLES = {"tasmax": ("tas", "max")}
+
+STEFAN_BOLTZMANN = 5.670374419e-8
+
+
+def grid(resolution: float) -> tuple[np.ndarray, np.ndarray]:
+    """Return the latitudes (decreasing, as in ERA5) and longitudes of the grid at a resolution in degrees."""
+    lat = np.arange(LAT_RANGE[1], LAT_RANGE[0] - resolution / 2, -resolution)
+    lon = np.arange(LON_RANGE[0], LON_RANGE[1] + resolution / 2, resolution)
+    return lat, lon
+
+
+def _anomalies(
+    rng: np.random.Generator, days: int, shape: tuple, rho: float, sd: float
+) -> np.ndarray:
+    """Return daily AR(1) anomalies of standard deviation `sd`, repeated for each hour of the day."""
+    values = np.empty((days, *shape))
+    values[0] = rng.standard_normal(shape)
+    innovations = rng.standard_normal((days - 1, *shape)) * np.sqrt(1 - rho**2)
+    for day in range(1, days):
+        values[day] = rho * values[day - 1] + innovations[day - 1]
+    return np.repeat(values * sd, 24, axis=0)
+
+
+def hourly_fields(
+    year: int, lat: np.ndarray, lon: np.ndarray, seed: int = 0
+) -> tuple[pd.DatetimeIndex, dict[str, np.ndarray]]:
+    """Return the hourly times and the values of every variable of `HOURLY_VARIABLES` for a year.
+
+    Parameters
+    ----------
+    year : int
+        The year.
+    lat, lon : np.ndarray
+        The coordinates of the grid, in degrees.
+    seed : int
+        Seed of the random generator, combined with the year.
+
+    Returns
+    -------
+    pd.DatetimeIndex, dict
+        The times and the float32 arrays of dimensions (time, lat, lon), by variable.
+    """
+    rng = np.random.default_rng([seed, year])
+    time = pd.date_range(f"{year}-01-01", f"{year}-12-31T23:00", freq="h")
+    days = time.size // 24
+    shape = (lat.size, lon.size)
+
+    doy = (time.dayofyear.values + time.hour.values / 24)[:, None, None]
+    hour_angle = np.deg2rad(15 * (time.hour.values[:, None, None] - 12) + lon)
+    phi = np.deg2rad(lat)[:, None]
+    season = np.cos(2 * np.pi * (doy - 200) / 365.25)
+
+    # Temperature: seasonal cycle growing with latitude, diurnal cycle peaking in the afternoon, weather anomalies
+    local_hour = (time.hour.values[:, None, None] + lon / 15) % 24
+    diurnal = np.cos(2 * np.pi * (local_hour - 15) / 24)
+    climatology = (
+        283 - 0.6 * (lat[:, None] - 40) + (10 + 0.3 * (lat[:, None] - 40)) * season
+    )
+    tas = (
+        climatology
+        + 4 * diurnal
+        + _anomalies(rng, days, shape, 0.8, 3)
+        + 0.5 * rng.standard_normal((time.size, *shape))
+    )
+    tdps = tas - 1 - np.abs(_anomalies(rng, days, shape, 0.6, 4))
+
+    # Solar geometry, with a daily cloud cover reducing the radiation
+    declination = np.deg2rad(23.44) * np.sin(2 * np.pi * (doy - 81) / 365.25)
+    cos_zenith = np.sin(phi) * np.sin(declination) + np.cos(phi) * np.cos(
+        declination
+    ) * np.cos(hour_angle)
+    clearness = np.repeat(rng.uniform(0.3, 1, (days, *shape)), 24, axis=0)
+    rsds = 1000 * np.clip(cos_zenith, 0, None) * clearness
+
+    # Snow accumulates in the cold season, and is brighter than the ground
+    snw = 15 * np.clip(273.15 - climatology, 0, None)
+    albedo = np.where(snw > 0, 0.6, 0.15)
+
+    # Precipitation falls in wet hours, as snow below freezing
+    wet = rng.random((time.size, *shape)) < 0.1
+    pr = np.where(wet, rng.gamma(0.7, 1.5, (time.size, *shape)), 0) / 3600
+    emissivity = 0.7 + 0.25 * (1 - clearness)
+
+    fields = dict(
+        tas=tas,
+        tdps=tdps,
+        pr=pr,
+        prsn=np.where(tas < 273.15, pr, 0),
+        evspsblpot=2.5e-5 * rsds / 800 + 1e-7,
+        snw=snw,
+        snr=250 - 50 * season,
+        ps=100500 + 50 * (70 - lat[:, None]) + _anomalies(rng, days, shape, 0.7, 800),
+        rsds=rsds,
+        rss=(1 - albedo) * rsds,
+        rlds=emissivity * STEFAN_BOLTZMANN * tas**4,
+        rls=(emissivity - 1) * STEFAN_BOLTZMANN * tas**4,
+        uas=2 + _anomalies(rng, days, shape, 0.7, 4) + rng.standard_normal(tas.shape),
+        vas=_anomalies(rng, days, shape, 0.7, 3) + rng.standard_normal(tas.shape),
+    )
+    return time, {
+        name: np.broadcast_to(values, tas.shape).astype("float32")
+        for name, values in fields.items()
+    }
+
+
+def _write_store(
+    path: Path,
+    name: str,
+    freq: str,
+    time: pd.DatetimeIndex,
+    values: np.ndarray,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    attrs: tuple[str, str, str],
+) -> None:
+    """Write a variable as a consolidated Zarr v2 store, chunked as in the converted archive."""
+    import zarr
+
+    units, standard_name, long_name = attrs
+    ds = xr.Dataset(
+        {
+            name: (
+                ("time", "lat", "lon"),
+                values,
+                dict(units=units, standard_name=standard_name, long_name=long_name),
+            )
+        },
+        coords=dict(
+            time=time,
+            lat=("lat", lat, dict(units="degrees_north", standard_name="latitude")),
+            lon=("lon", lon, dict(units="degrees_east", standard_name="longitude")),
+        ),
+        attrs=dict(
+            Conventions="CF-1.8",
+            institution="ECMWF",
+            source="ERA5",
+            domain="NAM",
+            frequency=freq,
+            title="Synthetic stand-in of the ERA5 single levels reanalysis",
+            history="Written by synthesize_era5_archive.py",
+        ),
+    )
+    kwargs = dict()
+    if int(zarr.__version__.split(".")[0]) >= 3:
+        # The stores converted with miranda are Zarr v2
+        kwargs["zarr_format"] = 2
+    tmp = path.with_name(f".{path.name}.tmp")
+    ds.chunk(CHUNKS[freq]).to_zarr(tmp, mode="w", consolidated=True, **kwargs)
+    tmp.rename(path)
+
+
+def synthesize_archive(
+    root: Union[str, Path],
+    years: list[int],
+    resolution: float = 2.5,
+    seed: int = 0,
+    overwrite: bool = False,
+) -> list[Path]:
+    """Write the stores of the synthetic archive that do not exist yet.
+
+    Parameters
+    ----------
+    root : str or Path
+        The folder in which `datasets/reconstruction/...` is written, i.e. the `base_path` of the builder.
+    years : list of int
+        The years to write.
+    resolution : float
+        The resolution of the grid, in degrees.
+    seed : int
+        Seed of the random generator.
+    overwrite : bool
+        Whether to write the stores that already exist again.
+
+    Returns
+    -------
+    list of Path
+        The written stores.
+    """
+    archive = Path(root).joinpath(ARCHIVE_PATH)
+    lat, lon = grid(resolution)
+
+    def store(freq: str, name: str, year: int) -> Path:
+        return Path(archive.as_posix().format(time=freq)).joinpath(
+            name, STORE_NAME.format(variable=name, time=freq, year=year)
+        )
+
+    written = []
+    for year in years:
+        expected = [store("1hr", name, year) for name in HOURLY_VARIABLES] + [
+            store("day", name, year) for name in DAILY_VARIABLES
+        ]
+        if not overwrite and all(path.exists() for path in expected):
+            continue
+        time, fields = hourly_fields(year, lat, lon, seed)
+        for name, attrs in HOURLY_VARIABLES.items():
+            path = store("1hr", name, year)
+            if overwrite or not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                _write_store(path, name, "1hr", time, fields[name], lat, lon, attrs)
+                written.append(path)
+        for name, (variable, reduction) in DAILY_VARIABLES.items():
+            path = store("day", name, year)
+            if overwrite or not path.exists():
+                days = fields[variable].reshape(-1, 24, lat.size, lon.size)
+                values = getattr(days, reduction)(axis=1)
+                attrs = HOURLY_VARIABLES[variable]
+                path.parent.mkdir(parents=True, exist_ok=True)
+                _write_store(
+                    path,
+                    name,
+                    "day",
+                    time[::24],
+                    values,
+                    lat,
+                    lon,
+                    (attrs[0], attrs[1], f"Daily {reduction} of {attrs[2].lower()}"),
+                )
+                written.append(path)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=(
+            "Write a small synthetic stand-in of the converted ERA5 archive read by "
+            "construct_era5_daily_cancities.py."
+        )
+    )
+    parser.add_argument(
+        "root",
+        type=Path,
+        help="Folder in which the archive is written, to be given as base_path to the builder.",
+    )
+    parser.add_argument(
+        "--years",
+        nargs=2,
+        type=int,
+        default=[1990, 1991],
+        metavar=("START", "END"),
+        help="First and last years of the archive (default: 1990 1991).",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=float,
+        default=2.5,
+        help="Resolution of the grid, in degrees (default: 2.5).",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Write the stores that already exist again.",
+    )
+    args = parser.parse_args()
+
+    stores = synthesize_archive(
+        args.root,
+        list(range(args.years[0], args.years[1] + 1)),
+        args.resolution,
+        args.seed,
+        args.overwrite,
+    )
+    print(f"Successfully wrote {len(stores)} stores in {args.root}.")
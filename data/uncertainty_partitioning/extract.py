@@ -1,37 +1,145 @@
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 import xarray as xr
-import numpy as np
-from pathlib import Path
 
-def load_test_data(var="tas", region="pnw"):
-    """Load data from https://github.com/thenaomig/regionalVariance.
+SCENS = ("historical", "rcp26", "rcp45", "rcp60", "rcp85")
+SOURCE_PATH = Path("/tmp/regionalVariance/timeSeries")
+FN_PAT = "timeSeries_{var}_{region}_Monthly_{scen}.csv"
+
+
+def _csv_engine():
+    """Return the fastest CSV engine available to pandas."""
+    try:
+        import pyarrow  # noqa: F401
+
+        return "pyarrow"
+    except ImportError:
+        return "c"
+
+
+def read_annual_means(fn):
+    """Read a monthly time series file and return its annual means.
+
+    The two header lines hold the model and run of each column. The monthly values are averaged per year directly
+    on the array, skipping missing values.
+
+    Returns
+    -------
+    years : np.ndarray
+        The years, in increasing order.
+    columns : list of tuple
+        The (model, run) of each column.
+    means : np.ndarray
+        The annual means, of shape (year, column).
+    """
+    with open(fn, newline="") as f:
+        models, runs, names = islice(csv.reader(f), 3)
+    # The third line holds the name of the time index, if any
+    header = 3 if not any(names[1:]) else 2
+
+    df = pd.read_csv(
+        fn, header=None, skiprows=header, index_col=0, engine=_csv_engine()
+    )
+    time = pd.DatetimeIndex(pd.to_datetime(df.index))
+    values = df.to_numpy(dtype=np.float64)
+
+    order = np.argsort(time.year, kind="stable")
+    years, starts = np.unique(time.year[order], return_index=True)
+    values = values[order]
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+    counts = np.add.reduceat(valid, starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return years, list(zip(models[1:], runs[1:])), means
+
+
+def load_test_datasets(pairs, path=SOURCE_PATH, jobs=8):
+    """Load the data of several (var, region) pairs from https://github.com/thenaomig/regionalVariance.
+
+    All scenario files are parsed concurrently and their annual means are written into a dense
+    (scen, time, model, run) array for each pair.
 
     Accessed 2022-12-16 (399b4b8)
     """
-    scens = ("historical", "rcp26", "rcp45", "rcp60", "rcp85")
-    path = Path("/tmp/regionalVariance/timeSeries")
-    fn_pat = "timeSeries_{var}_{region}_Monthly_{scen}.csv"
-    def read(var, region, scen):
-        fn = fn_pat.format(var=var, region=region, scen=scen)
-        df = pd.read_csv(path / fn, index_col=0, header=[0, 1], parse_dates=True)
-        da = df.stack([0, 1]).to_xarray().astype(np.float32)
-        da.name = var
-        return da
-
-    index = pd.Index(scens, name="scen")
-    out = xr.concat([read(var, region, scen) for scen in scens], dim=index).resample(time="Y").mean()
-    out.attrs["source"] = "https://github.com/thenaomig/regionalVariance"
-    out.attrs["original_filenames"] = ", ".join([fn_pat.format(var=var, region=region, scen=scen) for scen in scens])
-    out.attrs["date_accessed"] = "2022-12-20"
+    files = {
+        (var, region, scen): Path(path)
+        / FN_PAT.format(var=var, region=region, scen=scen)
+        for var, region in pairs
+        for scen in SCENS
+    }
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        annual = dict(zip(files, executor.map(read_annual_means, files.values())))
+
+    out = dict()
+    for var, region in pairs:
+        parts = [annual[var, region, scen] for scen in SCENS]
+        first = min(years[0] for years, _, _ in parts)
+        last = max(years[-1] for years, _, _ in parts)
+        models = sorted({model for _, columns, _ in parts for model, _ in columns})
+        runs = sorted({run for _, columns, _ in parts for _, run in columns})
+        imodel = {model: i for i, model in enumerate(models)}
+        irun = {run: i for i, run in enumerate(runs)}
+
+        data = np.full(
+            (len(SCENS), last - first + 1, len(models), len(runs)),
+            np.nan,
+            dtype=np.float32,
+        )
+        for s, (years, columns, means) in enumerate(parts):
+            mi = np.array([imodel[model] for model, _ in columns])
+            ri = np.array([irun[run] for _, run in columns])
+            data[s, (years - first)[:, np.newaxis], mi, ri] = means
+
+        da = xr.DataArray(
+            data,
+            dims=("scen", "time", "model", "run"),
+            coords={
+                "scen": list(SCENS),
+                "time": pd.to_datetime(
+                    [f"{year}-12-31" for year in range(first, last + 1)]
+                ),
+                "model": models,
+                "run": runs,
+            },
+            name=var,
+        )
+        # Models and runs without any data are not kept
+        valid = da.notnull()
+        da = da.sel(
+            model=valid.any(["scen", "time", "run"]),
+            run=valid.any(["scen", "time", "model"]),
+        )
+        da.attrs["source"] = "https://github.com/thenaomig/regionalVariance"
+        da.attrs["original_filenames"] = ", ".join(
+            [FN_PAT.format(var=var, region=region, scen=scen) for scen in SCENS]
+        )
+        da.attrs["date_accessed"] = "2022-12-20"
+        out[var, region] = da
     return out
 
 
-def save_test_data(path="~/src/xclim-testdata/uncertainty_partitioning/"):
-    """Save to netCDF."""
+def load_test_data(var="tas", region="pnw", path=SOURCE_PATH):
+    """Load data from https://github.com/thenaomig/regionalVariance.
 
-    for var in ["pr", "tas"]:
-        for region in ["global", "pnw"]:
-            da = load_test_data(var, region)
-            da.to_netcdf(Path(path) / f"cmip5_{var}_{region}_mon.nc",
-                         encoding={var: {"zlib": True, "complevel": 8}})
-            da.close()
+    Accessed 2022-12-16 (399b4b8)
+    """
+    return load_test_datasets([(var, region)], path)[var, region]
+
+
+def save_test_data(
+    path="~/src/xclim-testdata/uncertainty_partitioning/", source=SOURCE_PATH
+):
+    """Save to netCDF."""
+    path = Path(path).expanduser()
+    pairs = [(var, region) for var in ["pr", "tas"] for region in ["global", "pnw"]]
+    for (var, region), da in load_test_datasets(pairs, source).items():
+        da.to_netcdf(
+            path / f"cmip5_{var}_{region}_mon.nc",
+            encoding={var: {"zlib": True, "complevel": 8}},
+        )
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""
+Decode the registered datasets once into a shared, memory-mappable cache.
+
+Each NetCDF file is opened once, with its compression and CF packing (scale, offset, fill values) decoded, and its
+variables are stored uncompressed as `.npy` files in `{cache}/v1/{digest[:2]}/sha256-{digest}/`, next to a `dataset.json`
+sidecar holding the dimensions, attributes and coordinates. Entries are keyed by the sha256 of the file in
+`data/registry.txt`, so a file whose registered hash changes is decoded again, and stale entries can be removed
+with `--prune`. Entries are built into a temporary folder under a file lock, then renamed, so that concurrent
+processes (e.g. pytest-xdist workers) decode each file only once.
+
+`open_cached` memory-maps the arrays read-only and decodes the times, so every process gets xarray objects backed
+by the same pages of the page cache, without copies:
+
+    ds = open_cached("ERA5/daily_surface_cancities_1990-1993.nc")
+
+The module is also a pytest plugin (`pytest -p decoded_cache`, or `pytest_plugins = ["decoded_cache"]` in a
+`conftest.py`) providing an `open_testdata` fixture. The data folder and the cache folder are set with the
+`XCLIM_TESTDATA_DIR` and `XCLIM_TESTDATA_DECODED_CACHE` environment variables.
+
+Requires numpy, xarray and a NetCDF backend.
+"""
+import argparse
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+from fetch_testdata import DEFAULT_CACHE
+from report_check_sums import file_sha256_checksum, read_registry
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Version of the layout of the cache entries
+CACHE_VERSION = "v1"
+
+DEFAULT_DATA_FOLDER = Path(os.environ.get("XCLIM_TESTDATA_DIR", "data"))
+DEFAULT_DECODED_CACHE = Path(
+    os.environ.get("XCLIM_TESTDATA_DECODED_CACHE", DEFAULT_CACHE / "decoded")
+)
+
+METADATA_FILE = "dataset.json"
+
+
+def entry_path(
+    file_hash: str, cache_dir: Union[str, Path] = DEFAULT_DECODED_CACHE
+) -> Path:
+    """Return the folder of the cache entry of a file.
+
+    Parameters
+    ----------
+    file_hash : str
+        The registered hash of the file, e.g. "sha256:abcdef...".
+    cache_dir : str or Path
+        The cache folder.
+    """
+    algorithm, digest = file_hash.split(":")
+    return Path(cache_dir).joinpath(CACHE_VERSION, digest[:2], f"{algorithm}-{digest}")
+
+
+def _encode_attr(value):
+    """Convert an attribute value to JSON, keeping the dtype of numpy values."""
+    if isinstance(value, (np.ndarray, np.generic)):
+        return {
+            "__ndarray__": np.asarray(value).tolist(),
+            "dtype": value.dtype.str,
+            "shape": list(np.shape(value)),
+        }
+    if isinstance(value, bytes):
+        return {"__bytes__": value.decode("latin-1")}
+    return value
+
+
+def _decode_attr(value):
+    """Convert an attribute value read from JSON back to its original type."""
+    if isinstance(value, dict) and "__ndarray__" in value:
+        array = np.array(value["__ndarray__"], dtype=value["dtype"]).reshape(
+            value["shape"]
+        )
+        return array[()] if array.ndim == 0 else array
+    if isinstance(value, dict) and "__bytes__" in value:
+        return value["__bytes__"].encode("latin-1")
+    return value
+
+
+@contextmanager
+def _locked(path: Path):
+    """Hold an exclusive lock on a file, on platforms supporting it."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def decode_file(filename: Path, output: Path) -> None:
+    """Write the decoded variables of a NetCDF file as `.npy` files, with a metadata sidecar.
+
+    Times are kept as numbers, with their units and calendar, and are decoded when the entry is opened.
+    Strings are stored as fixed-width unicode arrays.
+
+    Parameters
+    ----------
+    filename : Path
+        The NetCDF file.
+    output : Path
+        The folder of the cache entry.
+    """
+    import xarray as xr
+
+    output.mkdir(parents=True)
+    variables = dict()
+    with xr.open_dataset(filename, decode_times=False, decode_timedelta=False) as ds:
+        for i, (name, var) in enumerate(ds.variables.items()):
+            values = var.values
+            if values.dtype.kind == "O":
+                values = values.astype(str)
+            np.save(output.joinpath(f"{i}.npy"), values, allow_pickle=False)
+            variables[name] = dict(
+                file=f"{i}.npy",
+                dims=list(var.dims),
+                attrs={k: _encode_attr(v) for k, v in var.attrs.items()},
+                coord=name in ds.coords,
+            )
+        metadata = dict(
+            source=filename.name,
+            attrs={k: _encode_attr(v) for k, v in ds.attrs.items()},
+            variables=variables,
+        )
+    with output.joinpath(METADATA_FILE).open("w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+
+
+def build_entry(
+    filename: Union[str, Path],
+    file_hash: str,
+    cache_dir: Union[str, Path] = DEFAULT_DECODED_CACHE,
+) -> Path:
+    """Decode a file into the cache, unless its entry already exists.
+
+    The file is checked against its registered hash before being decoded. Concurrent callers wait for the one
+    holding the lock, and then reuse its entry.
+
+    Parameters
+    ----------
+    filename : str or Path
+        The NetCDF file.
+    file_hash : str
+        Its registered hash, e.g. "sha256:abcdef...".
+    cache_dir : str or Path
+        The cache folder.
+
+    Returns
+    -------
+    Path
+        The folder of the cache entry.
+    """
+    entry = entry_path(file_hash, cache_dir)
+    if entry.joinpath(METADATA_FILE).exists():
+        return entry
+    with _locked(entry.with_name(f"{entry.name}.lock")):
+        if entry.joinpath(METADATA_FILE).exists():
+            return entry
+        filename = Path(filename)
+        checksum = f"sha256:{file_sha256_checksum(filename)}"
+        if checksum != file_hash:
+            raise ValueError(
+                f"{filename} does not match its registered hash ({checksum} != {file_hash})."
+            )
+        tmp = entry.with_name(f"{entry.name}.tmp-{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            decode_file(filename, tmp)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp, entry)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return entry
+
+
+def open_entry(entry: Union[str, Path]):
+    """Open a cache entry as a dataset backed by read-only memory maps.
+
+    Parameters
+    ----------
+    entry : str or Path
+        The folder of the cache entry.
+
+    Returns
+    -------
+    xarray.Dataset
+    """
+    import xarray as xr
+
+    entry = Path(entry)
+    with entry.joinpath(METADATA_FILE).open(encoding="utf-8") as f:
+        metadata = json.load(f)
+
+    data_vars, coords = dict(), dict()
+    for name, var in metadata["variables"].items():
+        variable = xr.Variable(
+            var["dims"],
+            np.load(entry.joinpath(var["file"]), mmap_mode="r"),
+            {k: _decode_attr(v) for k, v in var["attrs"].items()},
+        )
+        (coords if var["coord"] else data_vars)[name] = variable
+    ds = xr.Dataset(
+        data_vars,
+        coords,
+        {k: _decode_attr(v) for k, v in metadata["attrs"].items()},
+    )
+    return xr.decode_cf(
+        ds, mask_and_scale=False, concat_characters=False, decode_coords=False
+    )
+
+
+def open_cached(
+    name: str,
+    data_folder: Union[str, Path] = DEFAULT_DATA_FOLDER,
+    cache_dir: Union[str, Path] = DEFAULT_DECODED_CACHE,
+    registry: Optional[dict[str, str]] = None,
+):
+    """Open a registered dataset from the decoded cache, decoding it first if needed.
+
+    Parameters
+    ----------
+    name : str
+        The path of the file, relative to `data/`.
+    data_folder : str or Path
+        The folder holding the files and `registry.txt`.
+    cache_dir : str or Path
+        The cache folder.
+    registry : dict, optional
+        The registry entries. Defaults to those of `{data_folder}/registry.txt`.
+
+    Returns
+    -------
+    xarray.Dataset
+        A dataset whose arrays are read-only memory maps of the cache entry.
+    """
+    data_folder = Path(data_folder)
+    if registry is None:
+        registry = read_registry(data_folder.joinpath("registry.txt"))
+    if name not in registry:
+        raise KeyError(f"{name} is not in the registry.")
+    return open_entry(
+        build_entry(data_folder.joinpath(name), registry[name], cache_dir)
+    )
+
+
+def prune(
+    registry: Union[str, Path] = DEFAULT_DATA_FOLDER / "registry.txt",
+    cache_dir: Union[str, Path] = DEFAULT_DECODED_CACHE,
+) -> list[Path]:
+    """Remove the cache entries of files that are no longer registered with the same hash.
+
+    Parameters
+    ----------
+    registry : str or Path
+        The registry file.
+    cache_dir : str or Path
+        The cache folder.
+
+    Returns
+    -------
+    list of Path
+        The removed entries.
+    """
+    keep = {entry_path(h, cache_dir) for h in read_registry(Path(registry)).values()}
+    removed = []
+    for path in Path(cache_dir).joinpath(CACHE_VERSION).glob("*/*"):
+        # Entries come with their lock file, and possibly an interrupted build
+        entry = path.with_name(path.name.split(".")[0])
+        if entry in keep:
+            continue
+        if path.is_dir():
+            shutil.rmtree(path)
+            removed.append(path)
+        else:
+            path.unlink()
+    return removed
+
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+if pytest is not None:
+
+    @pytest.fixture(scope="session")
+    def open_testdata():
+        """Return a function opening registered datasets from the shared decoded cache."""
+        registry = read_registry(DEFAULT_DATA_FOLDER.joinpath("registry.txt"))
+
+        def _open(name: str):
+            return open_cached(name, registry=registry)
+
+        return _open
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Decode the registered NetCDF files into a shared, memory-mappable cache."
+    )
+    parser.add_argument(
+        "patterns",
+        nargs="*",
+        help="Glob patterns of the files to decode, relative to data/ (default: all NetCDF files).",
+    )
+    parser.add_argument("--data", default=DEFAULT_DATA_FOLDER)
+    parser.add_argument("--cache-dir", default=DEFAULT_DECODED_CACHE)
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Remove the entries of files that are no longer registered with the same hash.",
+    )
+    args = parser.parse_args()
+
+    data = Path(args.data)
+    entries = read_registry(data.joinpath("registry.txt"))
+    decoded = 0
+    for name, file_hash in sorted(entries.items()):
+        if not name.endswith(".nc") or (
+            args.patterns and not any(fnmatch(name, p) for p in args.patterns)
+        ):
+            continue
+        if not data.joinpath(name).exists():
+            print(f"Skipping missing file: {name}")
+            continue
+        build_entry(data.joinpath(name), file_hash, args.cache_dir)
+        decoded += 1
+    print(f"Successfully cached {decoded} decoded datasets in {args.cache_dir}.")
+    if args.prune:
+        removed = prune(data.joinpath("registry.txt"), args.cache_dir)
+        print(f"Removed {len(removed)} stale entries.")
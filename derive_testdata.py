@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Generate small test files derived from subsets of the registered datasets.
+
+The derived files are declared in `derived_testdata.json`, keyed by their path relative to `data/derived/`:
+
+    {
+      "sdba/CanESM2_2000.nc": {
+        "source": "sdba/CanESM2_1950-2100.nc",
+        "variables": ["tasmax"],
+        "sel": {"time": {"start": "2000-01-01", "stop": "2000-12-31"}},
+        "isel": {"location": [0]},
+        "encoding": {"zlib": true, "complevel": 4}
+      }
+    }
+
+`source` is relative to `data/`. `variables` (default: all) lists the data variables to keep. `sel` and `isel`
+select along dimensions by label or by position: a `{"start", "stop", "step"}` mapping is a slice, a list selects
+several values and a scalar selects a single one. `encoding` is applied to every data variable of the output.
+
+The sha256 of the source file and of the spec are recorded with the sha256 of each derived file in
+`data/derived/provenance.json`. A derived file is only regenerated when its source or its spec changed, or when it
+was modified or removed. The derived files and the provenance are then added to `data/registry.txt` and to the table of
+files of the README, and derived files no longer in the spec are removed from both.
+
+Requires xarray and netCDF4.
+"""
+import argparse
+import hashlib
+import json
+from pathlib import Path
+from typing import Union
+
+from report_check_sums import file_sha256_checksum, update_readme, update_registry
+
+# Folder, relative to `data/`, in which the derived files are written
+DERIVED_FOLDER = "derived"
+
+# Sidecar recording the source and spec of each derived file
+PROVENANCE_FILE = "provenance.json"
+
+
+def spec_hash(spec: dict) -> str:
+    """Return the sha256 of the canonical JSON representation of a spec."""
+    text = json.dumps(spec, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _indexer(value):
+    """Convert an indexer of the spec to a slice, a list or a scalar."""
+    if isinstance(value, dict):
+        return slice(value.get("start"), value.get("stop"), value.get("step"))
+    return value
+
+
+def derive_file(source: Path, output: Path, spec: dict) -> None:
+    """Write the subset of a dataset described by a spec.
+
+    Parameters
+    ----------
+    source : Path
+        The source file.
+    output : Path
+        The derived file to write.
+    spec : dict
+        The spec of the derived file, with optional `variables`, `sel`, `isel` and `encoding` entries.
+    """
+    import xarray as xr
+
+    with xr.open_dataset(source) as ds:
+        if "variables" in spec:
+            ds = ds[spec["variables"]]
+        if "isel" in spec:
+            ds = ds.isel({dim: _indexer(v) for dim, v in spec["isel"].items()})
+        if "sel" in spec:
+            ds = ds.sel({dim: _indexer(v) for dim, v in spec["sel"].items()})
+        ds = ds.load()
+
+    for name in ds.data_vars:
+        encoding = ds[name].encoding
+        encoding.update(spec.get("encoding", {}))
+        if encoding.get("zlib") or encoding.get("compression"):
+            # Compressed variables cannot be stored contiguously
+            encoding["contiguous"] = False
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp = output.with_name(f".{output.name}.tmp")
+    ds.to_netcdf(tmp)
+    tmp.replace(output)
+
+
+def derive(
+    spec_file: Union[str, Path] = "derived_testdata.json",
+    registry: Union[str, Path] = "data/registry.txt",
+    force: bool = False,
+    readme: Union[str, Path] = "README.md",
+) -> dict:
+    """Generate the derived files whose source or spec changed, and register them.
+
+    Parameters
+    ----------
+    spec_file : str or Path
+        The JSON file declaring the derived files.
+    registry : str or Path
+        The registry file. The sources and derived files are found in its folder.
+    force : bool
+        Whether to regenerate every derived file.
+    readme : str or Path
+        The README file holding the table of files, updated with the same entries as the registry.
+
+    Returns
+    -------
+    dict
+        The provenance of the derived files, keyed by path relative to `data/derived/`.
+    """
+    registry = Path(registry)
+    data_folder = registry.parent
+    folder = data_folder.joinpath(DERIVED_FOLDER)
+    provenance_file = folder.joinpath(PROVENANCE_FILE)
+
+    with Path(spec_file).open(encoding="utf-8") as f:
+        specs = json.load(f)
+    previous = dict()
+    if provenance_file.exists():
+        with provenance_file.open(encoding="utf-8") as f:
+            previous = json.load(f)
+
+    provenance = dict()
+    generated = 0
+    for name, spec in sorted(specs.items()):
+        output = folder.joinpath(name)
+        entry = dict(
+            source=spec["source"],
+            source_sha256=file_sha256_checksum(data_folder.joinpath(spec["source"])),
+            spec=spec,
+            spec_sha256=spec_hash(spec),
+        )
+        old = previous.get(name, {})
+        if (
+            not force
+            and output.exists()
+            and old.get("source_sha256") == entry["source_sha256"]
+            and old.get("spec_sha256") == entry["spec_sha256"]
+            and old.get("sha256") == file_sha256_checksum(output)
+        ):
+            provenance[name] = old
+            continue
+        print(f"Deriving {name} from {spec['source']}.")
+        derive_file(data_folder.joinpath(spec["source"]), output, spec)
+        entry["sha256"] = file_sha256_checksum(output)
+        provenance[name] = entry
+        generated += 1
+
+    removed = sorted(set(previous) - set(provenance))
+    for name in removed:
+        folder.joinpath(name).unlink(missing_ok=True)
+        print(f"Removed {name}, which is no longer in {spec_file}.")
+
+    folder.mkdir(parents=True, exist_ok=True)
+    with provenance_file.open("w", encoding="utf-8") as f:
+        json.dump(provenance, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+    entries = {
+        f"{DERIVED_FOLDER}/{name}": f"sha256:{entry['sha256']}"
+        for name, entry in provenance.items()
+    }
+    entries.update({f"{DERIVED_FOLDER}/{name}": None for name in removed})
+    entries[
+        f"{DERIVED_FOLDER}/{PROVENANCE_FILE}"
+    ] = f"sha256:{file_sha256_checksum(provenance_file)}"
+    update_registry(entries, registry)
+    update_readme(entries, readme, data_folder)
+    print(
+        f"Generated {generated} derived files, {len(provenance) - generated} up to date."
+    )
+    return provenance
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate the small derived test files declared in derived_testdata.json."
+    )
+    parser.add_argument("--spec", default="derived_testdata.json")
+    parser.add_argument("--registry", default="data/registry.txt")
+    parser.add_argument("--readme", default="README.md")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate every derived file, even if its source and spec are unchanged.",
+    )
+    args = parser.parse_args()
+    derive(args.spec, args.registry, args.force, args.readme)
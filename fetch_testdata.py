@@ -0,0 +1,498 @@
+#!/usr/bin/env python
+"""
+Download the registered test data files, concurrently, into a content-addressed local cache.
+
+Files listed in `data/registry.txt` (or in the registry of a given branch or commit) are downloaded with a pool of
+keep-alive HTTP connections, hashed while they are streamed, and stored in the cache under their checksum
+(`{cache}/objects/sha256/ab/abcdef...`). Files already in the cache are never downloaded again, whatever the
+branch they come from. Interrupted downloads are resumed with HTTP Range requests, and timeouts and dropped
+connections are retried. The requested files are then exposed in a view of the branch, `{cache}/views/{branch}`,
+mirroring `data/` with hard links (or symbolic links, or copies) to the cached objects. Switching branches or
+pinning a commit only downloads the files whose contents differ, and each branch keeps its own view. The files that
+the registry no longer lists are removed from the view, but only those linked there by this script, as recorded in
+`{view}/.fetched.json`. A folder given with `--destination` is never pruned.
+
+    python fetch_testdata.py --branch main "sdba/*" "ERA5/*"
+
+With `--history`, the registry of any commit or tag is read from the registry history written by
+`report_check_sums.py --history` (`registry_history.txt` and `registry_commits.txt`), instead of downloading the
+`registry.txt` of that commit. The history is not committed: it is read from a local folder where it was generated,
+or from a URL such as the assets of the latest release, to which it is attached when the release is published.
+
+Only the standard library is needed. Any HTTP server can stand in for GitHub, e.g. `python -m http.server`
+started in the repository, with `--base-url http://localhost:8000/data`.
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Optional, Union
+from urllib.parse import urljoin, urlsplit
+
+from report_check_sums import (
+    CHUNK_SIZE,
+    COMMITS_FILE,
+    HISTORY_FILE,
+    file_checksums,
+    read_registry,
+    registry_at,
+)
+
+GITHUB_RAW_URL = "https://raw.githubusercontent.com/Ouranosinc/xclim-testdata"
+DEFAULT_CACHE = Path(
+    os.environ.get("XCLIM_TESTDATA_CACHE", Path.home() / ".cache" / "xclim-testdata")
+)
+
+# Timeout of the connections, in seconds
+TIMEOUT = 60
+
+# Number of times a download is attempted again after a timeout or a dropped connection, and the delay before the
+# first retry, in seconds, doubled after each attempt
+RETRIES = 3
+RETRY_DELAY = 1.0
+
+# Errors after which a download is attempted again, resuming from the bytes already received
+RETRIED_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    socket.timeout,
+    http.client.HTTPException,
+)
+
+# Hidden file of each view listing the files linked there, the only ones that are removed from it
+VIEW_MANIFEST = ".fetched.json"
+
+_connections = threading.local()
+
+
+class HTTPError(OSError):
+    """An HTTP error response, with its status."""
+
+    def __init__(self, url: str, status: int):
+        super().__init__(f"Failed to download {url}: HTTP {status}.")
+        self.status = status
+
+
+def _get_connection(scheme: str, netloc: str) -> http.client.HTTPConnection:
+    """Return the keep-alive connection of the current thread to a server, creating it if needed."""
+    pool = _connections.__dict__.setdefault("pool", dict())
+    if (scheme, netloc) not in pool:
+        cls = (
+            http.client.HTTPSConnection
+            if scheme == "https"
+            else http.client.HTTPConnection
+        )
+        pool[(scheme, netloc)] = cls(netloc, timeout=TIMEOUT)
+    return pool[(scheme, netloc)]
+
+
+def _close_connections() -> None:
+    """Close the connections of the current thread, e.g. after an error left a response partially read."""
+    for conn in _connections.__dict__.pop("pool", dict()).values():
+        conn.close()
+
+
+def _request(url: str, headers: Optional[dict] = None, redirects: int = 5):
+    """Send a GET request on a pooled connection, following redirects.
+
+    The response body must be read entirely before the connection can be reused.
+    """
+    for _ in range(redirects + 1):
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        for attempt in range(2):
+            conn = _get_connection(parts.scheme, parts.netloc)
+            try:
+                conn.request("GET", path, headers=headers or {})
+                response = conn.getresponse()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the kept-alive connection; reconnect once
+                conn.close()
+                if attempt:
+                    raise
+        if response.status in (301, 302, 303, 307, 308):
+            response.read()
+            url = urljoin(url, response.getheader("Location"))
+            continue
+        if response.status >= 400:
+            response.read()
+            raise HTTPError(url, response.status)
+        return response
+    raise OSError(f"Too many redirects for {url}.")
+
+
+def object_path(file_hash: str, cache_dir: Union[str, Path] = DEFAULT_CACHE) -> Path:
+    """Return the location of a file in the content-addressed cache.
+
+    Parameters
+    ----------
+    file_hash : str
+        The hash of the file, e.g. "sha256:abcdef...".
+    cache_dir : str or Path
+        The cache folder.
+    """
+    algorithm, digest = file_hash.split(":")
+    return Path(cache_dir).joinpath("objects", algorithm, digest[:2], digest)
+
+
+def _content_range_start(response) -> Optional[int]:
+    """Return the first byte of a partial response, from its Content-Range header."""
+    match = re.match(r"bytes (\d+)-", response.getheader("Content-Range") or "")
+    return int(match.group(1)) if match else None
+
+
+def _download_partial(url: str, algorithm: str, digest: str, partial: Path):
+    """Download a file into a partial file, resuming from the bytes it already holds.
+
+    The partial file is restarted from scratch if the server cannot serve the requested range (HTTP 416, e.g. when
+    it is longer than the file), or answers with another range.
+
+    Returns
+    -------
+    hashlib object
+        The hash of the partial file.
+    """
+    h = hashlib.new(algorithm)
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    offset = 0
+    if partial.exists():
+        with partial.open("rb", buffering=0) as f:
+            while n := f.readinto(buffer):
+                h.update(view[:n])
+                offset += n
+        if h.hexdigest() == digest:
+            # The previous attempt was interrupted after the download was complete
+            return h
+
+    try:
+        response = _request(url, {"Range": f"bytes={offset}-"} if offset else None)
+    except HTTPError as err:
+        if err.status != 416 or not offset:
+            raise
+        partial.unlink()
+        return _download_partial(url, algorithm, digest, partial)
+    if response.status == 206 and _content_range_start(response) != offset:
+        # The body does not continue the partial file, and is not read
+        _close_connections()
+        if not offset:
+            raise OSError(f"Failed to download {url}: unexpected partial content.")
+        partial.unlink()
+        return _download_partial(url, algorithm, digest, partial)
+    if response.status != 206:
+        # Full content: the server ignored or does not support the Range request
+        h = hashlib.new(algorithm)
+    with partial.open("ab" if response.status == 206 else "wb") as f:
+        while n := response.readinto(buffer):
+            h.update(view[:n])
+            f.write(view[:n])
+    if response.length:
+        # http.client stops silently when the connection is closed before the end of the body
+        raise http.client.IncompleteRead(b"", response.length)
+    return h
+
+
+def download(
+    url: str,
+    file_hash: str,
+    cache_dir: Union[str, Path] = DEFAULT_CACHE,
+    retries: int = RETRIES,
+) -> Path:
+    """Download a file into the content-addressed cache, unless it is already there.
+
+    The file is hashed while it is streamed to disk. A partial download left by a previous attempt is resumed with
+    a Range request, and restarted if the server does not support them or cannot serve the range. Timeouts and
+    dropped connections are retried, resuming from the bytes already received.
+
+    Parameters
+    ----------
+    url : str
+        The URL of the file.
+    file_hash : str
+        The expected hash, e.g. "sha256:abcdef...".
+    cache_dir : str or Path
+        The cache folder.
+    retries : int
+        Number of times the download is attempted again after a timeout or a dropped connection.
+
+    Returns
+    -------
+    Path
+        The location of the file in the cache.
+    """
+    target = object_path(file_hash, cache_dir)
+    if target.exists():
+        return target
+
+    algorithm, digest = file_hash.split(":")
+    partial = Path(cache_dir).joinpath("partial", f"{algorithm}-{digest}")
+    partial.parent.mkdir(parents=True, exist_ok=True)
+
+    for attempt in range(retries + 1):
+        try:
+            h = _download_partial(url, algorithm, digest, partial)
+            break
+        except RETRIED_ERRORS:
+            _close_connections()
+            if attempt == retries:
+                raise
+            time.sleep(RETRY_DELAY * 2**attempt)
+
+    if h.hexdigest() != digest:
+        partial.unlink()
+        raise OSError(f"Checksum of {url} does not match {file_hash}.")
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(partial, target)
+    return target
+
+
+def _link(source: Path, destination: Path, mode: str = "hard") -> None:
+    """Link a cached object to its destination, copying it if linking is not possible.
+
+    `mode` is "hard", "symbolic" or "copy".
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if destination.exists() or destination.is_symlink():
+        if (
+            mode != "copy"
+            and destination.exists()
+            and os.path.samefile(source, destination)
+        ):
+            return
+        destination.unlink()
+    try:
+        if mode == "hard":
+            os.link(source, destination)
+        elif mode == "symbolic":
+            os.symlink(source.resolve(), destination)
+        else:
+            shutil.copyfile(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def _is_linked(file: Path, file_hash: str, cache_dir: Union[str, Path]) -> bool:
+    """Return True if a file is still a link to (or a copy of) the cached object of a hash."""
+    if not file.is_file():
+        return False
+    try:
+        if os.path.samefile(object_path(file_hash, cache_dir), file):
+            return True
+    except OSError:
+        pass
+    algorithm, digest = file_hash.split(":")
+    return (
+        not file.is_symlink() and file_checksums(file, [algorithm])[algorithm] == digest
+    )
+
+
+def _update_view(
+    view: Path,
+    entries: dict[str, str],
+    registered: dict[str, str],
+    cache_dir: Union[str, Path],
+) -> int:
+    """Record the files linked into a view, and remove the ones linked before that the registry no longer lists.
+
+    Only the files listed in the manifest of the view, and still linked to their cached object, are removed, so files
+    added to the view by hand are kept.
+
+    Parameters
+    ----------
+    view : Path
+        The view.
+    entries : dict
+        The files just linked into the view, with their hash.
+    registered : dict
+        The registry of the view.
+    cache_dir : str or Path
+        The content-addressed cache folder.
+
+    Returns
+    -------
+    int
+        The number of removed files.
+    """
+    manifest = view.joinpath(VIEW_MANIFEST)
+    try:
+        linked = json.loads(manifest.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        linked = dict()
+    removed = 0
+    for name, file_hash in list(linked.items()):
+        if name in entries or registered.get(name) == file_hash:
+            continue
+        del linked[name]
+        file = view.joinpath(name)
+        if _is_linked(file, file_hash, cache_dir):
+            file.unlink()
+            removed += 1
+            # Remove the folders left empty, up to the view
+            for folder in file.parents:
+                if folder == view or any(folder.iterdir()):
+                    break
+                folder.rmdir()
+    linked.update(entries)
+    view.mkdir(parents=True, exist_ok=True)
+    manifest.write_text(json.dumps(linked, indent=0, sort_keys=True), encoding="utf-8")
+    return removed
+
+
+def _history_registry(
+    history: Union[str, Path], ref: str, cache_dir: Union[str, Path]
+) -> dict[str, str]:
+    """Return the registry of a commit or tag from the registry history in a local folder or at a URL."""
+    if "://" in str(history):
+        folder = Path(cache_dir).joinpath("history")
+        folder.mkdir(parents=True, exist_ok=True)
+        for name in (HISTORY_FILE, COMMITS_FILE):
+            response = _request(f"{str(history).rstrip('/')}/{name}")
+            folder.joinpath(name).write_bytes(response.read())
+        history = folder
+    return registry_at(history, ref)
+
+
+def fetch(
+    patterns: Optional[list[str]] = None,
+    branch: str = "main",
+    base_url: Optional[str] = None,
+    registry: Union[str, Path, None] = None,
+    destination: Union[str, Path, None] = None,
+    cache_dir: Union[str, Path] = DEFAULT_CACHE,
+    jobs: int = 8,
+    history: Union[str, Path, None] = None,
+    link: str = "hard",
+) -> dict[str, Path]:
+    """Download the registered files matching some patterns and link them into a view of the branch.
+
+    Parameters
+    ----------
+    patterns : list of str, optional
+        Glob patterns of the files to fetch, relative to `data/`. Defaults to every registered file.
+    branch : str
+        Branch, tag or commit hash of `xclim-testdata` to fetch the data from.
+    base_url : str, optional
+        URL of the `data/` folder. Defaults to the GitHub URL of `branch`.
+    registry : str or Path, optional
+        A local registry file. Defaults to the `registry.txt` found at `base_url`.
+    destination : str or Path, optional
+        The folder in which the files are linked, mirroring `data/`. Defaults to `{cache_dir}/views/{branch}`, from
+        which the files linked by a previous call and no longer registered are removed. Other folders are not pruned.
+    cache_dir : str or Path
+        The content-addressed cache folder.
+    jobs : int
+        Number of concurrent downloads.
+    history : str or Path, optional
+        Folder or URL holding the registry history. If given, the registry of `branch`, which can then be any
+        commit or tag of the history, is read from it.
+    link : {"hard", "symbolic", "copy"}
+        How the cached files are exposed in the destination folder.
+
+    Returns
+    -------
+    dict
+        Mapping of the fetched file names to their path in `destination`.
+    """
+    base_url = (base_url or f"{GITHUB_RAW_URL}/{branch}/data").rstrip("/")
+    if registry is not None:
+        registered = read_registry(Path(registry))
+    elif history is not None:
+        registered = _history_registry(history, branch, cache_dir)
+    else:
+        response = _request(f"{base_url}/registry.txt")
+        registry = Path(cache_dir).joinpath(
+            "registries", f"{branch.replace('/', '_')}.txt"
+        )
+        registry.parent.mkdir(parents=True, exist_ok=True)
+        registry.write_bytes(response.read())
+        registered = read_registry(registry)
+    entries = {
+        name: file_hash
+        for name, file_hash in registered.items()
+        if not patterns or any(fnmatch(name, pattern) for pattern in patterns)
+    }
+    # Only the views managed by this script are pruned, never a folder given as destination
+    view = destination is None
+    destination = Path(
+        destination or Path(cache_dir).joinpath("views", branch.replace("/", "_"))
+    )
+
+    # Files with identical contents are downloaded once
+    sources = {file_hash: name for name, file_hash in entries.items()}
+    cached = sum(object_path(h, cache_dir).exists() for h in sources)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        objects = dict(
+            zip(
+                sources,
+                executor.map(
+                    lambda item: download(f"{base_url}/{item[1]}", item[0], cache_dir),
+                    sources.items(),
+                ),
+            )
+        )
+
+    paths = dict()
+    for name, file_hash in entries.items():
+        paths[name] = destination.joinpath(name)
+        _link(objects[file_hash], paths[name], link)
+    print(
+        f"Fetched {len(paths)} files into {destination} "
+        f"({len(sources) - cached} downloaded, {cached} from cache)."
+    )
+    if view:
+        removed = _update_view(destination, entries, registered, cache_dir)
+        if removed:
+            print(f"Removed {removed} files that are no longer registered.")
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download registered xclim-testdata files into a content-addressed cache."
+    )
+    parser.add_argument(
+        "patterns",
+        nargs="*",
+        help="Glob patterns of the files to fetch, relative to data/ (default: all files).",
+    )
+    parser.add_argument("-b", "--branch", default="main", help="Branch, tag or commit.")
+    parser.add_argument(
+        "--base-url", help="URL of the data/ folder (overrides --branch)."
+    )
+    parser.add_argument("--registry", help="Use a local registry file.")
+    parser.add_argument(
+        "--history",
+        help="Folder or URL holding the registry history, to resolve the registry of any commit or tag.",
+    )
+    parser.add_argument(
+        "-d",
+        "--destination",
+        help="Folder in which the files are linked (default: {cache-dir}/views/{branch}).",
+    )
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE)
+    parser.add_argument("--link", choices=("hard", "symbolic", "copy"), default="hard")
+    parser.add_argument("-j", "--jobs", type=int, default=8)
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+    fetch(
+        args.patterns,
+        branch=args.branch,
+        base_url=args.base_url,
+        registry=args.registry,
+        destination=args.destination,
+        cache_dir=args.cache_dir,
+        jobs=args.jobs,
+        history=args.history,
+        link=args.link,
+    )
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+"""
+Find the compression settings of the registered NetCDF files that are the fastest to read for their size.
+
+Every NetCDF4 file of `data/registry.txt` is re-encoded under candidate settings (zlib levels, with and without the
+shuffle filter, with the current chunk layout or with chunks holding whole time series, as xclim reads them), plus an
+uncompressed, contiguous baseline. For each candidate, the script measures the size on disk and the time needed to
+read and decompress all the variables. The recommended setting is the fastest to read among those that do not make
+the file larger (up to a tolerance), if it is at least 10% faster than the current encoding. A per-file report is
+written to a JSON file.
+
+With `--apply`, the files for which a candidate beats their current encoding are replaced by their re-encoded
+version, after checking it holds the same variables, attributes and values. Only their entries in `data/registry.txt`
+and their rows in the README table are updated, so the entries of the files that are not checked out are kept.
+
+NetCDF3 files cannot be compressed and are left as they are. Requires xarray and netCDF4.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Optional, Union
+
+import netCDF4
+import numpy as np
+
+from report_check_sums import (
+    file_sha256_checksum,
+    read_registry,
+    update_readme,
+    update_registry,
+)
+
+# Candidate zlib levels
+LEVELS = (1, 4, 8)
+
+# Minimal ratio of the current read time over the read time of the recommended setting
+MIN_SPEEDUP = 1.1
+
+# Target size, in bytes, of the uncompressed chunks holding whole time series
+TIMESERIES_CHUNK_SIZE = 1024 * 1024
+
+
+def _open_raw(filename: Path):
+    """Open a dataset without decoding anything, so that variables are written back exactly as they are stored."""
+    import xarray as xr
+
+    return xr.open_dataset(
+        filename, decode_cf=False, mask_and_scale=False, decode_times=False, cache=False
+    )
+
+
+def timeseries_chunks(
+    dims: tuple[str, ...],
+    shape: tuple[int, ...],
+    itemsize: int,
+    target: int = TIMESERIES_CHUNK_SIZE,
+) -> Optional[tuple[int, ...]]:
+    """Return chunks holding the whole time axis, with the other dimensions split to stay under a target size.
+
+    Parameters
+    ----------
+    dims : tuple of str
+        The dimensions of the variable.
+    shape : tuple of int
+        The shape of the variable.
+    itemsize : int
+        The size of an element, in bytes.
+    target : int
+        Target size of a chunk, in bytes.
+
+    Returns
+    -------
+    tuple of int or None
+        The chunk shape, or None if the variable has no time dimension.
+    """
+    if "time" not in dims or 0 in shape:
+        return None
+    chunks = list(shape)
+    while np.prod(chunks) * itemsize > target:
+        # Halve the largest non-time dimension
+        others = [i for i, dim in enumerate(dims) if dim != "time" and chunks[i] > 1]
+        if not others:
+            break
+        i = max(others, key=lambda i: chunks[i])
+        chunks[i] = -(-chunks[i] // 2)
+    return tuple(chunks)
+
+
+def candidate_settings() -> dict[str, dict]:
+    """Return the candidate settings, by name."""
+    candidates = {"none-contiguous": dict(level=0, shuffle=False, chunks="contiguous")}
+    for level in LEVELS:
+        for shuffle in (False, True):
+            for chunks in ("current", "timeseries"):
+                name = f"zlib{level}{'-shuffle' if shuffle else ''}-{chunks}"
+                candidates[name] = dict(level=level, shuffle=shuffle, chunks=chunks)
+    return candidates
+
+
+def encode(
+    filename: Path, output: Path, level: int, shuffle: bool, chunks: str
+) -> None:
+    """Write a copy of a NetCDF4 file with other compression settings.
+
+    Dimensions, variables and attributes are copied as they are stored, with netCDF4, so that only their
+    compression and chunking change.
+
+    Parameters
+    ----------
+    filename : Path
+        The file to re-encode.
+    output : Path
+        The file to write.
+    level : int
+        The zlib compression level. 0 disables compression.
+    shuffle : bool
+        Whether to apply the shuffle filter before compression.
+    chunks : {"contiguous", "current", "timeseries"}
+        The chunk layout: none, the layout of the original file, or whole time series.
+    """
+    with netCDF4.Dataset(filename) as src, netCDF4.Dataset(
+        output, "w", format=src.data_model
+    ) as dst:
+        src.set_auto_maskandscale(False)
+        dst.setncatts(src.__dict__)
+        for name, dim in src.dimensions.items():
+            dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+        for name, var in src.variables.items():
+            numeric = isinstance(var.dtype, np.dtype) and var.dtype.kind in "biuf"
+            compress = level > 0 and numeric and var.ndim > 0
+            # Variables along an unlimited dimension must be chunked
+            unlimited = any(src.dimensions[dim].isunlimited() for dim in var.dimensions)
+            chunksizes = None
+            if chunks == "current" and var.chunking() not in (None, "contiguous"):
+                chunksizes = var.chunking()
+            elif chunks == "timeseries" and numeric:
+                chunksizes = timeseries_chunks(
+                    var.dimensions, var.shape, var.dtype.itemsize
+                )
+            out = dst.createVariable(
+                name,
+                var.datatype,
+                var.dimensions,
+                zlib=compress,
+                complevel=level if compress else 4,
+                shuffle=shuffle and compress,
+                chunksizes=chunksizes,
+                contiguous=chunks == "contiguous" and not compress and not unlimited,
+                fill_value=var.__dict__.get("_FillValue"),
+            )
+            out.set_auto_maskandscale(False)
+            out.setncatts({k: v for k, v in var.__dict__.items() if k != "_FillValue"})
+            out[...] = var[...]
+
+
+def read_time(filename: Path, repeat: int = 5) -> float:
+    """Return the median time needed to read and decompress all the variables of a file, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with _open_raw(filename) as ds:
+            ds.load()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def _equal(a, b) -> bool:
+    """Return whether two arrays or attribute values are equal, NaNs included."""
+    a, b = np.asarray(a), np.asarray(b)
+    return np.array_equal(a, b, equal_nan=a.dtype.kind in "fc" and b.dtype.kind in "fc")
+
+
+def compare_values(original: Path, recompressed: Path) -> list[str]:
+    """Return the names of the variables whose dimensions, attributes or stored values differ between two files."""
+    differences = []
+    with _open_raw(original) as a, _open_raw(recompressed) as b:
+        if a.attrs.keys() != b.attrs.keys() or not all(
+            _equal(a.attrs[k], b.attrs[k]) for k in a.attrs
+        ):
+            differences.append("global attributes")
+        for name in set(a.variables) | set(b.variables):
+            if name not in a.variables or name not in b.variables:
+                differences.append(name)
+                continue
+            va, vb = a[name].variable, b[name].variable
+            if (
+                va.dims != vb.dims
+                or va.dtype != vb.dtype
+                or va.attrs.keys() != vb.attrs.keys()
+                or not all(_equal(va.attrs[k], vb.attrs[k]) for k in va.attrs)
+                or not _equal(va.values, vb.values)
+            ):
+                differences.append(name)
+    return sorted(differences)
+
+
+def evaluate_file(
+    filename: Path, workdir: Path, repeat: int = 5, tolerance: float = 1.0
+) -> dict:
+    """Measure the size and read time of a file under its current encoding and under every candidate setting.
+
+    Parameters
+    ----------
+    filename : Path
+        The NetCDF4 file.
+    workdir : Path
+        Folder in which the candidates are written.
+    repeat : int
+        Number of timed reads of each candidate.
+    tolerance : float
+        Maximal ratio of the size of the recommended setting over the current size.
+
+    Returns
+    -------
+    dict
+        The size (bytes), read time (s) and throughput (uncompressed MB/s) of the current encoding and of each
+        candidate, with the name of the recommended one ("current" if no candidate is better).
+    """
+    with _open_raw(filename) as ds:
+        nbytes = ds.nbytes
+
+    def measure(path: Path) -> dict:
+        seconds = read_time(path, repeat)
+        return dict(
+            size=path.stat().st_size,
+            read_time=seconds,
+            throughput=nbytes / seconds / 1e6,
+        )
+
+    results = dict(current=measure(filename))
+    for name, settings in candidate_settings().items():
+        output = workdir.joinpath(f"{name}.nc")
+        encode(filename, output, **settings)
+        results[name] = dict(settings, **measure(output))
+        output.unlink()
+
+    # The fastest setting that does not grow the file beyond the tolerance
+    current = results["current"]
+    recommended = min(
+        (
+            name
+            for name, result in results.items()
+            if result["size"] <= tolerance * current["size"]
+        ),
+        key=lambda name: results[name]["read_time"],
+    )
+    # Keep the current encoding unless the gain is larger than the timing noise
+    if results[recommended]["read_time"] * MIN_SPEEDUP > current["read_time"]:
+        recommended = "current"
+    return dict(nbytes=nbytes, recommended=recommended, candidates=results)
+
+
+def recompress(
+    patterns: Optional[list[str]] = None,
+    registry: Union[str, Path] = "data/registry.txt",
+    repeat: int = 5,
+    tolerance: float = 1.0,
+    apply: bool = False,
+    readme: Union[str, Path] = "README.md",
+) -> dict:
+    """Evaluate the candidate compression settings of the registered NetCDF4 files, and optionally apply them.
+
+    Parameters
+    ----------
+    patterns : list of str, optional
+        Glob patterns of the files to evaluate, relative to `data/`. Defaults to all NetCDF files.
+    registry : str or Path
+        The registry file.
+    repeat : int
+        Number of timed reads of each candidate.
+    tolerance : float
+        Maximal ratio of the size of the recommended setting over the current size.
+    apply : bool
+        Whether to replace the files by their recommended encoding, after checking their values,
+        and update their entries in the registry and their rows in the README.
+    readme : str or Path
+        The README file holding the table of files.
+
+    Returns
+    -------
+    dict
+        The report, keyed by file path relative to `data/`.
+    """
+    registry = Path(registry)
+    report = dict()
+    applied = []
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = Path(workdir)
+        for name in sorted(read_registry(registry)):
+            file = registry.parent.joinpath(name)
+            if not name.endswith(".nc") or (
+                patterns and not any(fnmatch(name, pattern) for pattern in patterns)
+            ):
+                continue
+            if not file.exists():
+                print(f"Skipping missing file: {name}")
+                continue
+            with netCDF4.Dataset(file) as nc:
+                if not nc.data_model.startswith("NETCDF4"):
+                    print(f"Skipping {nc.data_model} file: {name}")
+                    continue
+                if nc.groups:
+                    print(f"Skipping file with groups: {name}")
+                    continue
+
+            entry = report[name] = evaluate_file(file, workdir, repeat, tolerance)
+            best, current = (
+                entry["candidates"][entry["recommended"]],
+                entry["candidates"]["current"],
+            )
+            print(
+                f"{name}: {entry['recommended']} "
+                f"({current['size']} -> {best['size']} bytes, "
+                f"{current['throughput']:.1f} -> {best['throughput']:.1f} MB/s)"
+            )
+
+            if apply and entry["recommended"] != "current":
+                output = workdir.joinpath("recompressed.nc")
+                settings = {k: best[k] for k in ("level", "shuffle", "chunks")}
+                encode(file, output, **settings)
+                differences = compare_values(file, output)
+                if differences:
+                    print(
+                        f"Not replacing {name}, its re-encoded version differs: {', '.join(differences)}."
+                    )
+                    continue
+                os.replace(output, file)
+                applied.append(name)
+
+    if applied:
+        # Only the replaced files are updated, so the entries of files that are not checked out are kept
+        entries = {
+            name: f"sha256:{file_sha256_checksum(registry.parent.joinpath(name))}"
+            for name in applied
+        }
+        update_registry(entries, registry)
+        update_readme(entries, readme, registry.parent)
+        print(f"Recompressed {len(applied)} files, updated {registry} and {readme}.")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find the compression settings of the NetCDF files of data/registry.txt that are the fastest to read."
+    )
+    parser.add_argument(
+        "patterns",
+        nargs="*",
+        help="Glob patterns of the files to evaluate, relative to data/ (e.g. 'sdba/*').",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.0,
+        help="Maximal ratio of the size of the recommended setting over the current size (default: 1.0).",
+    )
+    parser.add_argument("-o", "--output", default="recompress_report.json")
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help=(
+            "Replace the files by their recommended encoding, after checking their values, "
+            "and update their entries in data/registry.txt and the README."
+        ),
+    )
+    args = parser.parse_args()
+
+    output = recompress(
+        args.patterns, repeat=args.repeat, tolerance=args.tolerance, apply=args.apply
+    )
+    with Path(args.output).open("w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(f"Successfully wrote the report of {len(output)} files to {args.output}.")
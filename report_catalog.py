@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Build a metadata catalog of the registered files, reading only the NetCDF headers.
+
+For every file listed in `data/registry.txt`, the catalog (`data/catalog.json`) lists its checksum, size, format,
+dimensions, variables (dims, shape, dtype, units, chunk layout and filters) and, when there is a time coordinate,
+its calendar and first/last timestamps. Only the headers and the first and last time values are read, so test
+fixtures can select or skip datasets without opening them with xarray.
+
+Requires netCDF4 and cftime.
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Optional, Union
+
+import cftime
+import netCDF4
+import numpy as np
+
+from report_check_sums import read_registry
+
+
+def _to_json(value):
+    """Convert netCDF4 attribute values to JSON-serializable objects."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+
+def describe_variable(var: netCDF4.Variable) -> dict:
+    """Return the header information of a NetCDF variable.
+
+    Parameters
+    ----------
+    var : netCDF4.Variable
+        The variable.
+    """
+    chunking = var.chunking()
+    return dict(
+        dims=list(var.dimensions),
+        shape=list(var.shape),
+        dtype=str(var.dtype),
+        units=_to_json(getattr(var, "units", None)),
+        standard_name=_to_json(getattr(var, "standard_name", None)),
+        chunks=chunking if chunking in (None, "contiguous") else list(chunking),
+        filters={k: _to_json(v) for k, v in (var.filters() or {}).items() if v},
+    )
+
+
+def describe_time(ds: netCDF4.Dataset) -> Optional[dict]:
+    """Return the calendar and bounds of the time coordinate, reading only its first and last values.
+
+    Parameters
+    ----------
+    ds : netCDF4.Dataset
+        The opened dataset.
+    """
+    time = ds.variables.get("time")
+    if time is None or not hasattr(time, "units") or time.size == 0:
+        return None
+    calendar = getattr(time, "calendar", "standard")
+    start, end = cftime.num2date(
+        [time[0], time[-1]],
+        time.units,
+        calendar=calendar,
+        only_use_cftime_datetimes=True,
+    )
+    return dict(
+        units=time.units,
+        calendar=calendar,
+        size=time.size,
+        start=start.isoformat(),
+        end=end.isoformat(),
+    )
+
+
+def describe_file(filename: Path) -> dict:
+    """Return the catalog entry of a NetCDF file.
+
+    Parameters
+    ----------
+    filename : Path
+        The path to the file.
+    """
+    with netCDF4.Dataset(filename) as ds:
+        return dict(
+            format=ds.data_model,
+            dims={name: len(dim) for name, dim in ds.dimensions.items()},
+            variables={
+                name: describe_variable(var) for name, var in ds.variables.items()
+            },
+            time=describe_time(ds),
+        )
+
+
+def build_catalog(
+    registry: Union[str, Path] = "data/registry.txt",
+    output: Union[str, Path] = "data/catalog.json",
+) -> dict:
+    """Write the metadata catalog of the files in the registry.
+
+    Parameters
+    ----------
+    registry : str or Path
+        The registry file.
+    output : str or Path
+        The catalog file to write.
+
+    Returns
+    -------
+    dict
+        The catalog, keyed by file path relative to `data/`.
+    """
+    registry = Path(registry)
+    data_folder = registry.parent
+    catalog = dict()
+    for name, file_hash in sorted(read_registry(registry).items()):
+        file = data_folder.joinpath(name)
+        if not file.exists():
+            print(f"Skipping missing file: {name}")
+            continue
+        entry = dict(hash=file_hash, size=file.stat().st_size)
+        if file.suffix == ".nc":
+            entry.update(describe_file(file))
+        else:
+            entry["format"] = file.suffix.lstrip(".")
+        catalog[name] = entry
+
+    output = Path(output)
+    with output.open("w", encoding="utf-8") as f:
+        json.dump(catalog, f, indent=2)
+        f.write("\n")
+    print(f"Successfully wrote {len(catalog)} entries to {output}.")
+    return catalog
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the header-only metadata catalog of the files in data/registry.txt."
+    )
+    parser.add_argument("--registry", default="data/registry.txt")
+    parser.add_argument("--output", default="data/catalog.json")
+    args = parser.parse_args()
+    build_catalog(args.registry, args.output)
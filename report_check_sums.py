@@ -1,8 +1,34 @@
 #!/usr/bin/env python
+import argparse
 import hashlib
+import json
 import math
+import os
+import subprocess
+import sys
+import time
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Union
+from typing import Optional, Union
+
+# Size of the buffer used to stream files through the hashing algorithms
+CHUNK_SIZE = 1024 * 1024
+
+# Default size of the blocks listed in the block manifests
+BLOCK_SIZE = 1024 * 1024
+
+# Suffix of the block manifests written next to each data file
+MANIFEST_SUFFIX = ".blocks.json"
+
+# Hidden sidecar holding the checksums of the previous run, keyed on file stat metadata
+CACHE_FILE = ".registry_cache.json"
+
+# Sorted `{commit} {path} {hash}` lines of the registry of every distinct registry version in the git history
+HISTORY_FILE = "registry_history.txt"
+
+# Sorted `{commit or tag} {commit}` lines mapping each commit and tag to the commit listed in the history file
+COMMITS_FILE = "registry_commits.txt"
 
 
 def file_size_formatter(i: int, binary: bool = True, precision: int = 1) -> str:
@@ -24,12 +50,193 @@ def file_size_formatter(i: int, binary: bool = True, precision: int = 1) -> str:
     return f"{value:.{precision}f} {suffix}"
 
 
+def file_checksums(
+    filename: Path,
+    algorithms: Sequence[str] = ("sha256",),
+    chunk_size: int = CHUNK_SIZE,
+) -> dict[str, str]:
+    """Return the checksums of a file for several hashing algorithms in a single pass.
+
+    The file is streamed through a single preallocated buffer, so memory usage does not depend on the file size.
+
+    Parameters
+    ----------
+    filename : Path
+        The path to the file.
+    algorithms : sequence of str
+        Names of `hashlib` algorithms, e.g. "sha256", "md5" or "blake2b".
+    chunk_size : int
+        Size of the read buffer, in bytes.
+
+    Returns
+    -------
+    dict
+        Mapping of algorithm names to hexadecimal digests. Prefixed with "{algorithm}:", these are valid `pooch` hashes.
+    """
+    hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with filename.open("rb", buffering=0) as f:
+        while n := f.readinto(buffer):
+            for h in hashes.values():
+                h.update(view[:n])
+    return {algorithm: h.hexdigest() for algorithm, h in hashes.items()}
+
+
 def file_sha256_checksum(filename: Path) -> str:
     """Return sha256 checksum for file."""
-    hash_sha256 = hashlib.sha256()
-    with filename.open("rb") as f:
-        hash_sha256.update(f.read())
-    return hash_sha256.hexdigest()
+    return file_checksums(filename, ["sha256"])["sha256"]
+
+
+def merkle_root(hashes: Sequence[str]) -> str:
+    """Return the Merkle root of a list of sha256 hexadecimal digests.
+
+    Nodes are the sha256 of the concatenation of their two children. An odd node at the end of a level is promoted
+    to the next level unchanged. The root of an empty list is the sha256 of an empty string.
+
+    Parameters
+    ----------
+    hashes : sequence of str
+        The leaf digests, in order.
+    """
+    level = [bytes.fromhex(h) for h in hashes]
+    if not level:
+        return hashlib.sha256(b"").hexdigest()
+    while len(level) > 1:
+        paired = [
+            hashlib.sha256(level[i] + level[i + 1]).digest()
+            for i in range(0, len(level) - 1, 2)
+        ]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0].hex()
+
+
+def block_manifest(filename: Path, block_size: int = BLOCK_SIZE) -> dict:
+    """Return the fixed-size block hashes of a file, with their Merkle root and the whole-file sha256.
+
+    Parameters
+    ----------
+    filename : Path
+        The path to the file.
+    block_size : int
+        Size of the blocks, in bytes. The last block may be shorter.
+    """
+    blocks = []
+    whole = hashlib.sha256()
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with filename.open("rb", buffering=0) as f:
+        while True:
+            n = 0
+            while n < block_size and (read := f.readinto(view[n:])):
+                n += read
+            if not n:
+                break
+            whole.update(view[:n])
+            blocks.append(hashlib.sha256(view[:n]).hexdigest())
+    return dict(
+        size=filename.stat().st_size,
+        block_size=block_size,
+        sha256=whole.hexdigest(),
+        merkle_root=merkle_root(blocks),
+        blocks=blocks,
+    )
+
+
+def verify_blocks(filename: Path, manifest: dict) -> list[int]:
+    """Return the indices of the blocks of a (possibly partial) file that do not match its manifest.
+
+    Blocks beyond the end of a truncated file are reported as invalid, so a downloader can resume by
+    fetching only the returned blocks.
+
+    Parameters
+    ----------
+    filename : Path
+        The path to the file.
+    manifest : dict
+        The block manifest of the complete file, as returned by `block_manifest`.
+    """
+    expected = manifest["blocks"]
+    actual = (
+        block_manifest(filename, manifest["block_size"])["blocks"]
+        if filename.exists()
+        else []
+    )
+    return [
+        i
+        for i, block_hash in enumerate(expected)
+        if i >= len(actual) or actual[i] != block_hash
+    ]
+
+
+def write_block_manifests(
+    file_checksums: dict[Path, str], block_size: int = BLOCK_SIZE
+) -> int:
+    """Write the block manifest of each file next to it, skipping those that are up to date.
+
+    Parameters
+    ----------
+    file_checksums : dict
+        Mapping of files to their sha256 checksum.
+    block_size : int
+        Size of the blocks, in bytes.
+
+    Returns
+    -------
+    int
+        The number of manifests written.
+    """
+    written = 0
+    for file, checksum in file_checksums.items():
+        manifest_file = file.with_name(file.name + MANIFEST_SUFFIX)
+        try:
+            with manifest_file.open(encoding="utf-8") as f:
+                current = json.load(f)
+            if current["sha256"] == checksum and current["block_size"] == block_size:
+                continue
+        except (OSError, ValueError, KeyError):
+            pass
+        with manifest_file.open("w", encoding="utf-8") as f:
+            json.dump(block_manifest(file, block_size), f, indent=0)
+        written += 1
+    return written
+
+
+def file_stat_signature(filename: Path) -> list[int]:
+    """Return the (size, mtime_ns, inode) signature used to detect modified files."""
+    stat = filename.stat()
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def load_checksum_cache(cache_file: Path) -> dict:
+    """Load the checksum cache, returning an empty cache if it is missing or unreadable.
+
+    Parameters
+    ----------
+    cache_file : Path
+        The path to the cache file.
+    """
+    try:
+        with cache_file.open(encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_checksum_cache(cache: dict, cache_file: Path) -> None:
+    """Write the checksum cache.
+
+    Parameters
+    ----------
+    cache : dict
+        Mapping of relative file paths to their stat signature and sha256 checksum.
+    cache_file : Path
+        The path to the cache file.
+    """
+    with cache_file.open("w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=0, sort_keys=True)
 
 
 def valid(path: Path) -> bool:
@@ -49,26 +256,489 @@ def valid(path: Path) -> bool:
     if any([p.startswith(".") for p in path.parts]):
         return False
 
-    # Exclude the registry
-    if path.name == "registry.txt":
+    # Exclude the registry, its history, the metadata catalog and the series index
+    if path.name in (
+        "registry.txt",
+        HISTORY_FILE,
+        COMMITS_FILE,
+        "catalog.json",
+        "series.json",
+    ):
+        return False
+
+    # Exclude the block manifests
+    if path.name.endswith(MANIFEST_SUFFIX):
         return False
 
-    if path.suffix == ".py":
+    # Exclude the scripts and the bytecode written when they are imported
+    if path.suffix in (".py", ".pyc") or "__pycache__" in path.parts:
         return False
 
     if path.is_file():
         return True
 
 
-def main(dry_run: bool = False, readme: Union[str, Path] = "README.md"):
-    """Create checksum files."""
+def hash_files(
+    files: Sequence[Path], jobs: Optional[int] = None, verbose: bool = True
+) -> dict[Path, str]:
+    """Compute the sha256 checksums of files concurrently.
+
+    Hashing is done in a thread pool: `hashlib` releases the GIL while digesting large buffers.
+
+    Parameters
+    ----------
+    files : sequence of Path
+        The files to hash.
+    jobs : int, optional
+        Number of threads. Defaults to the number of CPUs.
+    verbose : bool
+        Whether to print the progress and throughput of each file.
+
+    Returns
+    -------
+    dict
+        Mapping of files to their sha256 checksum, in the same order as `files`.
+    """
+
+    def _timed_checksum(file: Path) -> tuple[str, float]:
+        start = time.perf_counter()
+        checksum = file_sha256_checksum(file)
+        return checksum, time.perf_counter() - start
+
+    if not files:
+        return dict()
+
+    checksums = dict()
+    total_size = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        futures = {executor.submit(_timed_checksum, file): file for file in files}
+        for n, future in enumerate(as_completed(futures), start=1):
+            file = futures[future]
+            checksums[file], elapsed = future.result()
+            size = file.stat().st_size
+            total_size += size
+            if verbose:
+                print(
+                    f"[{n}/{len(files)}] {file.as_posix()} "
+                    f"({file_size_formatter(size)}, {size / max(elapsed, 1e-9) / 1e6:.1f} MB/s)"
+                )
+    if verbose:
+        elapsed = time.perf_counter() - start
+        print(
+            f"Hashed {file_size_formatter(total_size)} in {elapsed:.2f} s "
+            f"({total_size / max(elapsed, 1e-9) / 1e6:.1f} MB/s)."
+        )
+    return {file: checksums[file] for file in files}
+
+
+def read_registry(registry: Path) -> dict[str, str]:
+    """Read a registry file.
+
+    Parameters
+    ----------
+    registry : Path
+        The path to the registry file.
+
+    Returns
+    -------
+    dict
+        Mapping of file paths, relative to `data/`, to their hash (e.g. "sha256:...").
+    """
+    entries = dict()
+    with registry.open(encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            name, file_hash = line.split()[:2]
+            entries[name] = file_hash
+    return entries
+
+
+def update_registry(
+    entries: dict[str, Optional[str]], registry: Union[str, Path] = "data/registry.txt"
+) -> None:
+    """Add, replace or remove some entries of a registry file, keeping it sorted.
+
+    Unlike `main`, only the given entries are changed, so entries of files missing from the local copy are kept.
+
+    Parameters
+    ----------
+    entries : dict
+        Mapping of file paths, relative to `data/`, to their hash (e.g. "sha256:..."), or to None to remove them.
+    registry : str or Path
+        The registry file.
+    """
+    registry = Path(registry)
+    current = read_registry(registry)
+    for name, file_hash in entries.items():
+        if file_hash is None:
+            current.pop(name, None)
+        else:
+            current[name] = file_hash
+    with registry.open("w", encoding="utf-8") as out:
+        for name, file_hash in sorted(current.items()):
+            out.write(f"{name} {file_hash}\n")
+
+
+def _readme_row(name: str, size: int, file_hash: str) -> str:
+    """Return the row of a file in the table of files of the README."""
+    return f"| {name} | {file_size_formatter(size)} | {file_hash} |\n"
+
+
+def update_readme(
+    entries: dict[str, Optional[str]],
+    readme: Union[str, Path] = "README.md",
+    data_folder: Union[str, Path] = "data",
+) -> None:
+    """Add, replace or remove some rows of the table of files of the README, keeping its order.
+
+    Like `update_registry`, only the given entries are changed, so the rows of files missing from the local copy are
+    kept.
+
+    Parameters
+    ----------
+    entries : dict
+        Mapping of file paths, relative to `data/`, to their hash (e.g. "sha256:..."), or to None to remove them.
+    readme : str or Path
+        The README file holding the table of files written by `main`.
+    data_folder : str or Path
+        The folder of the files, whose sizes are given in the table.
+    """
+    readme = Path(readme)
+    with readme.open(encoding="utf-8") as f:
+        lines = f.readlines()
+
+    try:
+        # The rows follow the title, a blank line, the header and the separator of the table
+        start = lines.index("### Files\n") + 4
+    except ValueError:
+        raise ValueError(
+            f"Could not find '### Files' in {readme}, run report_check_sums.py first."
+        ) from None
+    end = start
+    while end < len(lines) and lines[end].startswith("|"):
+        end += 1
+
+    rows = {line.split("|")[1].strip(): line for line in lines[start:end]}
+    for name, file_hash in entries.items():
+        if file_hash is None:
+            rows.pop(name, None)
+        else:
+            size = Path(data_folder).joinpath(name).stat().st_size
+            rows[name] = _readme_row(name, size, file_hash)
+    # As written by `main`, in reverse order of the paths
+    lines[start:end] = [rows[name] for name in sorted(rows, key=Path, reverse=True)]
+
+    with readme.open("w", encoding="utf-8") as r:
+        r.writelines(lines)
+
+
+def _git(*args: str, stdin: Optional[str] = None) -> str:
+    """Run a git command and return its output."""
+    return subprocess.run(
+        ["git", *args], input=stdin, capture_output=True, text=True, check=True
+    ).stdout
+
+
+def build_history(
+    registry: Union[str, Path] = "data/registry.txt", ref: str = "HEAD"
+) -> tuple[int, int]:
+    """Write the history of the registry, from git, next to it.
+
+    Commits sharing the same registry (same git blob) are listed once in the history file, under their oldest commit.
+    The commits file maps every commit, and every tag, to that commit. Both files are sorted by line so that
+    `resolve_commit`, `registry_at` and `lookup_history` can search them in O(log n) without loading them.
+    Commits made after the files were generated are not included; their registry is `registry.txt` itself.
+
+    Parameters
+    ----------
+    registry : str or Path
+        The registry file, relative to the root of the git repository.
+    ref : str
+        The commit whose ancestors are included.
+
+    Returns
+    -------
+    int, int
+        The number of commits and of distinct registry versions.
+    """
+    registry = Path(registry)
+    commits = _git("rev-list", "--reverse", ref).split()
+    blobs = _git(
+        "cat-file",
+        "--batch-check",
+        stdin="".join(f"{commit}:{registry.as_posix()}\n" for commit in commits),
+    ).splitlines()
+
+    # The oldest commit of each version of the registry
+    versions = dict()
+    aliases = dict()
+    for commit, line in zip(commits, blobs):
+        blob, kind = line.split()[:2]
+        if kind != "blob":
+            # The registry does not exist at this commit
+            continue
+        aliases[commit] = versions.setdefault(blob, commit)
+
+    rows = []
+    for blob, commit in versions.items():
+        for line in _git("cat-file", "blob", blob).splitlines():
+            line = line.strip()
+            if line and not line.startswith("#"):
+                name, file_hash = line.split()[:2]
+                rows.append(f"{commit} {name} {file_hash}\n")
+    tags = _git(
+        "for-each-ref",
+        "--format=%(refname:short) %(objectname) %(*objectname)",
+        "refs/tags",
+    )
+    for line in tags.splitlines():
+        # Annotated tags also give the commit they point to
+        tag, *objects = line.split()
+        if objects[-1] in aliases:
+            aliases[tag] = aliases[objects[-1]]
+
+    with registry.with_name(HISTORY_FILE).open(
+        "w", encoding="utf-8", newline="\n"
+    ) as f:
+        f.writelines(sorted(rows))
+    with registry.with_name(COMMITS_FILE).open(
+        "w", encoding="utf-8", newline="\n"
+    ) as f:
+        f.writelines(sorted(f"{key} {commit}\n" for key, commit in aliases.items()))
+    return len(commits), len(versions)
+
+
+def _seek_line(f, key: bytes) -> None:
+    """Move to the first line of a sorted file that is not lower than a key, by binary search on the byte offsets."""
+    lo, hi = 0, f.seek(0, os.SEEK_END)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        # The first line starting at or after `mid`
+        f.seek(mid - 1 if mid else 0)
+        if mid:
+            f.readline()
+        line = f.readline()
+        if line and line < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    f.seek(lo - 1 if lo else 0)
+    if lo:
+        f.readline()
+
+
+def resolve_commit(folder: Union[str, Path], ref: str) -> str:
+    """Return the commit of the registry history holding the registry of a commit or tag.
+
+    Parameters
+    ----------
+    folder : str or Path
+        The folder holding the history files, usually `data/`.
+    ref : str
+        A commit hash, an unambiguous prefix of at least 4 characters, or a tag.
+    """
+    key = ref.encode("utf-8")
+    with Path(folder).joinpath(COMMITS_FILE).open("rb") as f:
+        _seek_line(f, key)
+        matches = []
+        for line in f:
+            name, commit = line.decode("utf-8").split()
+            if name == ref:
+                return commit
+            if not name.startswith(ref) or len(ref) < 4:
+                break
+            matches.append(commit)
+    if len(set(matches)) != 1:
+        raise KeyError(
+            f"{ref} is {'ambiguous' if matches else 'not'} in the registry history."
+        )
+    return matches[0]
+
+
+def registry_at(folder: Union[str, Path], ref: str) -> dict[str, str]:
+    """Return the registry of a commit or tag, read from the registry history.
+
+    Parameters
+    ----------
+    folder : str or Path
+        The folder holding the history files, usually `data/`.
+    ref : str
+        A commit hash, an unambiguous prefix or a tag.
+
+    Returns
+    -------
+    dict
+        Mapping of file paths, relative to `data/`, to their hash (e.g. "sha256:...").
+    """
+    commit = resolve_commit(folder, ref)
+    entries = dict()
+    with Path(folder).joinpath(HISTORY_FILE).open("rb") as f:
+        _seek_line(f, f"{commit} ".encode("utf-8"))
+        for line in f:
+            key, name, file_hash = line.decode("utf-8").split()
+            if key != commit:
+                break
+            entries[name] = file_hash
+    return entries
+
+
+def lookup_history(folder: Union[str, Path], ref: str, name: str) -> Optional[str]:
+    """Return the hash of a file at a commit or tag, read from the registry history.
+
+    Parameters
+    ----------
+    folder : str or Path
+        The folder holding the history files, usually `data/`.
+    ref : str
+        A commit hash, an unambiguous prefix or a tag.
+    name : str
+        The path of the file, relative to `data/`.
+
+    Returns
+    -------
+    str or None
+        The hash of the file (e.g. "sha256:..."), or None if it is not registered at that commit.
+    """
+    key = f"{resolve_commit(folder, ref)} {name} "
+    with Path(folder).joinpath(HISTORY_FILE).open("rb") as f:
+        _seek_line(f, key.encode("utf-8"))
+        line = f.readline().decode("utf-8")
+    return line[len(key) :].strip() if line.startswith(key) else None
+
+
+def verify(
+    registry: Union[str, Path] = "data/registry.txt",
+    use_cache: bool = True,
+    jobs: Optional[int] = None,
+) -> bool:
+    """Check the files in `data/` against the registry, without writing anything.
+
+    A stat pre-pass trusts the cached checksum of files whose size, mtime and inode are unchanged,
+    so only new or modified files are hashed.
+
+    Parameters
+    ----------
+    registry : str or Path
+        The registry file to check against.
+    use_cache : bool
+        Whether to trust the checksum cache for unchanged files.
+    jobs : int, optional
+        Number of files hashed concurrently. Defaults to the number of CPUs.
+
+    Returns
+    -------
+    bool
+        True if the files match the registry exactly.
+    """
+    data_folder = Path(".").joinpath("data")
+    expected = read_registry(Path(registry))
+    on_disk = {
+        file.relative_to(data_folder).as_posix(): file
+        for file in filter(valid, data_folder.rglob("**/*"))
+    }
+    missing = sorted(set(expected) - set(on_disk))
+    extra = sorted(set(on_disk) - set(expected))
+
+    cache = (
+        load_checksum_cache(data_folder.joinpath(CACHE_FILE)) if use_cache else dict()
+    )
+    checksums = dict()
+    to_hash = []
+    for name in sorted(set(expected) & set(on_disk)):
+        entry = cache.get(name)
+        if entry is not None and entry.get("stat") == file_stat_signature(
+            on_disk[name]
+        ):
+            checksums[name] = entry["sha256"]
+        else:
+            to_hash.append(on_disk[name])
+    for file, checksum in hash_files(to_hash, jobs=jobs, verbose=False).items():
+        checksums[file.relative_to(data_folder).as_posix()] = checksum
+    mismatched = sorted(
+        name
+        for name, checksum in checksums.items()
+        if expected[name] != f"sha256:{checksum}"
+    )
+
+    print(
+        f"Checked {len(checksums)} files against {registry} "
+        f"({len(to_hash)} hashed, {len(checksums) - len(to_hash)} from cache)."
+    )
+    for label, names in [
+        ("Missing", missing),
+        ("Not in registry", extra),
+        ("Checksum mismatch", mismatched),
+    ]:
+        for name in names:
+            print(f"{label}: {name}")
+    return not (missing or extra or mismatched)
+
+
+def main(
+    dry_run: bool = False,
+    readme: Union[str, Path] = "README.md",
+    use_cache: bool = True,
+    jobs: Optional[int] = None,
+    catalog: bool = False,
+    block_size: Optional[int] = None,
+    history: bool = False,
+    series: bool = False,
+):
+    """Create checksum files.
+
+    Parameters
+    ----------
+    readme : str or Path
+        The README file in which the table of files is written.
+    use_cache : bool
+        Whether to reuse the checksums of files whose size, mtime and inode are unchanged since the last run.
+        If False, every file is hashed again and the cache is rebuilt.
+    jobs : int, optional
+        Number of files hashed concurrently. Defaults to the number of CPUs.
+    catalog : bool
+        Whether to also write the header-only metadata catalog (`data/catalog.json`). Requires netCDF4 and cftime.
+    block_size : int, optional
+        If given, also write a manifest of the sha256 of each block of this size, with their Merkle root,
+        next to every file (`{filename}.blocks.json`).
+    history : bool
+        Whether to also write the history of the registry from git (`data/registry_history.txt` and
+        `data/registry_commits.txt`), for the registry lookups of any commit or tag.
+    series : bool
+        Whether to also write the index of the datasets split across several files (`data/series.json`).
+        Requires netCDF4 and cftime.
+    """
     data_folder = Path(".").joinpath("data")
     files = list(filter(valid, data_folder.rglob("**/*")))
 
+    cache_file = data_folder.joinpath(CACHE_FILE)
+    cache = load_checksum_cache(cache_file) if use_cache else dict()
+
     file_checksums_tmp = dict()
+    signatures = dict()
+    to_hash = []
     for file in files:
         if valid(file):
-            file_checksums_tmp[file] = file_sha256_checksum(file)
+            key = file.relative_to(data_folder).as_posix()
+            signatures[file] = file_stat_signature(file)
+            entry = cache.get(key)
+            if entry is not None and entry.get("stat") == signatures[file]:
+                file_checksums_tmp[file] = entry["sha256"]
+            else:
+                to_hash.append(file)
+    cached = len(file_checksums_tmp)
+    file_checksums_tmp.update(hash_files(to_hash, jobs=jobs))
+
+    new_cache = {
+        file.relative_to(data_folder).as_posix(): dict(
+            stat=signatures[file], sha256=checksum
+        )
+        for file, checksum in file_checksums_tmp.items()
+    }
+    save_checksum_cache(new_cache, cache_file)
+    print(f"Hashed {len(to_hash)} files, reused {cached} checksums from cache.")
 
     # Sort the dictionary by key
     file_checksums = dict(sorted(file_checksums_tmp.items()))
@@ -105,9 +775,11 @@ def main(dry_run: bool = False, readme: Union[str, Path] = "README.md"):
     for file, checksum in file_checksums.items():
         lines.insert(
             i + 6,
-            f"| {file.relative_to(data_folder).as_posix()} "
-            f"| {file_size_formatter(file.stat().st_size)} "
-            f"| sha256:{checksum} |\n",
+            _readme_row(
+                file.relative_to(data_folder).as_posix(),
+                file.stat().st_size,
+                f"sha256:{checksum}",
+            ),
         )
 
     # Remove trailing newline
@@ -125,6 +797,84 @@ def main(dry_run: bool = False, readme: Union[str, Path] = "README.md"):
             out.write(f"{file.relative_to(data_folder).as_posix()} sha256:{checksum}\n")
     print(f"Successfully wrote {len(file_checksums)} checksums to {registry}.")
 
+    if block_size:
+        written = write_block_manifests(file_checksums, block_size)
+        print(f"Successfully wrote {written} block manifests.")
+
+    if catalog:
+        from report_catalog import build_catalog
+
+        build_catalog(registry, data_folder.joinpath("catalog.json"))
+
+    if series:
+        from report_series import build_series
+
+        build_series(registry, data_folder.joinpath("series.json"))
+
+    if history:
+        commits, versions = build_history(registry)
+        print(
+            f"Successfully wrote the history of {versions} registry versions over {commits} commits."
+        )
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description="Generate the sha256 checksums of the files found in `data/`."
+    )
+    parser.add_argument(
+        "--no-cache",
+        "--rehash",
+        dest="use_cache",
+        action="store_false",
+        help="Ignore the checksum cache and hash every file again.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of files hashed concurrently (default: number of CPUs).",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check the files against data/registry.txt without rewriting anything. Exits with 1 on any difference.",
+    )
+    parser.add_argument(
+        "--catalog",
+        action="store_true",
+        help="Also write the header-only metadata catalog (data/catalog.json).",
+    )
+    parser.add_argument(
+        "--blocks",
+        nargs="?",
+        type=int,
+        const=BLOCK_SIZE,
+        default=None,
+        metavar="BLOCK_SIZE",
+        help=f"Also write block manifests with a Merkle root next to each file (default block size: {BLOCK_SIZE}).",
+    )
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="Also write the history of data/registry.txt from git, to resolve the registry of any commit or tag.",
+    )
+    parser.add_argument(
+        "--series",
+        action="store_true",
+        help="Also write the index of the datasets split across several files (data/series.json).",
+    )
+    args = parser.parse_args()
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+    if args.verify:
+        sys.exit(0 if verify(use_cache=args.use_cache, jobs=args.jobs) else 1)
+    main(
+        use_cache=args.use_cache,
+        jobs=args.jobs,
+        catalog=args.catalog,
+        block_size=args.blocks,
+        history=args.history,
+        series=args.series,
+    )
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Build kerchunk reference files for the registered NetCDF files.
+
+For every NetCDF file in `data/registry.txt`, a JSON reference file giving the byte offset and length of each chunk
+is written to `data/references/{path}.json`. The references point to the data through a `{{data}}` template,
+which defaults to the raw GitHub URL of the `main` branch and can be overridden to point to a branch, a commit or a
+local copy of `data/`. Clients can then open a file as a virtual Zarr store and read only the chunks they need,
+locally or through HTTP range requests.
+
+The reference files live under `data/`, so `report_check_sums.py` registers them with checksums like the data.
+
+Requires kerchunk, h5py and fsspec. Opening the references with `open_reference` also requires xarray and zarr.
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Optional, Union
+
+from report_check_sums import read_registry
+
+GITHUB_URL = "https://github.com/Ouranosinc/xclim-testdata"
+DEFAULT_BASE_URL = f"{GITHUB_URL}/raw/main/data"
+
+# Folder, relative to `data/`, in which the reference files are written
+REFERENCES_FOLDER = "references"
+
+
+def file_references(
+    filename: Path, name: str, base_url: str = DEFAULT_BASE_URL
+) -> dict:
+    """Return the kerchunk references of a NetCDF file, with its URL replaced by the `{{data}}` template.
+
+    Parameters
+    ----------
+    filename : Path
+        The path to the NetCDF file.
+    name : str
+        The path of the file relative to `data/`.
+    base_url : str
+        Default value of the `data` template.
+    """
+    with filename.open("rb") as f:
+        is_hdf5 = f.read(8) == b"\x89HDF\r\n\x1a\n"
+
+    if is_hdf5:
+        from kerchunk.hdf import SingleHdf5ToZarr
+
+        refs = SingleHdf5ToZarr(filename.as_posix(), inline_threshold=300).translate()
+    else:
+        from kerchunk.netCDF3 import NetCDF3ToZarr
+
+        refs = NetCDF3ToZarr(filename.as_posix(), inline_threshold=300).translate()
+
+    for key, ref in refs["refs"].items():
+        if isinstance(ref, list):
+            refs["refs"][key] = ["{{data}}/" + name, *ref[1:]]
+    refs["templates"] = {"data": base_url}
+    return refs
+
+
+def build_references(
+    registry: Union[str, Path] = "data/registry.txt", base_url: str = DEFAULT_BASE_URL
+) -> list[Path]:
+    """Write the reference file of every registered NetCDF file.
+
+    Parameters
+    ----------
+    registry : str or Path
+        The registry file.
+    base_url : str
+        Default value of the `data` template.
+
+    Returns
+    -------
+    list of Path
+        The reference files written.
+    """
+    registry = Path(registry)
+    data_folder = registry.parent
+    written = []
+    for name in sorted(read_registry(registry)):
+        file = data_folder.joinpath(name)
+        if file.suffix != ".nc" or name.startswith(f"{REFERENCES_FOLDER}/"):
+            continue
+        if not file.exists():
+            print(f"Skipping missing file: {name}")
+            continue
+        output = data_folder.joinpath(REFERENCES_FOLDER, f"{name}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with output.open("w", encoding="utf-8") as f:
+            json.dump(file_references(file, name, base_url), f, sort_keys=True)
+        written.append(output)
+    print(
+        f"Successfully wrote {len(written)} reference files to {data_folder / REFERENCES_FOLDER}."
+    )
+    return written
+
+
+def open_reference(
+    reference: Union[str, Path],
+    data: Optional[str] = None,
+    storage_options: Optional[dict] = None,
+):
+    """Open a NetCDF file as a virtual Zarr store through its reference file.
+
+    Parameters
+    ----------
+    reference : str or Path
+        The reference file.
+    data : str, optional
+        Location of the `data/` folder (local path or URL). Defaults to the URL stored in the reference file.
+    storage_options : dict, optional
+        Options of the filesystem holding the data (e.g. HTTP headers).
+
+    Returns
+    -------
+    xarray.Dataset
+    """
+    import xarray as xr
+
+    options = dict(fo=Path(reference).as_posix(), remote_options=storage_options or {})
+    if data is not None:
+        options["template_overrides"] = {"data": data}
+        if "://" not in data:
+            options["remote_protocol"] = "file"
+    return xr.open_dataset(
+        "reference://",
+        engine="zarr",
+        backend_kwargs=dict(consolidated=False, storage_options=options),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build kerchunk reference files for the NetCDF files of data/registry.txt."
+    )
+    parser.add_argument("--registry", default="data/registry.txt")
+    parser.add_argument(
+        "--base-url",
+        default=DEFAULT_BASE_URL,
+        help="Default location of the data/ folder stored in the references.",
+    )
+    args = parser.parse_args()
+    build_references(args.registry, args.base_url)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+"""
+Build an index of the registered datasets that are split across several files, and open them as one dataset.
+
+Two kinds of series are indexed in `data/series.json`:
+
+* time series split by period, found from the CMIP file names (`{name}_{start}-{end}.nc`, e.g. the 13 files of
+  `cmip5/tas_Amon_HadGEM2-ES_rcp85_r1i1p1`), concatenated along `time`;
+* ensembles, whose members are listed in `ENSEMBLES` (e.g. the `EnsembleStats` members), concatenated along a new
+  `realization` dimension.
+
+For every series, the index lists its members in order, with their hash, decoded time range, size and offset along
+the series (and, for time series, the number of leading time steps already covered by the previous member). The
+members are checked once, when the index is built: they must hold the same variables and identical values for
+every variable that does not depend on time (coordinates, bounds, ...), and time series must be increasing and
+share their calendar. `open_series` then opens only the members overlapping a time window and concatenates them
+without comparing their coordinates again.
+
+Requires netCDF4 and cftime. `open_series` also requires xarray.
+"""
+import argparse
+import hashlib
+import json
+import re
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Optional, Union
+
+import cftime
+import netCDF4
+import numpy as np
+
+from report_check_sums import read_registry
+
+# Name of the CMIP files split by period
+PERIOD_PATTERN = re.compile(r"^(?P<series>.+)_(?P<start>\d{4,8})-(?P<end>\d{4,8})\.nc$")
+
+# Ensembles, by series name, with the pattern of their members
+ENSEMBLES = {
+    "EnsembleStats/BCCAQv2+ANUSPLIN300_historical+rcp45_tg_mean_YS": (
+        "EnsembleStats/BCCAQv2+ANUSPLIN300_*_historical+rcp45_*_tg_mean_YS.nc"
+    ),
+}
+
+# Dimension along which the ensemble members are concatenated
+ENSEMBLE_DIM = "realization"
+
+
+def find_series(names: list[str]) -> dict[str, tuple[str, list[str]]]:
+    """Group file names into series.
+
+    Parameters
+    ----------
+    names : list of str
+        File paths relative to `data/`.
+
+    Returns
+    -------
+    dict
+        The concatenation dimension and the sorted members of each series with at least two members, by name.
+    """
+    periods = dict()
+    for name in names:
+        match = PERIOD_PATTERN.match(name)
+        if match:
+            periods.setdefault(match["series"], []).append(name)
+    series = {
+        name: ("time", sorted(members))
+        for name, members in periods.items()
+        if len(members) > 1
+    }
+    for name, pattern in ENSEMBLES.items():
+        members = sorted(n for n in names if fnmatch(n, pattern))
+        if len(members) > 1:
+            series[name] = (ENSEMBLE_DIM, members)
+    return series
+
+
+def describe_member(filename: Path) -> dict:
+    """Return the time range and the signature of the variables of a file.
+
+    Parameters
+    ----------
+    filename : Path
+        The NetCDF file.
+    """
+    with netCDF4.Dataset(filename) as ds:
+        ds.set_auto_maskandscale(False)
+        time = ds.variables["time"]
+        calendar = getattr(time, "calendar", "standard")
+        times = cftime.num2date(
+            time[:], time.units, calendar=calendar, only_use_cftime_datetimes=True
+        )
+        # Values of the variables that do not depend on time, which must be identical in every member
+        fixed = hashlib.sha256()
+        variables = dict()
+        for name, var in sorted(ds.variables.items()):
+            variables[name] = [list(var.dimensions), str(var.dtype)]
+            if "time" not in var.dimensions:
+                fixed.update(json.dumps(variables[name] + [name]).encode("utf-8"))
+                fixed.update(np.ascontiguousarray(var[...]).tobytes())
+    return dict(
+        calendar=calendar,
+        times=times,
+        variables=variables,
+        fixed_sha256=fixed.hexdigest(),
+    )
+
+
+def _days_per_cycle(calendar: str) -> int:
+    """Return the number of days in four years of a calendar."""
+    return (
+        cftime.datetime(2004, 1, 1, calendar=calendar)
+        - cftime.datetime(2000, 1, 1, calendar=calendar)
+    ).days
+
+
+def index_series(
+    data_folder: Path, dim: str, members: list[str], registry: dict[str, str]
+) -> dict:
+    """Check that the members of a series can be concatenated and return its index entry.
+
+    Parameters
+    ----------
+    data_folder : Path
+        The folder holding the files.
+    dim : str
+        The concatenation dimension, "time" or a new dimension.
+    members : list of str
+        The sorted members, relative to `data/`.
+    registry : dict
+        The registry entries.
+
+    Raises
+    ------
+    ValueError
+        If the members are not compatible.
+    """
+    described = [describe_member(data_folder.joinpath(name)) for name in members]
+    first = described[0]
+    for name, member in zip(members[1:], described[1:]):
+        if member["variables"] != first["variables"]:
+            raise ValueError(
+                f"{name} does not hold the same variables as {members[0]}."
+            )
+        if member["fixed_sha256"] != first["fixed_sha256"]:
+            raise ValueError(
+                f"The coordinates of {name} differ from those of {members[0]}."
+            )
+        if dim == "time" and member["calendar"] != first["calendar"]:
+            raise ValueError(
+                f"The calendar of {name} differs from that of {members[0]}."
+            )
+
+    entries = []
+    offset = 0
+    previous = None
+    for name, member in zip(members, described):
+        times = member["times"]
+        skip = 0
+        if dim == "time":
+            if np.any(times[1:] <= times[:-1]):
+                raise ValueError(f"The time coordinate of {name} is not increasing.")
+            # Leading time steps already covered by the previous member
+            if previous is not None:
+                skip = int(np.searchsorted(times, previous, side="right"))
+            previous = times[-1]
+        entries.append(
+            dict(
+                name=name,
+                hash=registry[name],
+                calendar=member["calendar"],
+                start=times[0].isoformat(),
+                end=times[-1].isoformat(),
+                size=len(times),
+                skip=skip,
+                offset=offset,
+            )
+        )
+        if dim == "time":
+            offset += len(times) - skip
+        else:
+            offset += 1
+
+    # Ensemble members are converted to the calendar with the most days
+    calendar = max((member["calendar"] for member in described), key=_days_per_cycle)
+    return dict(
+        dim=dim,
+        calendar=calendar,
+        start=min(entry["start"] for entry in entries),
+        end=max(entry["end"] for entry in entries),
+        size=offset,
+        variables=first["variables"],
+        fixed_sha256=first["fixed_sha256"],
+        members=entries,
+    )
+
+
+def build_series(
+    registry: Union[str, Path] = "data/registry.txt",
+    output: Union[str, Path] = "data/series.json",
+) -> dict:
+    """Write the index of the series of the registered files.
+
+    Parameters
+    ----------
+    registry : str or Path
+        The registry file.
+    output : str or Path
+        The index file to write.
+
+    Returns
+    -------
+    dict
+        The index, keyed by series name.
+    """
+    registry = Path(registry)
+    data_folder = registry.parent
+    entries = read_registry(registry)
+    names = [name for name in entries if data_folder.joinpath(name).exists()]
+
+    index = dict()
+    for name, (dim, members) in sorted(find_series(names).items()):
+        try:
+            index[name] = index_series(data_folder, dim, members, entries)
+        except ValueError as err:
+            print(f"Skipping series {name}: {err}")
+
+    output = Path(output)
+    with output.open("w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+        f.write("\n")
+    print(f"Successfully wrote {len(index)} series to {output}.")
+    return index
+
+
+def _overlaps(member: dict, start: Optional[str], stop: Optional[str]) -> bool:
+    """Return whether a member overlaps a time window given as (partial) ISO dates."""
+    return (start is None or member["end"][: len(start)] >= start) and (
+        stop is None or member["start"][: len(stop)] <= stop
+    )
+
+
+def open_series(
+    name: str,
+    start: Optional[str] = None,
+    stop: Optional[str] = None,
+    index: Union[str, Path] = "data/series.json",
+    data_folder: Union[str, Path, None] = None,
+    **kwargs,
+):
+    """Open a series as one dataset, reading only the members overlapping a time window.
+
+    The members were checked when the index was built, so they are concatenated without comparing their
+    coordinates, which are taken from the first member read.
+
+    Parameters
+    ----------
+    name : str
+        The name of the series in the index.
+    start, stop : str, optional
+        Bounds of the time window, as (partial) ISO dates, e.g. "2050" or "2050-06-01".
+    index : str or Path
+        The index file.
+    data_folder : str or Path, optional
+        The folder holding the files. Defaults to the folder of the index.
+    kwargs
+        Arguments passed to `xarray.open_dataset`.
+
+    Returns
+    -------
+    xarray.Dataset
+    """
+    import xarray as xr
+
+    index = Path(index)
+    with index.open(encoding="utf-8") as f:
+        series = json.load(f)[name]
+    data_folder = Path(data_folder or index.parent)
+
+    datasets = []
+    for member in series["members"]:
+        if not _overlaps(member, start, stop):
+            continue
+        ds = xr.open_dataset(data_folder.joinpath(member["name"]), **kwargs)
+        if series["dim"] == "time":
+            ds = ds.isel(time=slice(member["skip"], None))
+        elif member["calendar"] != series["calendar"]:
+            ds = ds.convert_calendar(series["calendar"], align_on="date")
+        datasets.append(ds)
+    if not datasets:
+        raise ValueError(f"No member of {name} overlaps the time window.")
+
+    if series["dim"] == "time":
+        ds = xr.concat(
+            datasets,
+            dim="time",
+            data_vars="minimal",
+            coords="minimal",
+            compat="override",
+            join="override",
+        )
+    else:
+        members = [
+            Path(m["name"]).stem for m in series["members"] if _overlaps(m, start, stop)
+        ]
+        ds = xr.concat(
+            datasets,
+            dim=xr.DataArray(members, dims=(series["dim"],), name=series["dim"]),
+            data_vars="all",
+            coords="minimal",
+            compat="override",
+            join="outer",
+        )
+    if start is not None or stop is not None:
+        ds = ds.sel(time=slice(start, stop))
+    return ds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the index of the multi-file series of the files in data/registry.txt."
+    )
+    parser.add_argument("--registry", default="data/registry.txt")
+    parser.add_argument("--output", default="data/series.json")
+    args = parser.parse_args()
+    build_series(args.registry, args.output)
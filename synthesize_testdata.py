@@ -0,0 +1,581 @@
+#!/usr/bin/env python
+"""
+Write large synthetic datasets with the schema of a registered dataset, for scaling benchmarks.
+
+The template (e.g. `sdba/CanESM2_1950-2100.nc` or one of the `EnsembleStats` members) gives the dimensions,
+coordinates, variables, attributes, calendar and time step of the output. Its size can be scaled up:
+
+* `--years N` sets the length of the time axis, continuing the calendar and time step of the template;
+* `--size DIM=N` sets the size of other dimensions, and `--points N` multiplies the size of the largest spatial
+  dimension. Coordinates and time-independent variables are linearly interpolated over the same extent;
+* `--members N` writes N files, as members of an ensemble.
+
+Values are drawn from the statistics of the template, for every variable along time: the seasonal cycle of its
+mean and standard deviation, the interpolated field of the time mean of each point, and the lag-1 autocorrelation of
+the anomalies. Variables with many zeros (e.g. precipitation) get wet days drawn with the frequency of the template,
+and gamma-distributed amounts. The same seed and options always give the same values.
+
+The output, NetCDF or Zarr depending on its suffix, is written block by block (a range of time steps of a range of
+rows of the first spatial dimension), so that memory use is bounded by `--block-size` whatever the output size.
+Packed variables are written unpacked.
+
+    python synthesize_testdata.py sdba/CanESM2_1950-2100.nc canesm2_x100.nc --size location=300 --years 150
+
+Requires numpy, cftime and netCDF4, or xarray, dask and zarr for Zarr outputs.
+"""
+import argparse
+import math
+import warnings
+from pathlib import Path
+from typing import Optional, Union
+
+import cftime
+import numpy as np
+
+# Default target size of the generated blocks, in bytes
+BLOCK_SIZE = 64 * 1024 * 1024
+
+# Minimal fraction of zeros for a non-negative variable to be generated with wet and dry steps
+DRY_FRACTION = 0.01
+
+
+def _resize(values: np.ndarray, shape: tuple[int, ...], rows: slice = slice(None)):
+    """Linearly interpolate an array to a new shape, keeping its extent.
+
+    Non-numeric arrays take the value of the nearest element. Only the `rows` of the first axis of the output
+    are computed.
+    """
+    out = np.asarray(values)
+    for axis, size in enumerate(shape):
+        n = out.shape[axis]
+        positions = np.linspace(0, n - 1, size)
+        if axis == 0:
+            positions = positions[rows]
+        if out.dtype.kind in "fc":
+            lo = np.floor(positions).astype(int)
+            hi = np.minimum(lo + 1, n - 1)
+            weights = (positions - lo).reshape([-1] + [1] * (out.ndim - axis - 1))
+            a, b = np.take(out, lo, axis=axis), np.take(out, hi, axis=axis)
+            # Exact positions keep their value, even next to a missing one
+            out = np.where(weights == 0, a, a + (b - a) * weights)
+        else:
+            out = np.take(out, np.rint(positions).astype(int), axis=axis)
+    return out
+
+
+def _resize_coordinate(values: np.ndarray, size: int) -> np.ndarray:
+    """Return a dimension coordinate of a new size, over the same extent and with unique values."""
+    if values.dtype.kind in "iu" and np.array_equal(values, np.arange(len(values))):
+        return np.arange(size, dtype=values.dtype)
+    if values.dtype.kind in "fc":
+        return _resize(values, (size,)).astype(values.dtype)
+    # Labels are repeated with a suffix
+    labels = _resize(values, (size,)).astype(str)
+    counts = dict()
+    unique = []
+    for label in labels:
+        counts[label] = counts.get(label, -1) + 1
+        unique.append(f"{label}_{counts[label]}" if counts[label] else label)
+    return np.array(unique)
+
+
+def _bounds(values: np.ndarray) -> np.ndarray:
+    """Return the bounds of a 1D coordinate, halfway between its values."""
+    values = np.asarray(values, dtype=float)
+    if len(values) == 1:
+        return np.array([[values[0] - 0.5, values[0] + 0.5]])
+    edges = np.concatenate(
+        [
+            [values[0] - (values[1] - values[0]) / 2],
+            (values[1:] + values[:-1]) / 2,
+            [values[-1] + (values[-1] - values[-2]) / 2],
+        ]
+    )
+    return np.stack([edges[:-1], edges[1:]], axis=-1)
+
+
+def time_axis(times: np.ndarray, units: str, calendar: str, years: int) -> np.ndarray:
+    """Return the numeric values of a time axis of some years, continuing the first steps of a template.
+
+    Parameters
+    ----------
+    times : np.ndarray
+        The numeric time values of the template, with at least two steps.
+    units : str
+        The CF units of the time values.
+    calendar : str
+        The calendar.
+    years : int
+        The number of years of the new axis.
+    """
+    start, second = cftime.num2date(times[:2], units, calendar=calendar)
+    step_days = (second - start).total_seconds() / 86400
+    if step_days < 2:
+        stop = cftime.date2num(
+            start.replace(year=start.year + years), units, calendar=calendar
+        )
+        return np.arange(times[0], stop, times[1] - times[0])
+    if step_days < 40:
+        dates = [
+            start.replace(
+                year=start.year + (start.month - 1 + k) // 12,
+                month=(start.month - 1 + k) % 12 + 1,
+                day=min(start.day, 28),
+            )
+            for k in range(12 * years)
+        ]
+    else:
+        dates = [start.replace(year=start.year + k) for k in range(years)]
+    return np.asarray(cftime.date2num(dates, units, calendar=calendar))
+
+
+def _phases(times: np.ndarray, units: str, calendar: str, step_days: float):
+    """Return the position of each time step in the seasonal cycle (day of year, month, or 0 for yearly data)."""
+    dates = cftime.num2date(times, units, calendar=calendar)
+    if step_days < 2:
+        return np.array([min(d.dayofyr, 365) for d in dates]) - 1
+    if step_days < 40:
+        return np.array([d.month for d in dates]) - 1
+    return np.zeros(len(dates), dtype=int)
+
+
+def _per_phase(values: np.ndarray, phases: np.ndarray, n: int, func) -> np.ndarray:
+    """Apply a nan-aware reduction to the values of each phase, filling the missing phases."""
+    out = np.full(n, np.nan)
+    for p in np.unique(phases):
+        out[p] = func(values[phases == p])
+    missing = np.isnan(out)
+    if missing.all():
+        return np.zeros(n)
+    out[missing] = np.interp(
+        np.flatnonzero(missing), np.flatnonzero(~missing), out[~missing]
+    )
+    return out
+
+
+def variable_statistics(values: np.ndarray, phases: np.ndarray, n: int) -> dict:
+    """Estimate the statistics used to generate a variable.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The values of the template, of shape (time, *space).
+    phases : np.ndarray
+        The phase of each time step in the seasonal cycle.
+    n : int
+        The number of phases.
+    """
+    values = values.astype(np.float64)
+    flat = values.reshape(len(values), -1)
+    valid = flat[~np.isnan(flat)]
+    # Points without any value (e.g. a land or ocean mask) stay missing, through a NaN field
+    missing = np.isnan(flat).all(axis=0)
+    stats = dict(nonneg=bool(valid.size and valid.min() >= 0))
+    dry = np.mean(valid == 0) if valid.size else 0
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if stats["nonneg"] and dry > DRY_FRACTION:
+            # Wet and dry steps, with gamma-distributed amounts
+            wet = np.where(flat > 0, flat, np.nan)
+            mean = _per_phase(wet, phases, n, np.nanmean)
+            var = np.maximum(_per_phase(wet, phases, n, np.nanvar), 1e-12)
+            point = np.nan_to_num(np.nanmean(wet, axis=0) / np.nanmean(wet), nan=1.0)
+            point[missing] = np.nan
+            frequency = np.where(np.isnan(flat), np.nan, flat > 0)
+            stats.update(
+                kind="wet",
+                wet=_per_phase(frequency, phases, n, np.nanmean),
+                shape=mean**2 / var,
+                scale=var / np.maximum(mean, 1e-12),
+                field=point.reshape(values.shape[1:]),
+            )
+            return stats
+
+        mean = _per_phase(flat, phases, n, np.nanmean)
+        anomalies = flat - mean[phases, np.newaxis]
+        offsets = np.nanmean(anomalies, axis=0)
+        anomalies -= np.nan_to_num(offsets)
+        std = _per_phase(anomalies, phases, n, np.nanstd)
+        a, b = anomalies[1:], anomalies[:-1]
+        rho = np.nansum(a * b) / np.sqrt(np.nansum(a**2) * np.nansum(b**2))
+    stats.update(
+        kind="normal",
+        mean=mean,
+        std=std,
+        rho=float(np.clip(np.nan_to_num(rho), 0, 0.99)),
+        field=offsets.reshape(values.shape[1:]),
+    )
+    return stats
+
+
+def generate_block(
+    stats: dict,
+    phases: np.ndarray,
+    field: np.ndarray,
+    rng: np.random.Generator,
+    state: Optional[np.ndarray],
+):
+    """Generate the values of a block of time steps of some points.
+
+    Parameters
+    ----------
+    stats : dict
+        The statistics of the variable.
+    phases : np.ndarray
+        The phase of each time step of the block.
+    field : np.ndarray
+        The time mean (or the relative wet amount) of each point of the block.
+    rng : np.random.Generator
+        The random generator of the block.
+    state : np.ndarray, optional
+        The anomalies of the last time step of the previous block of the same points.
+
+    Returns
+    -------
+    np.ndarray, np.ndarray
+        The values, of shape (time, *field.shape), and the anomalies of their last time step.
+    """
+    shape = (len(phases),) + field.shape
+    if stats["kind"] == "wet":
+        wet = rng.random(shape) < stats["wet"][phases].reshape(
+            (-1,) + (1,) * field.ndim
+        )
+        amounts = rng.gamma(
+            stats["shape"][phases].reshape((-1,) + (1,) * field.ndim),
+            stats["scale"][phases].reshape((-1,) + (1,) * field.ndim),
+            size=shape,
+        )
+        return np.where(wet, amounts, 0) * field, state
+
+    rho = stats["rho"]
+    noise = rng.standard_normal(shape)
+    anomalies = np.empty(shape)
+    previous = noise[0] if state is None else state
+    for t in range(len(phases)):
+        previous = rho * previous + math.sqrt(1 - rho**2) * noise[t]
+        anomalies[t] = previous
+    expand = (-1,) + (1,) * field.ndim
+    values = (
+        stats["mean"][phases].reshape(expand)
+        + field
+        + stats["std"][phases].reshape(expand) * anomalies
+    )
+    if stats["nonneg"]:
+        values = np.maximum(values, 0)
+    return values, anomalies[-1]
+
+
+class _NetCDFWriter:
+    """Write the blocks of the output to a NetCDF4 file."""
+
+    def __init__(self, output: Path, complevel: int):
+        import netCDF4
+
+        self.ds = netCDF4.Dataset(output, "w")
+        self.complevel = complevel
+
+    def create(self, dims: dict, variables: dict, attrs: dict, chunks: dict):
+        self.ds.setncatts(attrs)
+        for name, size in dims.items():
+            self.ds.createDimension(name, size)
+        for name, (var_dims, dtype, var_attrs, values) in variables.items():
+            var_attrs = dict(var_attrs)
+            numeric = np.dtype(dtype).kind in "biuf"
+            fill = var_attrs.pop("_FillValue", None)
+            var = self.ds.createVariable(
+                name,
+                dtype if numeric else str,
+                var_dims,
+                zlib=numeric and self.complevel > 0 and len(var_dims) > 0,
+                complevel=max(self.complevel, 1),
+                chunksizes=[chunks[d] for d in var_dims]
+                if values is None and numeric
+                else None,
+                fill_value=fill,
+            )
+            var.setncatts(var_attrs)
+            if values is not None:
+                var[...] = values
+
+    def write(self, name: str, index: tuple, values: np.ndarray):
+        self.ds.variables[name][index] = values
+
+    def close(self):
+        self.ds.close()
+
+
+class _ZarrWriter:
+    """Write the blocks of the output to a Zarr store, initialized lazily with xarray and dask."""
+
+    def __init__(self, output: Path, complevel: int):
+        self.output = output
+
+    def create(self, dims: dict, variables: dict, attrs: dict, chunks: dict):
+        import dask.array
+        import xarray as xr
+
+        data_vars, encoding = dict(), dict()
+        for name, (var_dims, dtype, var_attrs, values) in variables.items():
+            var_attrs = dict(var_attrs)
+            fill = var_attrs.pop("_FillValue", None)
+            if values is None:
+                values = dask.array.zeros(
+                    [dims[d] for d in var_dims],
+                    chunks=[chunks[d] for d in var_dims],
+                    dtype=dtype,
+                )
+                encoding[name] = dict(chunks=[chunks[d] for d in var_dims])
+            if fill is not None:
+                encoding.setdefault(name, {})["_FillValue"] = fill
+            data_vars[name] = xr.Variable(var_dims, values, var_attrs)
+        self.ds = xr.Dataset(data_vars, attrs=attrs)
+        self.ds.to_zarr(
+            self.output, mode="w", compute=False, encoding=encoding, consolidated=True
+        )
+
+    def write(self, name: str, index: tuple, values: np.ndarray):
+        import xarray as xr
+
+        dims = self.ds[name].dims
+        xr.Dataset({name: (dims, values)}).to_zarr(
+            self.output, region=dict(zip(dims, index))
+        )
+
+    def close(self):
+        pass
+
+
+def _fixed_variables(ds, dims: dict, times: np.ndarray) -> dict:
+    """Return the dims, dtype, attributes and values of the variables that do not depend on time, resized.
+
+    Bounds are computed from their resized coordinate, and the time bounds from the new time axis.
+    """
+    bounds = {
+        var.attrs["bounds"]: name
+        for name, var in ds.variables.items()
+        if var.ndim == 1 and var.attrs.get("bounds") in ds.variables
+    }
+    out = dict()
+    names = [
+        name
+        for name, var in ds.variables.items()
+        if "time" not in var.dims or name == "time" or bounds.get(name) == "time"
+    ]
+    # Coordinates first, their bounds after
+    for name in sorted(names, key=lambda name: name in bounds):
+        var = ds[name].variable
+        shape = tuple(dims[d] for d in var.dims)
+        if name == "time":
+            values = times
+        elif bounds.get(name) == "time":
+            values = _bounds(times)
+        elif name in bounds and var.shape != shape:
+            values = _bounds(out[bounds[name]][3])
+        elif var.shape == shape:
+            values = var.values
+        elif var.ndim == 1 and name == var.dims[0]:
+            values = _resize_coordinate(var.values, shape[0])
+        else:
+            values = _resize(var.values, shape)
+        values = np.asarray(values)
+        if values.dtype.kind == "O":
+            values = values.astype(str)
+        elif var.dtype.kind in "iuf" and bounds.get(name) != "time":
+            values = values.astype(var.dtype)
+        attrs = dict(var.attrs)
+        if values.dtype.kind == "f" and "_FillValue" in var.encoding:
+            attrs["_FillValue"] = var.encoding["_FillValue"]
+        out[name] = (var.dims, values.dtype, attrs, values)
+    return out
+
+
+def synthesize(
+    template: Union[str, Path],
+    output: Union[str, Path],
+    years: Optional[int] = None,
+    sizes: Optional[dict[str, int]] = None,
+    points: int = 1,
+    members: int = 1,
+    seed: int = 0,
+    block_size: int = BLOCK_SIZE,
+    complevel: int = 1,
+) -> list[Path]:
+    """Write synthetic datasets with the schema of a template.
+
+    Parameters
+    ----------
+    template : str or Path
+        The template NetCDF file, with a time dimension of at least two steps.
+    output : str or Path
+        The output file, `.nc` or `.zarr`. With several members, the member number is added to its name.
+    years : int, optional
+        The number of years of the output. Defaults to the number of years of the template.
+    sizes : dict, optional
+        The size of the other dimensions to resize, by name.
+    points : int
+        Factor multiplying the size of the largest spatial dimension.
+    members : int
+        The number of members to write.
+    seed : int
+        The seed of the random generators.
+    block_size : int
+        Target size of the generated blocks, in bytes.
+    complevel : int
+        The zlib compression level of NetCDF outputs. 0 disables compression.
+
+    Returns
+    -------
+    list of Path
+        The files written.
+    """
+    import xarray as xr
+
+    with xr.open_dataset(template, decode_times=False) as ds:
+        ds = ds.load()
+    time = ds["time"]
+    units, calendar = time.attrs["units"], time.attrs.get("calendar", "standard")
+    start, second = cftime.num2date(time.values[:2], units, calendar=calendar)
+    step_days = (second - start).total_seconds() / 86400
+    if years is None:
+        end = cftime.num2date(time.values[-1], units, calendar=calendar)
+        years = end.year - start.year + 1
+    times = time_axis(time.values, units, calendar, years)
+    n_phases = 365 if step_days < 2 else 12 if step_days < 40 else 1
+
+    # Variables along time, generated, and the spatial dimensions, from the largest
+    timed = [
+        name
+        for name, var in ds.data_vars.items()
+        if "time" in var.dims and name != time.attrs.get("bounds")
+    ]
+    spatial = sorted(
+        {d for name in timed for d in ds[name].dims if d != "time"},
+        key=lambda d: -ds.sizes[d],
+    )
+    sizes = sizes or {}
+    unknown = set(sizes) - set(ds.dims) | {"time"} & set(sizes)
+    if unknown:
+        raise ValueError(f"Cannot resize dimensions: {', '.join(sorted(unknown))}.")
+    dims = dict(ds.sizes, time=len(times), **sizes)
+    if points > 1 and spatial:
+        dims[spatial[0]] *= points
+
+    variables = _fixed_variables(ds, dims, times)
+    template_phases = _phases(time.values, units, calendar, step_days)
+    phases = _phases(times, units, calendar, step_days)
+    statistics = dict()
+    chunks = dict(dims)
+    for name in timed:
+        var = ds[name].transpose("time", ...)
+        statistics[name] = variable_statistics(var.values, template_phases, n_phases)
+        # Packed variables are written unpacked
+        dtype = var.dtype if var.dtype.kind == "f" else np.dtype("float32")
+        attrs = dict(var.attrs, _FillValue=dtype.type(np.nan))
+        variables[name] = (ds[name].dims, dtype, attrs, None)
+
+        # Blocks of whole time steps and rows of the first spatial dimension, under the target size
+        space = var.dims[1:]
+        row = 8 * int(np.prod([dims[d] for d in space[1:]]))
+        chunks["time"] = min(chunks["time"], max(1, block_size // row))
+        if space:
+            rows = max(1, block_size // (row * chunks["time"]))
+            chunks[space[0]] = min(chunks[space[0]], rows)
+
+    attrs = dict(
+        ds.attrs,
+        comment=(
+            f"Synthetic data with the schema and statistics of {Path(template).name}, "
+            "generated by synthesize_testdata.py."
+        ),
+        synthetic_seed=seed,
+    )
+
+    output = Path(output)
+    written = []
+    for member in range(members):
+        path = (
+            output
+            if members == 1
+            else output.with_name(f"{output.stem}_m{member:03d}{output.suffix}")
+        )
+        writer = (_ZarrWriter if path.suffix == ".zarr" else _NetCDFWriter)(
+            path, complevel
+        )
+        writer.create(dims, variables, dict(attrs, synthetic_member=member), chunks)
+        for v, name in enumerate(timed):
+            stats = statistics[name]
+            # Blocks are generated along (time, *space) and transposed to the dims of the variable
+            space = [d for d in ds[name].dims if d != "time"]
+            order = [(["time"] + space).index(d) for d in ds[name].dims]
+            shape = tuple(dims[d] for d in space)
+            nrows = shape[0] if space else 1
+            step = chunks[space[0]] if space else 1
+            for b, r0 in enumerate(range(0, nrows, step)):
+                rows = slice(r0, min(r0 + step, nrows))
+                field = _resize(stats["field"], shape, rows)
+                state = None
+                for t, t0 in enumerate(range(0, dims["time"], chunks["time"])):
+                    steps = slice(t0, min(t0 + chunks["time"], dims["time"]))
+                    rng = np.random.default_rng([seed, member, v, b, t])
+                    values, state = generate_block(
+                        stats, phases[steps], field, rng, state
+                    )
+                    index = {"time": steps, **({space[0]: rows} if space else {})}
+                    writer.write(
+                        name,
+                        tuple(index.get(d, slice(None)) for d in ds[name].dims),
+                        values.transpose(order).astype(variables[name][1]),
+                    )
+        writer.close()
+        written.append(path)
+        print(f"Successfully wrote {path}.")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write large synthetic datasets with the schema and statistics of a registered dataset."
+    )
+    parser.add_argument("template", help="Template file, relative to --data.")
+    parser.add_argument("output", help="Output file (.nc or .zarr).")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--years", type=int, help="Number of years of the output.")
+    parser.add_argument(
+        "--size",
+        action="append",
+        default=[],
+        metavar="DIM=SIZE",
+        help="Size of a dimension of the output (can be repeated).",
+    )
+    parser.add_argument(
+        "--points",
+        type=int,
+        default=1,
+        help="Factor multiplying the size of the largest spatial dimension.",
+    )
+    parser.add_argument("--members", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=BLOCK_SIZE // 1024**2,
+        help="Target size of the generated blocks, in MiB (default: 64).",
+    )
+    parser.add_argument(
+        "--complevel",
+        type=int,
+        default=1,
+        help="zlib compression level of NetCDF outputs (default: 1).",
+    )
+    args = parser.parse_args()
+    synthesize(
+        Path(args.data).joinpath(args.template),
+        args.output,
+        years=args.years,
+        sizes={dim: int(size) for dim, size in (s.split("=") for s in args.size)},
+        points=args.points,
+        members=args.members,
+        seed=args.seed,
+        block_size=args.block_size * 1024**2,
+        complevel=args.complevel,
+    )
@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+# The tools are scripts, not an installed package
+ROOT = Path(__file__).parents[1]
+sys.path[:0] = [str(ROOT), str(ROOT / "data" / "ERA5")]
+
+# Importing the scripts under data/ must not write bytecode among the registered files
+sys.dont_write_bytecode = True
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from bundle_testdata import Bundle, build_bundle
+from report_check_sums import file_sha256_checksum
+
+
+@pytest.fixture
+def bundle_file(tmp_path):
+    data = tmp_path.joinpath("data")
+    data.joinpath("sub").mkdir(parents=True)
+    xr.Dataset({"tas": ("time", np.arange(10.0))}).to_netcdf(
+        data.joinpath("sub", "tas.nc"), engine="h5netcdf"
+    )
+    data.joinpath("notes.txt").write_bytes(b"some notes\n")
+    with data.joinpath("registry.txt").open("w") as f:
+        for name in ("notes.txt", "sub/tas.nc"):
+            f.write(f"{name} sha256:{file_sha256_checksum(data.joinpath(name))}\n")
+    output = tmp_path.joinpath("test.bundle")
+    build_bundle(data.joinpath("registry.txt"), output)
+    return output
+
+
+def test_open_read_close_member(bundle_file):
+    bundle = Bundle(bundle_file)
+    f = bundle.open("notes.txt")
+    assert f.read() == b"some notes\n"
+    f.close()
+    bundle.close()
+
+
+def test_close_with_open_members(bundle_file):
+    with Bundle(bundle_file) as bundle:
+        f = bundle.open("notes.txt")
+        ds = xr.open_dataset(bundle.open("sub/tas.nc"), engine="h5netcdf").load()
+    np.testing.assert_array_equal(ds.tas, np.arange(10.0))
+    assert f.closed
+    with pytest.raises(ValueError):
+        f.read()
+
+
+def test_close_with_member_view(bundle_file):
+    bundle = Bundle(bundle_file)
+    view = bundle.member("notes.txt")
+    with pytest.raises(BufferError, match="Bundle.member"):
+        bundle.close()
+    view.release()
+    bundle.close()
+
+
+def test_verify(bundle_file):
+    with Bundle(bundle_file) as bundle:
+        assert sorted(bundle.names) == ["notes.txt", "registry.txt", "sub/tas.nc"]
+        assert bundle.verify() == []
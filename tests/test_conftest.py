@@ -0,0 +1,13 @@
+import importlib
+import sys
+
+
+def test_imports_do_not_write_bytecode(tmp_path, monkeypatch):
+    folder = tmp_path.joinpath("data", "ERA5")
+    folder.mkdir(parents=True)
+    folder.joinpath("builder_module.py").write_text("VALUE = 1\n")
+    monkeypatch.syspath_prepend(str(folder))
+
+    assert importlib.import_module("builder_module").VALUE == 1
+    sys.modules.pop("builder_module")
+    assert [p.name for p in folder.iterdir()] == ["builder_module.py"]
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from construct_era5_daily_cancities import Checkpoints, daily_aggregate
+
+
+@pytest.fixture
+def hourly():
+    rng = np.random.default_rng(0)
+    time = pd.date_range("1990-01-01", periods=24 * 4, freq="h")
+    tas = rng.normal(280, 5, (2, time.size))
+    tas[0, 5] = np.nan
+    tas[1, 30:40] = np.nan
+    tas[1, 72:] = np.nan
+    return xr.Dataset(
+        {"tas": (("location", "time"), tas)},
+        coords=dict(time=time, location=["a", "b"]),
+    ).chunk(time=48)
+
+
+@pytest.mark.parametrize("reduction", ["mean", "min", "max", "sum"])
+def test_daily_aggregate_skips_nan(hourly, reduction):
+    daily = daily_aggregate(hourly, {"tas": [reduction]})["tas"][reduction]
+    expected = getattr(hourly.tas.resample(time="D"), reduction)()
+    xr.testing.assert_allclose(daily.compute(), expected.compute())
+    # The last day of "b" has no valid value, and sums to 0 as with resample
+    assert int(daily.notnull().sum()) == (8 if reduction == "sum" else 7)
+
+
+def test_daily_aggregate_boolean_sum(hourly):
+    sunny = (hourly.tas > 280).rename("sunny").to_dataset()
+    daily = daily_aggregate(sunny, {"sunny": ["sum"]})["sunny"]["sum"]
+    expected = sunny.sunny.resample(time="D").sum()
+    np.testing.assert_array_equal(daily, expected)
+
+
+def test_daily_aggregate_first(hourly):
+    daily = daily_aggregate(hourly, {"tas": ["first"]})["tas"]["first"]
+    xr.testing.assert_equal(daily.compute(), hourly.tas[:, ::24].compute())
+
+
+def test_checkpoints_compute_missing_locations_together(hourly, tmp_path):
+    checkpoints = Checkpoints(tmp_path)
+    calls = []
+
+    def get(keys):
+        # As in a run of the builder, the checkpoint is closed before it is replaced
+        with checkpoints.get("extract", "tas", 1990, keys, compute) as ds:
+            return ds.load()
+
+    def compute(locations):
+        calls.append(locations)
+        return hourly.sel(location=locations)
+
+    xr.testing.assert_identical(get({"a": "1", "b": "1"}).tas, hourly.tas.load())
+    # A changed key is recomputed, the other locations are reused, in the requested order
+    ds = get({"b": "2", "a": "1"})
+    assert list(ds.location.values) == ["b", "a"]
+    assert calls == [["a", "b"], ["b"]]
+    assert checkpoints.computed["extract"] == 3
+    assert checkpoints.reused["extract"] == 1
+    assert [p.name for p in tmp_path.rglob("*") if p.is_file()] == ["1990.nc"]
+    # Locations of other runs are kept in the checkpoint
+    get({"a": "1"})
+    get({"b": "2"})
+    assert len(calls) == 2
@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+import xarray as xr
+
+from derive_testdata import derive
+
+README = """## Available datasets
+
+### Files
+
+| File | Size | Checksum |
+| ---- | ---- | -------- |
+| source.nc | 1.0 kiB | sha256:aaa |
+"""
+
+
+def test_derive_updates_registry_and_readme(tmp_path):
+    data = tmp_path.joinpath("data")
+    data.mkdir()
+    xr.Dataset({"tas": ("time", np.arange(10.0))}).to_netcdf(data / "source.nc")
+    registry = data.joinpath("registry.txt")
+    registry.write_text("missing.nc sha256:bbb\nsource.nc sha256:aaa\n")
+    readme = tmp_path.joinpath("README.md")
+    readme.write_text(README, encoding="utf-8")
+    spec = tmp_path.joinpath("derived_testdata.json")
+    spec.write_text(
+        json.dumps({"first.nc": {"source": "source.nc", "isel": {"time": [0]}}})
+    )
+
+    derive(spec, registry, readme=readme)
+    entries = dict(line.split() for line in registry.read_text().splitlines())
+    rows = [line.split(" | ") for line in readme.read_text().splitlines()[-3:]]
+    assert sorted(entries) == [
+        "derived/first.nc",
+        "derived/provenance.json",
+        "missing.nc",
+        "source.nc",
+    ]
+    assert [(row[0][2:], row[2][:-2]) for row in rows] == [
+        ("source.nc", "sha256:aaa"),
+        ("derived/provenance.json", entries["derived/provenance.json"]),
+        ("derived/first.nc", entries["derived/first.nc"]),
+    ]
+
+    spec.write_text("{}")
+    derive(spec, registry, readme=readme)
+    assert "derived/first.nc" not in registry.read_text()
+    assert "derived/first.nc" not in readme.read_text()
+    assert "missing.nc" in registry.read_text()
@@ -0,0 +1,190 @@
+import hashlib
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fetch_testdata
+from fetch_testdata import download, fetch, object_path
+
+CONTENT = bytes(range(256)) * 1024
+FILE_HASH = f"sha256:{hashlib.sha256(CONTENT).hexdigest()}"
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serve `CONTENT` with Range support, misbehaving as set on the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get("Range"))
+        behaviour = server.behaviours.pop(0) if server.behaviours else None
+        if behaviour == "stall":
+            time.sleep(1)
+            return
+        start = 0
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range") or "")
+        if match:
+            start = int(match.group(1))
+            if start >= len(CONTENT):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(CONTENT)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if behaviour == "wrong-range":
+                start = 0
+        body = CONTENT[start:]
+        self.send_response(206 if match else 200)
+        if match:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}"
+            )
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if behaviour == "drop":
+            # Close the connection in the middle of the body
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(fetch_testdata, "TIMEOUT", 0.5)
+    monkeypatch.setattr(fetch_testdata, "RETRY_DELAY", 0)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests, httpd.behaviours = [], []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    # Connections of other tests are kept alive in the pool of this thread
+    fetch_testdata._close_connections()
+    yield httpd
+    fetch_testdata._close_connections()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/file.nc"
+
+
+def _partial(cache):
+    return cache.joinpath("partial", f"sha256-{FILE_HASH.split(':')[1]}")
+
+
+def test_download_and_cache(server, tmp_path):
+    path = download(_url(server), FILE_HASH, tmp_path)
+    assert path == object_path(FILE_HASH, tmp_path)
+    assert path.read_bytes() == CONTENT
+    download(_url(server), FILE_HASH, tmp_path)
+    assert server.requests == [None]
+
+
+def test_resume(server, tmp_path):
+    partial = _partial(tmp_path)
+    partial.parent.mkdir(parents=True)
+    partial.write_bytes(CONTENT[:1000])
+    assert download(_url(server), FILE_HASH, tmp_path).read_bytes() == CONTENT
+    assert server.requests == ["bytes=1000-"]
+    assert not partial.exists()
+
+
+def test_complete_partial(server, tmp_path):
+    partial = _partial(tmp_path)
+    partial.parent.mkdir(parents=True)
+    partial.write_bytes(CONTENT)
+    assert download(_url(server), FILE_HASH, tmp_path).read_bytes() == CONTENT
+    assert server.requests == []
+
+
+def test_range_not_satisfiable(server, tmp_path):
+    partial = _partial(tmp_path)
+    partial.parent.mkdir(parents=True)
+    partial.write_bytes(CONTENT + b"garbage")
+    assert download(_url(server), FILE_HASH, tmp_path).read_bytes() == CONTENT
+    assert server.requests == [f"bytes={len(CONTENT) + 7}-", None]
+
+
+def test_unexpected_content_range(server, tmp_path):
+    server.behaviours = ["wrong-range"]
+    partial = _partial(tmp_path)
+    partial.parent.mkdir(parents=True)
+    partial.write_bytes(CONTENT[:1000])
+    assert download(_url(server), FILE_HASH, tmp_path).read_bytes() == CONTENT
+    assert server.requests == ["bytes=1000-", None]
+
+
+def test_retry_timeout(server, tmp_path):
+    server.behaviours = ["stall"]
+    assert download(_url(server), FILE_HASH, tmp_path).read_bytes() == CONTENT
+    assert server.requests == [None, None]
+
+
+def test_retry_dropped_connection(server, tmp_path):
+    server.behaviours = ["drop"]
+    assert download(_url(server), FILE_HASH, tmp_path).read_bytes() == CONTENT
+    assert server.requests == [None, f"bytes={len(CONTENT) // 2}-"]
+
+
+def test_retries_exhausted(server, tmp_path):
+    server.behaviours = ["stall"] * 3
+    with pytest.raises(TimeoutError):
+        download(_url(server), FILE_HASH, tmp_path, retries=2)
+
+
+def test_checksum_mismatch(server, tmp_path):
+    file_hash = f"sha256:{'0' * 64}"
+    with pytest.raises(OSError, match="does not match"):
+        download(_url(server), file_hash, tmp_path)
+    assert not object_path(file_hash, tmp_path).exists()
+
+
+def _fetch(server, tmp_path, names, **kwargs):
+    registry = tmp_path.joinpath("registry.txt")
+    registry.write_text("".join(f"{name} {FILE_HASH}\n" for name in names))
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/data"
+    return fetch(
+        base_url=base_url,
+        registry=registry,
+        cache_dir=tmp_path / "cache",
+        **kwargs,
+    )
+
+
+def test_fetch_prunes_only_its_own_links(server, tmp_path):
+    view = tmp_path.joinpath("cache", "views", "main")
+    _fetch(server, tmp_path, ["a.nc", "sub/b.nc", "c.nc"])
+    view.joinpath("notes.py").write_text("print('mine')")
+    view.joinpath("c.nc").unlink()
+    view.joinpath("c.nc").write_bytes(b"edited")
+
+    paths = _fetch(server, tmp_path, ["a.nc"])
+    assert paths == {"a.nc": view / "a.nc"}
+    assert view.joinpath("a.nc").read_bytes() == CONTENT
+    # Unregistered links are removed with their empty folders, files replaced or added by hand are kept
+    assert not view.joinpath("sub").exists()
+    assert view.joinpath("notes.py").exists()
+    assert view.joinpath("c.nc").read_bytes() == b"edited"
+
+
+def test_fetch_never_prunes_destination(server, tmp_path):
+    destination = tmp_path.joinpath("xclim-testdata")
+    destination.joinpath("sub").mkdir(parents=True)
+    destination.joinpath("notes.py").write_text("print('mine')")
+    destination.joinpath("sub", "keep.csv").write_text("a,b")
+
+    _fetch(server, tmp_path, ["a.nc", "sub/b.nc"], destination=destination)
+    _fetch(server, tmp_path, ["a.nc"], destination=destination)
+    assert sorted(
+        p.relative_to(destination).as_posix()
+        for p in destination.rglob("*")
+        if p.is_file()
+    ) == ["a.nc", "notes.py", "sub/b.nc", "sub/keep.csv"]
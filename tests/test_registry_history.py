@@ -0,0 +1,99 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from fetch_testdata import _history_registry
+from report_check_sums import (
+    COMMITS_FILE,
+    HISTORY_FILE,
+    build_history,
+    lookup_history,
+    registry_at,
+    resolve_commit,
+)
+
+
+def _git(*args: str) -> str:
+    return subprocess.run(
+        ["git", *args], capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def _commit(registry: dict, message: str) -> str:
+    Path("data").mkdir(exist_ok=True)
+    Path("data/registry.txt").write_text(
+        "".join(f"{name} {file_hash}\n" for name, file_hash in sorted(registry.items()))
+    )
+    Path("notes.txt").write_text(message)
+    _git("add", "-A")
+    _git("commit", "-q", "-m", message)
+    return _git("rev-parse", "HEAD")
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _git("init", "-q")
+    _git("config", "user.name", "test")
+    _git("config", "user.email", "test@example.com")
+    first = {"a.nc": "sha256:1", "b.nc": "sha256:2", "z.nc": "sha256:9"}
+    last = {"a.nc": "sha256:3", "z.nc": "sha256:9"}
+    commits = [
+        _commit(first, "first"),
+        # The registry is unchanged, this commit is an alias of the first
+        _commit(first, "second"),
+        _commit(last, "third"),
+    ]
+    _git("tag", "-a", "v1", "-m", "release", commits[0])
+    _git("tag", "light", commits[2])
+    assert build_history("data/registry.txt") == (3, 2)
+    return commits, first, last
+
+
+def test_registry_at_commits_and_tags(history):
+    commits, first, last = history
+    assert registry_at("data", commits[0]) == first
+    assert registry_at("data", commits[1]) == first
+    assert resolve_commit("data", commits[1]) == commits[0]
+    assert registry_at("data", commits[2][:7]) == last
+    assert registry_at("data", "v1") == first
+    assert registry_at("data", "light") == last
+
+
+def test_lookup_missing_path(history):
+    commits, _, _ = history
+    assert lookup_history("data", commits[0], "b.nc") == "sha256:2"
+    assert lookup_history("data", commits[2], "b.nc") is None
+    assert lookup_history("data", commits[2], "c.nc") is None
+
+
+def test_lookup_every_line(history):
+    # The first and last lines of the sorted file are the edge cases of the binary search
+    lines = Path("data", HISTORY_FILE).read_text().splitlines()
+    for line in lines:
+        commit, name, file_hash = line.split()
+        assert lookup_history("data", commit, name) == file_hash
+    commit = lines[-1].split()[0]
+    assert lookup_history("data", commit, "0.nc") is None
+    assert lookup_history("data", commit, "zz.nc") is None
+
+
+def test_resolve_unknown_and_ambiguous(tmp_path):
+    tmp_path.joinpath(COMMITS_FILE).write_text(
+        "abcd1111 1111\nabcd2222 2222\nabce3333 2222\nabce4444 2222\nffff0000 0000\n"
+    )
+    with pytest.raises(KeyError, match="ambiguous"):
+        resolve_commit(tmp_path, "abcd")
+    # Several prefixed keys resolving to the same commit are not ambiguous
+    assert resolve_commit(tmp_path, "abce") == "2222"
+    assert resolve_commit(tmp_path, "abcd1111") == "1111"
+    assert resolve_commit(tmp_path, "ffff0000") == "0000"
+    for ref in ["abc", "0000", "fffff", "abcd3"]:
+        with pytest.raises(KeyError, match="not"):
+            resolve_commit(tmp_path, ref)
+
+
+def test_fetch_history_registry(history, tmp_path):
+    _, first, _ = history
+    assert _history_registry("data", "v1", tmp_path / "cache") == first
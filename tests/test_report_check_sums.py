@@ -0,0 +1,141 @@
+import hashlib
+import os
+from pathlib import Path
+
+import pytest
+
+from report_check_sums import (
+    block_manifest,
+    main,
+    merkle_root,
+    update_readme,
+    update_registry,
+    valid,
+    verify,
+    verify_blocks,
+)
+
+README = """# Data
+
+## Available datasets
+
+### Files
+
+| File | Size | Checksum |
+| ---- | ---- | -------- |
+| b/missing.nc | 1.0 kiB | sha256:bbb |
+| a/old.nc | 3 B | sha256:old |
+"""
+
+
+def test_update_readme_keeps_missing_files(tmp_path):
+    readme = tmp_path.joinpath("README.md")
+    readme.write_text(README, encoding="utf-8")
+    data = tmp_path.joinpath("data")
+    for name, content in [("a/old.nc", b"1234"), ("a/new.nc", b"12"), ("c.nc", b"")]:
+        data.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+        data.joinpath(name).write_bytes(content)
+
+    update_readme(
+        {"a/old.nc": "sha256:111", "a/new.nc": "sha256:222", "c.nc": None},
+        readme,
+        data,
+    )
+    assert readme.read_text(encoding="utf-8").splitlines()[-4:] == [
+        "| ---- | ---- | -------- |",
+        "| b/missing.nc | 1.0 kiB | sha256:bbb |",
+        "| a/old.nc | 4.0 B | sha256:111 |",
+        "| a/new.nc | 2.0 B | sha256:222 |",
+    ]
+
+
+def test_update_registry_keeps_missing_files(tmp_path):
+    registry = tmp_path.joinpath("registry.txt")
+    registry.write_text("a/old.nc sha256:old\nb/missing.nc sha256:bbb\n")
+    update_registry({"a/old.nc": "sha256:111", "a/new.nc": "sha256:222"}, registry)
+    assert registry.read_text().splitlines() == [
+        "a/new.nc sha256:222",
+        "a/old.nc sha256:111",
+        "b/missing.nc sha256:bbb",
+    ]
+
+
+def test_valid_skips_bytecode(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    names = [
+        "data/ERA5/daily.nc",
+        "data/ERA5/builder.py",
+        "data/ERA5/__pycache__/builder.cpython-311.pyc",
+        "data/ERA5/__pycache__/other",
+        "data/ERA5/stray.pyc",
+    ]
+    for name in names:
+        Path(name).parent.mkdir(parents=True, exist_ok=True)
+        Path(name).write_bytes(b"")
+    assert [name for name in names if valid(Path(name))] == ["data/ERA5/daily.nc"]
+
+
+def test_merkle_root_promotes_odd_node():
+    leaves = [hashlib.sha256(bytes([i])).hexdigest() for i in range(3)]
+    pair = hashlib.sha256(bytes.fromhex(leaves[0]) + bytes.fromhex(leaves[1]))
+    expected = hashlib.sha256(pair.digest() + bytes.fromhex(leaves[2])).hexdigest()
+    assert merkle_root(leaves) == expected
+    assert merkle_root(leaves[:1]) == leaves[0]
+    assert merkle_root([]) == hashlib.sha256(b"").hexdigest()
+
+
+def test_verify_blocks(tmp_path):
+    file = tmp_path.joinpath("file.nc")
+    file.write_bytes(bytes(range(40)))
+    manifest = block_manifest(file, block_size=8)
+    assert len(manifest["blocks"]) == 5
+    assert verify_blocks(file, manifest) == []
+
+    with file.open("r+b") as f:
+        f.seek(17)
+        f.write(b"\xff")
+    assert verify_blocks(file, manifest) == [2]
+
+    file.write_bytes(bytes(range(20)))
+    assert verify_blocks(file, manifest) == [2, 3, 4]
+    file.unlink()
+    assert verify_blocks(file, manifest) == [0, 1, 2, 3, 4]
+
+
+@pytest.fixture
+def data_tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path("README.md").write_text("# Data\n\n## Available datasets\n")
+    for name, content in [("a/x.nc", b"x" * 100), ("b/y.nc", b"y" * 50)]:
+        Path("data", name).parent.mkdir(parents=True, exist_ok=True)
+        Path("data", name).write_bytes(content)
+    main()
+    return Path("data")
+
+
+def _hashed(capsys) -> str:
+    return capsys.readouterr().out.splitlines()[0]
+
+
+def test_verify_with_and_without_cache(data_tree, capsys):
+    capsys.readouterr()
+    assert verify(use_cache=True) and verify(use_cache=False)
+    assert "(0 hashed, 2 from cache)" in _hashed(capsys)
+
+
+@pytest.mark.parametrize("change", ["size", "mtime"])
+def test_cache_invalidated_by_stat_change(data_tree, capsys, change):
+    file = data_tree.joinpath("a", "x.nc")
+    stat = file.stat()
+    if change == "size":
+        file.write_bytes(b"x" * 101)
+    else:
+        # Same size, new contents, written in place
+        with file.open("r+b") as f:
+            f.write(b"z")
+        os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    capsys.readouterr()
+    assert not verify(use_cache=True)
+    assert "(1 hashed, 1 from cache)" in _hashed(capsys)
+    assert not verify(use_cache=False)
+    assert "Checksum mismatch: a/x.nc" in capsys.readouterr().out
@@ -0,0 +1,28 @@
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from synthesize_testdata import synthesize
+
+
+def test_members_share_fill_value(tmp_path):
+    time = pd.date_range("2000-01-01", periods=60, freq="D")
+    template = tmp_path.joinpath("template.nc")
+    xr.Dataset(
+        {
+            "tas": (
+                ("time", "location"),
+                np.random.default_rng(0).normal(280, 5, (60, 2)),
+            )
+        },
+        coords=dict(time=time, location=["a", "b"]),
+    ).to_netcdf(template)
+
+    paths = synthesize(template, tmp_path / "out.nc", members=2)
+    assert len(paths) == 2
+    fills = []
+    for path in paths:
+        with netCDF4.Dataset(path) as nc:
+            fills.append(nc.variables["tas"].getncattr("_FillValue"))
+    assert np.isnan(fills).all()